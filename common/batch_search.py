@@ -0,0 +1,103 @@
+import sys
+import json
+import time
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+# Запросов в одной задаче для процесса: внутри задачи леммы и списки
+# страниц читаются один раз, между задачами процессы не простаивают
+CHUNK_SIZE = 64
+
+
+def read_queries(path):
+    """Запросы из файла по строке на запрос ('-' - из stdin). Строка может
+    быть JSON-объектом с полем query, как в журнале запросов"""
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    queries = []
+    try:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                try:
+                    line = json.loads(line)['query']
+                except (ValueError, KeyError):
+                    pass
+            queries.append(line)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return queries
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+# ---------- процессы пакетного поиска ----------
+
+worker_engine = None
+
+
+def init_worker(engine_class, options):
+    global worker_engine
+    # Сообщения о загрузке индекса - в stderr, stdout занят результатами
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        worker_engine = engine_class(**options)
+        worker_engine.load_index()
+    finally:
+        sys.stdout = stdout
+
+
+def search_chunk(queries, search_options):
+    return worker_engine.search_many(queries, **search_options)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run_batch(engine, queries, output, workers=1, options=None, search_options=None):
+    """Выполняет запросы через engine.search_many и пишет результаты в output
+    (по JSON-объекту на строку, в порядке запросов). При workers > 1 запросы
+    делятся на части между процессами, в каждом загружается свой
+    type(engine)(**options) - индекс открывается через mmap, так что это дешево"""
+    search_options = search_options or {}
+    start = time.perf_counter()
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(workers, initializer=init_worker,
+                                       initargs=(type(engine), options or {}))
+        with executor:
+            parts = executor.map(search_chunk, chunks(queries, CHUNK_SIZE), repeat(search_options))
+            records = write_records(parts, output)
+    else:
+        parts = (engine.search_many(part, **search_options) for part in chunks(queries, CHUNK_SIZE))
+        records = write_records(parts, output)
+
+    elapsed = time.perf_counter() - start
+    latencies = [record['latency_ms'] for record in records]
+    print(f"Запросов: {len(records)} за {elapsed:.2f} с "
+          f"({len(records) / elapsed if elapsed else 0:.0f} в секунду), "
+          f"задержка p50 {percentile(latencies, 0.5):.2f} мс, "
+          f"p95 {percentile(latencies, 0.95):.2f} мс, "
+          f"max {max(latencies, default=0):.2f} мс", file=sys.stderr)
+    return records
+
+
+def write_records(parts, output):
+    """Пишет части результатов по мере готовности; возвращает краткие
+    записи (без результатов) для статистики"""
+    summary = []
+    for records in parts:
+        for record in records:
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+            summary.append({'query': record['query'], 'latency_ms': record['latency_ms']})
+        output.flush()
+    return summary
@@ -0,0 +1,530 @@
+import json
+from bisect import bisect_left
+from functools import cached_property
+
+import numpy as np
+
+from common.sections import SectionFile, write_sections, array_bytes
+from common.roaring import RoaringBitmap
+from common.postings import encode_postings, decode_postings
+from common.varbyte import encode_varbyte, read_varbyte
+from common.bm25 import bm25_impacts, K1, B
+from common.topk import block_maxima
+from common.weights import tf_values, idf_values
+from common.term_dict import (sorted_terms, term_dictionary_sections, TermDictionary,
+                              front_coded_sections, FrontCodedDictionary,
+                              kgram_sections, KGramIndex, expand_pattern, MAX_EXPANSIONS)
+
+BOOLEAN_MAGIC = b'IRBOOL\0\0'
+VECTOR_MAGIC = b'IRVECT\0\0'
+# Версия 4 булева индекса: списки страниц - сжатые битовые карты,
+# для каждой леммы - позиции в документах, словарь с общими префиксами
+# и n-граммы для шаблонов
+BOOLEAN_VERSION = 4
+# Версия 4 векторного индекса: tf без idf в обратном индексе и частоты в
+# прямом, idf терминов и нормы документов по документным частотам сборки,
+# квантованные вклады BM25, верхние границы вкладов терминов и блоков для
+# отбора top-k с отсечением
+VECTOR_VERSION = 4
+
+
+class LazyJson:
+    """Секция с JSON, которая разбирается при первом обращении"""
+
+    def __init__(self, data):
+        self.data = data
+        self.value = None
+
+    def get(self):
+        if self.value is None:
+            self.value = json.loads(bytes(self.data).decode('utf-8'))
+        return self.value
+
+
+def int_keys(mapping):
+    return {int(k): v for k, v in mapping.items()}
+
+
+# ---------- булев индекс ----------
+
+def encode_term_positions(doc_positions):
+    """Позиции леммы: число документов, для каждого документа разность номера
+    с предыдущим и размер блока, затем блоки позиций (как списки страниц -
+    разностями переменной длины). Блок нужного документа читается без
+    распаковки остальных"""
+    header = [len(doc_positions)]
+    blocks = []
+    last = 0
+    for doc_id in sorted(doc_positions):
+        block = encode_postings(doc_positions[doc_id])
+        header.extend((doc_id - last, len(block)))
+        blocks.append(block)
+        last = doc_id
+    return encode_varbyte(header) + b''.join(blocks)
+
+
+def write_boolean_index(path, inverted_index, doc_ids, id_to_file, id_to_title,
+                        positions=None):
+    """Булев индекс: словарь лемм (common/term_dict.py), списки страниц в виде
+    битовых карт (common/roaring.py), позиции лемм в документах и таблица документов"""
+    terms = sorted_terms(inverted_index)
+    postings = [RoaringBitmap(inverted_index[term]).to_bytes() for term in terms]
+    offsets = [0]
+    for data in postings:
+        offsets.append(offsets[-1] + len(data))
+
+    positions = positions or {}
+    term_positions = [encode_term_positions(positions.get(term, {})) for term in terms]
+    position_offsets = [0]
+    for data in term_positions:
+        position_offsets.append(position_offsets[-1] + len(data))
+
+    meta = {'doc_ids': doc_ids, 'id_to_file': id_to_file, 'id_to_title': id_to_title,
+            'has_positions': bool(positions)}
+    sections = front_coded_sections(terms)
+    sections.update(kgram_sections(terms))
+    sections.update({
+        'postings': b''.join(postings),
+        'posting_offsets': array_bytes(offsets, 'Q'),
+        'positions': b''.join(term_positions),
+        'position_offsets': array_bytes(position_offsets, 'Q'),
+        'documents': array_bytes(sorted(id_to_file), 'I'),
+        'all_docs': RoaringBitmap(id_to_file).to_bytes(),
+        'meta': json.dumps(meta, ensure_ascii=False).encode('utf-8'),
+    })
+    write_sections(path, BOOLEAN_MAGIC, BOOLEAN_VERSION, sections)
+
+
+class TermPositions:
+    """Позиции леммы по документам: заголовок с документами разбирается при
+    первом обращении, блок позиций распаковывается только для нужного документа"""
+
+    def __init__(self, data):
+        self.data = data
+        self.blocks = None
+
+    def load(self):
+        self.blocks = {}
+        if not len(self.data):
+            return
+        count, offset = read_varbyte(self.data, 0)
+        header = []
+        doc_id = 0
+        for _ in range(count):
+            gap, offset = read_varbyte(self.data, offset)
+            size, offset = read_varbyte(self.data, offset)
+            doc_id += gap
+            header.append((doc_id, size))
+        for doc_id, size in header:
+            self.blocks[doc_id] = (offset, offset + size)
+            offset += size
+
+    def get(self, doc_id):
+        """Отсортированные номера слов леммы в документе"""
+        if self.blocks is None:
+            self.load()
+        block = self.blocks.get(doc_id)
+        if block is None:
+            return ()
+        return decode_postings(self.data[block[0]:block[1]])
+
+    def items(self):
+        if self.blocks is None:
+            self.load()
+        for doc_id in self.blocks:
+            yield doc_id, self.get(doc_id)
+
+
+class BooleanIndexFile:
+    """Булев индекс из mmap: открытие не зависит от размера индекса,
+    битовые карты разбираются только для лемм из запроса"""
+
+    def __init__(self, path):
+        self.file = SectionFile(path, BOOLEAN_MAGIC, BOOLEAN_VERSION)
+        self.terms = FrontCodedDictionary(self.file.section('terms'),
+                                          self.file.array('term_blocks', 'Q'),
+                                          self.file.array('term_count', 'Q')[0])
+        self.kgrams = KGramIndex(TermDictionary(self.file.section('kgrams'),
+                                                self.file.array('kgrams_offsets', 'Q')),
+                                 self.file.section('kgram_postings'),
+                                 self.file.array('kgram_offsets', 'Q'))
+        self.postings = self.file.section('postings')
+        self.offsets = self.file.array('posting_offsets', 'Q')
+        self.position_data = self.file.section('positions')
+        self.position_offsets = self.file.array('position_offsets', 'Q')
+        self.documents = self.file.array('documents', 'I')
+        self.meta = LazyJson(self.file.section('meta'))
+
+    def get(self, lemma, default=None):
+        term_id = self.terms.find(lemma)
+        if term_id is None:
+            return default
+        return RoaringBitmap.from_bytes(self.postings[self.offsets[term_id]:self.offsets[term_id + 1]])
+
+    def term_positions(self, term_id):
+        return TermPositions(self.position_data[self.position_offsets[term_id]:
+                                                self.position_offsets[term_id + 1]])
+
+    def positions(self, lemma):
+        """Позиции леммы по документам (TermPositions) или None"""
+        term_id = self.terms.find(lemma)
+        if term_id is None:
+            return None
+        return self.term_positions(term_id)
+
+    def expand(self, pattern, limit=MAX_EXPANSIONS):
+        """Леммы, подходящие под шаблон с * (петер*, *град, мон*рх)"""
+        return expand_pattern(self.terms, self.kgrams, pattern, limit)
+
+    @cached_property
+    def has_positions(self):
+        return self.meta.get().get('has_positions', False)
+
+    def __contains__(self, lemma):
+        return lemma in self.terms
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def items(self):
+        for term_id, lemma in enumerate(self.terms):
+            yield lemma, RoaringBitmap.from_bytes(
+                self.postings[self.offsets[term_id]:self.offsets[term_id + 1]])
+
+    def positions_items(self):
+        for term_id, lemma in enumerate(self.terms):
+            yield lemma, self.term_positions(term_id)
+
+    def all_docs(self):
+        """Все страницы - для NOT (хранятся готовой битовой картой)"""
+        return RoaringBitmap.from_bytes(self.file.section('all_docs'))
+
+    @cached_property
+    def doc_ids(self):
+        return self.meta.get()['doc_ids']
+
+    @cached_property
+    def id_to_file(self):
+        return int_keys(self.meta.get()['id_to_file'])
+
+    @cached_property
+    def id_to_title(self):
+        return int_keys(self.meta.get()['id_to_title'])
+
+    def close(self):
+        self.file.close()
+
+
+# ---------- векторный индекс ----------
+
+def write_vector_index(path, doc_counts, doc_lengths, doc_titles, doc_files,
+                       k1=K1, b=B, tf='relative', idf='smooth'):
+    """Векторный индекс: словарь терминов, для каждого термина - документы
+    и tf (обратный индекс), для каждого документа - термины и частоты
+    (прямой). Строки документов хранятся без idf: частоты терминов doc_counts
+    (doc_id -> {термин: частота}), длины документов doc_lengths и tf по
+    формуле tf. idf терминов (формула idf по числу документов с термином),
+    нормы векторов tf-idf, границы для отсечения и квантованные вклады BM25
+    (common/bm25.py) с параметрами k1 и b считаются при записи по текущим
+    документным частотам - операциями NumPy над всеми парами сразу"""
+    terms = sorted_terms({term for counts in doc_counts.values() for term in counts})
+    term_to_id = {term: i for i, term in enumerate(terms)}
+
+    term_postings = [[] for _ in terms]
+    documents = sorted(doc_counts)
+    doc_offsets = [0]
+    doc_terms = []
+    doc_term_counts = []
+    for doc_id in documents:
+        entries = sorted((term_to_id[term], count) for term, count in doc_counts[doc_id].items())
+        for term_id, count in entries:
+            term_postings[term_id].append((doc_id, count))
+            doc_terms.append(term_id)
+            doc_term_counts.append(count)
+        doc_offsets.append(len(doc_terms))
+
+    posting_offsets = [0]
+    posting_docs = []
+    posting_counts = []
+    for postings in term_postings:
+        for doc_id, count in postings:
+            posting_docs.append(doc_id)
+            posting_counts.append(count)
+        posting_offsets.append(len(posting_docs))
+
+    lengths = np.array([doc_lengths.get(doc_id, 0) for doc_id in documents], dtype=np.int64)
+    rows = np.searchsorted(np.asarray(documents, dtype=np.int64),
+                           np.asarray(posting_docs, dtype=np.int64))
+    posting_lengths = lengths[rows]
+    df = np.diff(np.asarray(posting_offsets, dtype=np.int64))
+    posting_df = np.repeat(df, df)
+
+    # Вклады BM25 считаются заранее: поиск только складывает их для
+    # терминов запроса, без норм и деления
+    avg_length = float(lengths.sum()) / len(lengths) if len(lengths) else 0.0
+    impacts, scale = bm25_impacts(posting_counts, posting_lengths, posting_df,
+                                  len(documents), avg_length, k1, b)
+
+    # tf хранится без idf, idf умножается при оценке документа. Нормы
+    # векторов tf-idf зависят от документных частот и пересчитываются при
+    # каждой записи индекса
+    posting_tf = tf_values(posting_counts, posting_lengths, tf)
+    term_idf = idf_values(df, len(documents), idf)
+    squares = (posting_tf * np.repeat(term_idf, df)) ** 2
+    norms = np.sqrt(np.bincount(rows, weights=squares, minlength=len(documents)))
+
+    # Верхние границы вклада для отсечения (common/topk.py): для косинуса -
+    # tf, деленный на норму документа (idf и вес термина в запросе - общие
+    # множители списка), для BM25 - вклад; по терминам и по блокам их списков
+    posting_norms = norms[rows]
+    cosines = np.divide(posting_tf, posting_norms, out=np.zeros(len(posting_tf)),
+                        where=posting_norms != 0)
+    term_blocks, block_last, (block_cosine, block_impact) = block_maxima(
+        posting_offsets, posting_docs, (cosines, impacts))
+    first_blocks = term_blocks[:-1]
+    term_cosine = np.maximum.reduceat(block_cosine, first_blocks) if len(block_cosine) else block_cosine
+    term_impact = np.maximum.reduceat(block_impact, first_blocks) if len(block_impact) else block_impact
+
+    meta = {'doc_titles': {str(k): v for k, v in doc_titles.items()},
+            'doc_files': {str(k): v for k, v in doc_files.items()},
+            'weights': {'tf': tf, 'idf': idf},
+            'bm25': {'k1': k1, 'b': b, 'scale': scale, 'avg_length': avg_length}}
+    sections = term_dictionary_sections(terms)
+    sections.update({
+        'term_idf': np.asarray(term_idf, dtype='<f8').tobytes(),
+        'posting_offsets': array_bytes(posting_offsets, 'Q'),
+        'posting_docs': array_bytes(posting_docs, 'I'),
+        'posting_tf': np.asarray(posting_tf, dtype='<f8').tobytes(),
+        'posting_impacts': impacts.tobytes(),
+        'term_max_cosine': np.asarray(term_cosine, dtype='<f8').tobytes(),
+        'term_max_impact': np.asarray(term_impact, dtype='<u2').tobytes(),
+        'term_blocks': np.asarray(term_blocks, dtype='<u8').tobytes(),
+        'block_last_doc': np.asarray(block_last, dtype='<u4').tobytes(),
+        'block_max_cosine': np.asarray(block_cosine, dtype='<f8').tobytes(),
+        'block_max_impact': np.asarray(block_impact, dtype='<u2').tobytes(),
+        'documents': array_bytes(documents, 'I'),
+        'doc_norms': np.asarray(norms, dtype='<f8').tobytes(),
+        'doc_lengths': np.asarray(lengths, dtype='<u4').tobytes(),
+        'doc_offsets': array_bytes(doc_offsets, 'Q'),
+        'doc_terms': array_bytes(doc_terms, 'I'),
+        'doc_counts': array_bytes(doc_term_counts, 'I'),
+        'meta': json.dumps(meta, ensure_ascii=False).encode('utf-8'),
+    })
+    write_sections(path, VECTOR_MAGIC, VECTOR_VERSION, sections)
+
+
+class DocVector:
+    """Вектор документа из прямого индекса: термин -> вес tf-idf без построения словаря"""
+
+    def __init__(self, index, terms, weights):
+        self.index = index
+        self.terms = terms
+        self.weights = weights
+
+    def position(self, term):
+        term_id = self.index.terms.find(term)
+        if term_id is None:
+            return None
+        i = bisect_left(self.terms, term_id)
+        if i < len(self.terms) and self.terms[i] == term_id:
+            return i
+        return None
+
+    def __contains__(self, term):
+        return self.position(term) is not None
+
+    def __getitem__(self, term):
+        i = self.position(term)
+        if i is None:
+            raise KeyError(term)
+        return self.weights[i]
+
+    def get(self, term, default=None):
+        i = self.position(term)
+        return default if i is None else self.weights[i]
+
+    def __len__(self):
+        return len(self.terms)
+
+    def items(self):
+        for term_id, weight in zip(self.terms, self.weights):
+            yield self.index.terms[term_id], weight
+
+
+class DocTable:
+    """Отображение doc_id -> значение по отсортированному массиву документов"""
+
+    def __init__(self, documents, values):
+        self.documents = documents
+        self.values = values
+
+    def index_of(self, doc_id):
+        i = bisect_left(self.documents, doc_id)
+        if i < len(self.documents) and self.documents[i] == doc_id:
+            return i
+        return None
+
+    def value(self, i):
+        return self.values[i]
+
+    def __getitem__(self, doc_id):
+        i = self.index_of(doc_id)
+        if i is None:
+            raise KeyError(doc_id)
+        return self.value(i)
+
+    def get(self, doc_id, default=None):
+        i = self.index_of(doc_id)
+        return default if i is None else self.value(i)
+
+    def __contains__(self, doc_id):
+        return self.index_of(doc_id) is not None
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __iter__(self):
+        return iter(self.documents)
+
+    def keys(self):
+        return iter(self.documents)
+
+
+class DocVectors(DocTable):
+    """doc_id -> DocVector: веса считаются по частотам прямого индекса, длине
+    документа и idf терминов этой сборки индекса"""
+
+    def __init__(self, index):
+        super().__init__(index.documents, None)
+        self.index = index
+
+    def value(self, i):
+        start, end = self.index.doc_offsets[i], self.index.doc_offsets[i + 1]
+        terms = self.index.doc_terms[start:end]
+        weights = tf_values(self.index.doc_term_counts[start:end], self.index.lengths[i],
+                            self.index.weights['tf'])
+        return DocVector(self.index, terms,
+                         (weights * np.asarray(self.index.term_idf)[terms]).tolist())
+
+
+class TermDocs:
+    """термин -> документы, где он встречается (из обратного индекса)"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def get(self, term, default=None):
+        term_id = self.index.terms.find(term)
+        if term_id is None:
+            return default
+        return self.index.posting_docs[self.index.posting_offsets[term_id]:
+                                       self.index.posting_offsets[term_id + 1]]
+
+    def __contains__(self, term):
+        return term in self.index.terms
+
+    def __len__(self):
+        return len(self.index.terms)
+
+
+class TermPostings(TermDocs):
+    """термин -> (документы, tf без idf) из обратного индекса (представления секций)"""
+
+    def get(self, term, default=None):
+        term_id = self.index.terms.find(term)
+        if term_id is None:
+            return default
+        start, end = self.index.posting_offsets[term_id], self.index.posting_offsets[term_id + 1]
+        return self.index.posting_docs[start:end], self.index.posting_tf[start:end]
+
+
+class VectorIndexFile:
+    """Векторный индекс из mmap: векторы документов, нормы и списки документов
+    терминов читаются из секций при обращении. В списках хранится tf без
+    idf, idf термина (idf()) умножается при оценке"""
+
+    def __init__(self, path):
+        self.file = SectionFile(path, VECTOR_MAGIC, VECTOR_VERSION)
+        self.terms = TermDictionary(self.file.section('terms'),
+                                    self.file.array('term_offsets', 'Q'))
+        self.term_idf = self.file.array('term_idf', 'd')
+        self.posting_offsets = self.file.array('posting_offsets', 'Q')
+        self.posting_docs = self.file.array('posting_docs', 'I')
+        self.posting_tf = self.file.array('posting_tf', 'd')
+        self.posting_impacts = self.file.array('posting_impacts', 'H')
+        self.term_max_cosine = self.file.array('term_max_cosine', 'd')
+        self.term_max_impact = self.file.array('term_max_impact', 'H')
+        self.term_blocks = self.file.array('term_blocks', 'Q')
+        self.block_last_doc = self.file.array('block_last_doc', 'I')
+        self.block_max_cosine = self.file.array('block_max_cosine', 'd')
+        self.block_max_impact = self.file.array('block_max_impact', 'H')
+        self.documents = self.file.array('documents', 'I')
+        self.norms = self.file.array('doc_norms', 'd')
+        self.lengths = self.file.array('doc_lengths', 'I')
+        self.doc_offsets = self.file.array('doc_offsets', 'Q')
+        self.doc_terms = self.file.array('doc_terms', 'I')
+        self.doc_term_counts = self.file.array('doc_counts', 'I')
+        self.meta = LazyJson(self.file.section('meta'))
+
+        self.doc_vectors = DocVectors(self)
+        self.doc_norms = DocTable(self.documents, self.norms)
+        self.doc_lengths = DocTable(self.documents, self.lengths)
+        self.term_to_docs = TermDocs(self)
+        self.term_postings = TermPostings(self)
+
+    @cached_property
+    def doc_titles(self):
+        return int_keys(self.meta.get()['doc_titles'])
+
+    @cached_property
+    def doc_files(self):
+        return int_keys(self.meta.get()['doc_files'])
+
+    @cached_property
+    def weights(self):
+        """Формулы tf и idf, по которым посчитаны tf в списках и idf терминов"""
+        return self.meta.get()['weights']
+
+    @cached_property
+    def bm25(self):
+        """Параметры BM25, с которыми посчитаны вклады, и шаг квантования"""
+        return self.meta.get()['bm25']
+
+    def idf(self, term):
+        """idf термина по документным частотам этой сборки индекса (0 - термина нет)"""
+        term_id = self.terms.find(term)
+        return 0.0 if term_id is None else self.term_idf[term_id]
+
+    def term_impacts(self, term):
+        """Документы термина и квантованные вклады BM25 (представления секций)"""
+        term_id = self.terms.find(term)
+        if term_id is None:
+            return self.posting_docs[:0], self.posting_impacts[:0]
+        start, end = self.posting_offsets[term_id], self.posting_offsets[term_id + 1]
+        return self.posting_docs[start:end], self.posting_impacts[start:end]
+
+    def term_bounds(self, term):
+        """Наибольший вклад термина и его блоков: (наибольший tf / норма,
+        наибольший вклад BM25, последние документы блоков, то же по блокам)"""
+        term_id = self.terms.find(term)
+        if term_id is None:
+            return 0.0, 0, self.block_last_doc[:0], self.block_max_cosine[:0], self.block_max_impact[:0]
+        start, end = self.term_blocks[term_id], self.term_blocks[term_id + 1]
+        return (self.term_max_cosine[term_id], self.term_max_impact[term_id],
+                self.block_last_doc[start:end], self.block_max_cosine[start:end],
+                self.block_max_impact[start:end])
+
+    def counts(self):
+        """Частоты терминов всех документов в виде словарей (для обновления индекса)"""
+        counts = {}
+        for i, doc_id in enumerate(self.documents):
+            start, end = self.doc_offsets[i], self.doc_offsets[i + 1]
+            counts[doc_id] = {self.terms[term_id]: count for term_id, count in
+                              zip(self.doc_terms[start:end], self.doc_term_counts[start:end])}
+        return counts
+
+    def close(self):
+        self.file.close()
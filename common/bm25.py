@@ -0,0 +1,37 @@
+import numpy as np
+
+# Параметры BM25 по умолчанию: насыщение частоты и нормализация по длине документа
+K1 = 1.2
+B = 0.75
+# Вклады квантуются в 16 бит: 1..IMPACT_LEVELS пропорционально вкладу. В 8
+# битах у частых терминов (idf около нуля) все вклады сливаются в 1 и
+# порядок документов по ним теряется
+IMPACT_LEVELS = 65535
+
+
+def bm25_idf(df, total_docs):
+    """idf BM25 в неотрицательном варианте: log(1 + (N - df + 0.5) / (df + 0.5))"""
+    df = np.asarray(df, dtype=np.float64)
+    return np.log1p((total_docs - df + 0.5) / (df + 0.5))
+
+
+def bm25_impacts(counts, lengths, df, total_docs, avg_length, k1=K1, b=B):
+    """Вклады BM25 пар (термин, документ) по частоте термина в документе,
+    длине документа и документной частоте термина (массивы по парам),
+    avg_length - средняя длина документа корпуса.
+    Возвращает квантованные вклады (uint16) и шаг квантования: оценка
+    документа - сумма вкладов терминов запроса, умноженная на шаг"""
+    counts = np.asarray(counts, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.float64)
+    norm = 1 - b + (b * lengths / avg_length if avg_length else 0.0)
+    impacts = bm25_idf(df, total_docs) * counts * (k1 + 1) / (counts + k1 * norm)
+
+    top = impacts.max() if len(impacts) else 0.0
+    if top <= 0:
+        return np.zeros(len(impacts), dtype='<u2'), 0.0
+    scale = top / IMPACT_LEVELS
+    # Пара с частотой больше нуля получает хотя бы 1: документ с термином
+    # запроса не должен выпадать из результатов из-за округления
+    quantized = np.clip(np.rint(impacts / scale), 1, IMPACT_LEVELS)
+    quantized[counts <= 0] = 0
+    return quantized.astype('<u2'), float(scale)
@@ -0,0 +1,195 @@
+import os
+import re
+from html.parser import HTMLParser
+
+# Элементы без текста, которые пропускаются целиком
+SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'math'}
+
+# Элементы без закрывающего тега
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+             'meta', 'param', 'source', 'track', 'wbr'}
+
+# Основной текст статьи Википедии
+WIKI_CONTENT_ID = 'mw-content-text'
+
+# Служебные блоки Википедии внутри статьи: навигация, сноски, оглавление, правка
+WIKI_SKIP_CLASSES = {'navbox', 'navbox-styles', 'vertical-navbox', 'sidebar', 'metadata',
+                     'ambox', 'reflist', 'references', 'reference', 'mw-references-wrap',
+                     'mw-editsection', 'toc', 'catlinks', 'printfooter', 'noprint',
+                     'mw-empty-elt', 'hatnote', 'dablink'}
+WIKI_SKIP_IDS = {'toc', 'catlinks', 'mw-navigation', 'footer'}
+
+
+def clean_title(title):
+    """Убирает суффикс "- Википедия" из названия страницы"""
+    return re.sub(r'[-–—]\s*Википедия.*$', '', title).strip()
+
+
+def normalize_text(text):
+    """Очищает текст от лишних пробелов и переносов"""
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return ' '.join(chunk for chunk in chunks if chunk)
+
+
+def load_titles(titles_file):
+    """Читает названия страниц, сохраненные hw2: page_001 -> название"""
+    titles = {}
+    if titles_file and os.path.exists(titles_file):
+        with open(titles_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t', 1)
+                if len(parts) == 2:
+                    titles[parts[0]] = parts[1]
+    return titles
+
+
+def is_wiki_chrome(element_id, classes):
+    """Элемент - служебный блок Википедии (по id или классу)"""
+    if element_id in WIKI_SKIP_IDS:
+        return True
+    return any(cls in WIKI_SKIP_CLASSES for cls in classes)
+
+
+class Bs4Extractor:
+    """Извлечение через BeautifulSoup (полное дерево разбора)"""
+
+    def __init__(self, wiki=False):
+        self.wiki = wiki
+
+    def extract(self, html_content):
+        """Возвращает (название страницы, текст)"""
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html_content, 'html.parser')
+        title = clean_title(soup.title.get_text()) if soup.title else None
+
+        # Удаляем скрипты, стили и другие ненужные элементы
+        for script in soup(['script', 'style', 'meta', 'link']):
+            script.decompose()
+
+        root = soup
+        if self.wiki:
+            content = soup.find(id=WIKI_CONTENT_ID)
+            if content is not None:
+                chrome = content.find_all(lambda tag: is_wiki_chrome(tag.get('id'),
+                                                                     tag.get('class') or []))
+                for element in chrome:
+                    # Вложенные блоки уже удалены вместе с родителем
+                    if not element.decomposed:
+                        element.decompose()
+                root = content
+
+        text = root.get_text()
+        if self.wiki and root is not soup and title:
+            text = title + '\n' + text
+        return title, normalize_text(text)
+
+
+class StreamingExtractor(HTMLParser):
+    """Потоковое извлечение на html.parser без построения дерева:
+    текст собирается прямо в обработчиках событий парсера"""
+
+    def __init__(self, wiki=False):
+        super().__init__(convert_charrefs=True)
+        self.wiki = wiki
+
+    def extract(self, html_content):
+        """Возвращает (название страницы, текст)"""
+        self.reset()
+        self.chunks = []
+        self.title_chunks = []
+        self.in_title = False
+        # Пропускаемый элемент: (тег, глубина вложенности одноименных тегов)
+        self.skip_tag = None
+        self.skip_depth = 0
+        # В режиме Википедии текст берется только внутри блока статьи
+        self.content_depth = 0 if self.wiki else None
+        self.content_found = False
+
+        self.feed(html_content)
+        self.close()
+
+        title = clean_title(''.join(self.title_chunks)) if self.title_chunks else None
+        text = ''.join(self.chunks)
+        if self.wiki and not self.content_found:
+            # Не страница Википедии: повторяем разбор без фильтрации
+            return StreamingExtractor(wiki=False).extract(html_content)
+        if self.wiki and title:
+            text = title + '\n' + text
+        return title, normalize_text(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            return
+
+        if self.skip_tag is not None:
+            if tag == self.skip_tag:
+                self.skip_depth += 1
+            return
+
+        if tag == 'title':
+            self.in_title = True
+
+        if self.wiki:
+            if self.content_depth == 0:
+                if tag == 'div' and dict(attrs).get('id') == WIKI_CONTENT_ID:
+                    self.content_depth = 1
+                    self.content_found = True
+                return
+            if tag == 'div':
+                self.content_depth += 1
+            attrs = dict(attrs)
+            if is_wiki_chrome(attrs.get('id'), (attrs.get('class') or '').split()):
+                self.start_skip(tag)
+                return
+
+        if tag in SKIP_TAGS:
+            self.start_skip(tag)
+
+    def start_skip(self, tag):
+        self.skip_tag = tag
+        self.skip_depth = 1
+
+    def handle_endtag(self, tag):
+        if self.skip_tag is not None:
+            if tag == self.skip_tag:
+                self.skip_depth -= 1
+                if self.skip_depth == 0:
+                    self.skip_tag = None
+                    if self.wiki and tag == 'div':
+                        self.content_depth -= 1
+            return
+
+        if tag == 'title':
+            self.in_title = False
+        if self.wiki and self.content_depth and tag == 'div':
+            self.content_depth -= 1
+
+    def handle_startendtag(self, tag, attrs):
+        pass
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title_chunks.append(data)
+            if not self.wiki:
+                self.chunks.append(data)
+            return
+        if self.skip_tag is not None:
+            return
+        if self.wiki and not self.content_depth:
+            return
+        self.chunks.append(data)
+
+
+EXTRACTORS = {
+    'bs4': Bs4Extractor,
+    'fast': StreamingExtractor,
+}
+
+
+def get_extractor(backend='bs4', wiki=False):
+    """Извлекатель текста: backend - 'bs4' или 'fast', wiki - только текст статьи"""
+    if backend not in EXTRACTORS:
+        raise ValueError(f"Неизвестный способ извлечения текста: {backend}")
+    return EXTRACTORS[backend](wiki=wiki)
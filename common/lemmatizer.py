@@ -0,0 +1,67 @@
+import os
+from functools import lru_cache
+
+import pymorphy3
+
+
+class Lemmatizer:
+    """Лемматизатор с кэшем: словарь слово -> лемма, построенный при индексации
+    (hw2/lemma_dictionary.txt), и ограниченный LRU-кэш для остальных слов.
+    MorphAnalyzer создается только при первом слове, которого нет в словаре.
+    record_new - запоминать разобранные слова для записи в словарь (при его
+    построении в hw2); в поиске слова запросов держит только LRU-кэш"""
+
+    def __init__(self, dictionary_file=None, cache_size=100000, record_new=False):
+        self.dictionary_file = dictionary_file
+        self.dictionary = {}
+        self.record_new = record_new
+        self.new_entries = {}  # слова, разобранные pymorphy3 после загрузки словаря
+        self.morph = None
+        self.morph_calls = 0
+
+        self.cached_lemma = lru_cache(maxsize=cache_size)(self.parse)
+
+        if dictionary_file and os.path.exists(dictionary_file):
+            self.load(dictionary_file)
+
+    def load(self, dictionary_file):
+        with open(dictionary_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2:
+                    self.dictionary[parts[0]] = parts[1]
+
+    def parse(self, word):
+        if self.morph is None:
+            self.morph = pymorphy3.MorphAnalyzer()
+        self.morph_calls += 1
+        lemma = self.morph.parse(word)[0].normal_form
+        if self.record_new:
+            self.new_entries[word] = lemma
+        return lemma
+
+    def lemmatize(self, word):
+        """Нормальная форма слова (слово должно быть в нижнем регистре)"""
+        lemma = self.dictionary.get(word)
+        if lemma is None:
+            lemma = self.cached_lemma(word)
+        return lemma
+
+    def take_new_entries(self):
+        """Возвращает и очищает накопленные новые пары слово -> лемма"""
+        entries = self.new_entries
+        self.new_entries = {}
+        return entries
+
+    def save(self, dictionary_file=None, extra_entries=None):
+        """Дописывает в словарь новые пары (и пары из других процессов)"""
+        dictionary_file = dictionary_file or self.dictionary_file
+        self.dictionary.update(self.take_new_entries())
+        if extra_entries:
+            self.dictionary.update(extra_entries)
+
+        tmp_file = dictionary_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for word, lemma in sorted(self.dictionary.items()):
+                f.write(f"{word} {lemma}\n")
+        os.replace(tmp_file, dictionary_file)
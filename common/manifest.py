@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+
+
+def content_hash(content):
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+def file_stamp(*paths):
+    """Быстрая отметка файлов (размер и время изменения): пока она не изменилась,
+    содержимое не перечитывается и хеш не пересчитывается"""
+    stamps = []
+    for path in paths:
+        if os.path.exists(path):
+            st = os.stat(path)
+            stamps.append(f"{st.st_size}:{st.st_mtime_ns}")
+        else:
+            stamps.append('-')
+    return '|'.join(stamps)
+
+
+def read_files(*paths):
+    """Содержимое нескольких входных файлов документа (для хеша)"""
+    data = b''
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data += f.read()
+        data += b'\0'
+    return data
+
+
+class Manifest:
+    """Манифест этапа обработки: для каждого входного документа - отметка файла,
+    хеш содержимого и версия результатов, в которой документ был обработан.
+
+    Параметры этапа (например, способ извлечения текста) хранятся вместе
+    с манифестом: если они изменились, все документы считаются новыми."""
+
+    def __init__(self, manifest_file, params=None):
+        self.manifest_file = manifest_file
+        self.params = params or {}
+        self.version = 0
+        self.entries = {}  # имя документа -> [отметка, хеш, версия]
+        self.modified = False
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.manifest_file):
+            return False
+
+        with open(self.manifest_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        self.version = data['version']
+        if data.get('params', {}) == self.params:
+            self.entries = data['entries']
+        return True
+
+    def save(self):
+        """Сохраняет манифест (после записи результатов этапа)"""
+        if not self.modified and os.path.exists(self.manifest_file):
+            return
+        self.version += 1
+        for entry in self.entries.values():
+            if entry[2] is None:
+                entry[2] = self.version
+
+        data = {'version': self.version, 'params': self.params, 'entries': self.entries}
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.manifest_file)
+        self.modified = False
+
+    def clear(self):
+        """Полная пересборка: прежние записи не учитываются"""
+        self.entries = {}
+        self.modified = True
+
+    def record(self, name, stamp, digest):
+        """Запоминает обработанный документ (версия назначается при сохранении)"""
+        self.entries[name] = [stamp, digest, None]
+        self.modified = True
+
+    def forget(self, name):
+        if self.entries.pop(name, None) is not None:
+            self.modified = True
+
+    def changes(self, names, stamp, read):
+        """Сравнивает документы с манифестом; возвращает (новые или измененные, удаленные).
+
+        stamp(name) - быстрая отметка документа, read(name) - его содержимое:
+        содержимое читается только для документов с изменившейся отметкой"""
+        changed = []
+        for name in names:
+            current_stamp = stamp(name)
+            entry = self.entries.get(name)
+            if entry is not None and entry[0] == current_stamp:
+                continue
+
+            digest = content_hash(read(name))
+            if entry is not None and entry[1] == digest:
+                # Файл перезаписан тем же содержимым - обрабатывать не нужно
+                entry[0] = current_stamp
+                self.modified = True
+                continue
+
+            self.record(name, current_stamp, digest)
+            changed.append(name)
+
+        present = set(names)
+        removed = sorted(name for name in self.entries if name not in present)
+        for name in removed:
+            self.forget(name)
+        return changed, removed
@@ -0,0 +1,258 @@
+import os
+import re
+import zlib
+import struct
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Заголовок записи: магия, кодек, doc_id, длина URL, длина сжатых данных, crc32
+RECORD_HEADER = struct.Struct('<4sBIIII')
+RECORD_MAGIC = b'PGR1'
+
+CODEC_GZIP = 1
+CODEC_ZSTD = 2
+
+INDEX_FILENAME = 'offsets.idx'
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+def page_name(doc_id):
+    return f"page_{doc_id:03d}"
+
+
+def parse_page_name(name):
+    """Номер страницы из имени файла или пути (page_001.html -> 1)"""
+    match = re.search(r'page_(\d+)', os.path.basename(name))
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def compress(data, codec):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return zlib.compress(data, 6)
+
+
+def decompress(data, codec):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Для чтения записей zstd нужен пакет zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class PageStore:
+    """Хранилище страниц: сжатые записи дописываются в сегментные файлы,
+    offsets.idx хранит смещения записей по doc_id и URL"""
+
+    def __init__(self, store_dir, codec=None, segment_size=SEGMENT_SIZE):
+        self.store_dir = store_dir
+        self.index_path = os.path.join(store_dir, INDEX_FILENAME)
+        self.segment_size = segment_size
+        if codec is None:
+            codec = CODEC_ZSTD if zstandard is not None else CODEC_GZIP
+        self.codec = codec
+
+        self.entries = {}  # doc_id -> (сегмент, смещение, длина записи, url)
+        self.url_to_id = {}
+
+        self.segment_number = 0
+        self.writer = None
+        self.index_writer = None
+        self.readers = {}  # открытые на чтение сегменты
+
+        os.makedirs(store_dir, exist_ok=True)
+        self.load_index()
+
+    @staticmethod
+    def exists(path):
+        return os.path.isfile(os.path.join(path, INDEX_FILENAME))
+
+    def segment_path(self, segment_number):
+        return os.path.join(self.store_dir, f"segment_{segment_number:05d}.seg")
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 5:
+                    # Недописанная строка после аварийной остановки
+                    continue
+                doc_id, segment, offset, length = (int(p) for p in parts[:4])
+                # Повторная запись того же документа заменяет предыдущую
+                self.entries[doc_id] = (segment, offset, length, parts[4])
+                self.url_to_id[parts[4]] = doc_id
+                self.segment_number = max(self.segment_number, segment)
+
+    # ---------- запись ----------
+
+    def open_writer(self):
+        path = self.segment_path(self.segment_number)
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_size:
+            self.segment_number += 1
+            path = self.segment_path(self.segment_number)
+        self.writer = open(path, 'ab')
+        self.index_writer = open(self.index_path, 'a', encoding='utf-8')
+
+    def append(self, doc_id, url, html):
+        """Дописывает страницу в текущий сегмент"""
+        if self.writer is None:
+            self.open_writer()
+        elif self.writer.tell() >= self.segment_size:
+            self.writer.close()
+            self.segment_number += 1
+            self.writer = open(self.segment_path(self.segment_number), 'ab')
+
+        url_bytes = url.encode('utf-8')
+        payload = compress(html.encode('utf-8'), self.codec)
+        header = RECORD_HEADER.pack(RECORD_MAGIC, self.codec, doc_id,
+                                    len(url_bytes), len(payload), zlib.crc32(payload))
+
+        offset = self.writer.tell()
+        self.writer.write(header + url_bytes + payload)
+        self.writer.flush()
+        length = RECORD_HEADER.size + len(url_bytes) + len(payload)
+
+        # Строка индекса пишется после записи, так что индекс никогда
+        # не ссылается на недописанные данные
+        self.index_writer.write(f"{doc_id}\t{self.segment_number}\t{offset}\t{length}\t{url}\n")
+        self.index_writer.flush()
+
+        self.entries[doc_id] = (self.segment_number, offset, length, url)
+        self.url_to_id[url] = doc_id
+
+    def flush(self):
+        """Записывает буферы дописанных записей и строк индекса в файлы и
+        возвращает пути этих файлов: fsync по ним выполняет вызывающий код"""
+        if self.writer is None:
+            return []
+        for f in (self.writer, self.index_writer):
+            f.flush()
+        return [self.writer.name, self.index_writer.name]
+
+    def close(self):
+        for f in self.readers.values():
+            f.close()
+        self.readers = {}
+        if self.writer is not None:
+            self.writer.close()
+            self.index_writer.close()
+            self.writer = None
+            self.index_writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- чтение ----------
+
+    def decode_record(self, data, offset=0):
+        """Разбирает запись; возвращает (doc_id, url, html, длина записи)"""
+        magic, codec, doc_id, url_len, payload_len, crc = RECORD_HEADER.unpack_from(data, offset)
+        if magic != RECORD_MAGIC:
+            raise ValueError(f"Повреждена запись в хранилище страниц (смещение {offset})")
+
+        start = offset + RECORD_HEADER.size
+        url = bytes(data[start:start + url_len]).decode('utf-8')
+        payload = bytes(data[start + url_len:start + url_len + payload_len])
+        if zlib.crc32(payload) != crc:
+            raise ValueError(f"Не совпала контрольная сумма записи doc_id={doc_id}")
+
+        html = decompress(payload, codec).decode('utf-8')
+        return doc_id, url, html, RECORD_HEADER.size + url_len + payload_len
+
+    def get(self, doc_id):
+        """Произвольный доступ: HTML страницы по doc_id"""
+        entry = self.entries.get(doc_id)
+        if entry is None:
+            return None
+
+        segment, offset, length, _ = entry
+        if segment not in self.readers:
+            self.readers[segment] = open(self.segment_path(segment), 'rb')
+        f = self.readers[segment]
+        f.seek(offset)
+        return self.decode_record(f.read(length))[2]
+
+    def get_by_url(self, url):
+        doc_id = self.url_to_id.get(url)
+        if doc_id is None:
+            return None
+        return self.get(doc_id)
+
+    def read(self, name):
+        """HTML страницы по имени вида page_001 / page_001.html"""
+        return self.get(parse_page_name(name))
+
+    def stamp(self, name):
+        """Отметка версии страницы: записи не перезаписываются, поэтому
+        новое содержимое всегда лежит по новому смещению"""
+        entry = self.entries.get(parse_page_name(name))
+        if entry is None:
+            return None
+        segment, offset, length, _ = entry
+        return f"{segment}:{offset}:{length}"
+
+    def doc_ids(self):
+        return sorted(self.entries)
+
+    def names(self):
+        return [page_name(doc_id) for doc_id in self.doc_ids()]
+
+    def scan(self):
+        """Последовательно читает сегменты целиком и отдает актуальные
+        записи: (имя страницы, HTML)"""
+        # Устаревшие версии перезаписанных страниц и недописанные после сбоя
+        # записи в индекс не попадают и при чтении пропускаются
+        by_segment = {}
+        for segment, offset, _, _ in self.entries.values():
+            by_segment.setdefault(segment, []).append(offset)
+
+        for segment in sorted(by_segment):
+            with open(self.segment_path(segment), 'rb') as f:
+                data = memoryview(f.read())
+
+            for offset in sorted(by_segment[segment]):
+                doc_id, _, html, _ = self.decode_record(data, offset)
+                yield page_name(doc_id), html
+
+
+class HtmlDirectory:
+    """Страницы, сохраненные отдельными HTML-файлами (формат hw1/pages)"""
+
+    def __init__(self, pages_dir):
+        self.pages_dir = pages_dir
+
+    def read(self, name):
+        name = os.path.splitext(os.path.basename(name))[0]
+        with open(os.path.join(self.pages_dir, name + '.html'), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def stamp(self, name):
+        name = os.path.splitext(os.path.basename(name))[0]
+        st = os.stat(os.path.join(self.pages_dir, name + '.html'))
+        return f"{st.st_size}:{st.st_mtime_ns}"
+
+    def names(self):
+        files = sorted(f for f in os.listdir(self.pages_dir) if f.endswith('.html'))
+        return [os.path.splitext(f)[0] for f in files]
+
+    def scan(self):
+        for name in self.names():
+            yield name, self.read(name)
+
+
+def open_pages(path):
+    """Источник страниц: хранилище PageStore или папка с HTML-файлами"""
+    if PageStore.exists(path):
+        return PageStore(path)
+    return HtmlDirectory(path)
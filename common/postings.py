@@ -0,0 +1,167 @@
+import heapq
+from array import array
+from bisect import bisect_left
+
+from common.varbyte import encode_varbyte, decode_varbyte
+
+
+def encode_postings(doc_ids):
+    """Сжимает список страниц: число документов, затем разности
+    соседних номеров по возрастанию (переменной длины)"""
+    doc_ids = sorted(doc_ids)
+    gaps = [len(doc_ids)]
+    last = 0
+    for doc_id in doc_ids:
+        gaps.append(doc_id - last)
+        last = doc_id
+    return encode_varbyte(gaps)
+
+
+def decode_postings(data):
+    numbers = decode_varbyte(data)
+    doc_ids = array('I')
+    last = 0
+    for gap in numbers[1:]:
+        last += gap
+        doc_ids.append(last)
+    return doc_ids
+
+
+def result_array(values):
+    """Пустой массив того же типа, что и входной список
+    (array('I') для индекса, array('H') для контейнеров битовых карт)"""
+    if isinstance(values, array):
+        return array(values.typecode)
+    if isinstance(values, memoryview) and values.format in ('H', 'I'):
+        return array(values.format)
+    return array('I')
+
+
+# Во сколько раз один список должен быть длиннее другого, чтобы
+# вместо слияния искать элементы короткого списка галопом по длинному
+GALLOP_RATIO = 8
+
+
+def gallop(doc_ids, target, lo=0):
+    """Первая позиция не раньше lo, где doc_ids[i] >= target: шаг удваивается,
+    пока не перешагнет target, затем двоичный поиск в найденном отрезке"""
+    n = len(doc_ids)
+    step = 1
+    hi = lo
+    while hi < n and doc_ids[hi] < target:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(doc_ids, target, lo, min(hi, n))
+
+
+def intersect_galloping(small, large):
+    """Пересечение за O(len(small) * log(len(large) / len(small)))"""
+    result = result_array(small)
+    j = 0
+    len_large = len(large)
+    for x in small:
+        j = gallop(large, x, j)
+        if j == len_large:
+            break
+        if large[j] == x:
+            result.append(x)
+            j += 1
+    return result
+
+
+def intersect(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    if len(b) >= GALLOP_RATIO * len(a):
+        return intersect_galloping(a, b)
+
+    result = result_array(a)
+    i = j = 0
+    len_a, len_b = len(a), len(b)
+    while i < len_a and j < len_b:
+        x, y = a[i], b[j]
+        if x == y:
+            result.append(x)
+            i += 1
+            j += 1
+        elif x < y:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def union(a, b):
+    result = result_array(a)
+    i = j = 0
+    len_a, len_b = len(a), len(b)
+    while i < len_a and j < len_b:
+        x, y = a[i], b[j]
+        if x == y:
+            result.append(x)
+            i += 1
+            j += 1
+        elif x < y:
+            result.append(x)
+            i += 1
+        else:
+            result.append(y)
+            j += 1
+    result.extend(a[i:])
+    result.extend(b[j:])
+    return result
+
+
+def union_many(lists):
+    """Объединение нескольких списков k-путевым слиянием через кучу"""
+    lists = [doc_ids for doc_ids in lists if len(doc_ids)]
+    if not lists:
+        return array('I')
+    if len(lists) == 1:
+        return lists[0]
+    if len(lists) == 2:
+        return union(lists[0], lists[1])
+
+    result = array('I')
+    last = None
+    for doc_id in heapq.merge(*lists):
+        if doc_id != last:
+            result.append(doc_id)
+            last = doc_id
+    return result
+
+
+def difference(a, b):
+    if len(a) >= GALLOP_RATIO * len(b):
+        # Мало исключаемых: копируем отрезки длинного списка между ними
+        result = result_array(a)
+        i = 0
+        for x in b:
+            j = gallop(a, x, i)
+            result.extend(a[i:j])
+            i = j + 1 if j < len(a) and a[j] == x else j
+        result.extend(a[i:])
+        return result
+
+    if len(b) >= GALLOP_RATIO * len(a):
+        # Короткий список без длинного: ищем его элементы галопом
+        result = result_array(a)
+        j = 0
+        for x in a:
+            j = gallop(b, x, j)
+            if j == len(b) or b[j] != x:
+                result.append(x)
+        return result
+
+    result = result_array(a)
+    i = j = 0
+    len_a, len_b = len(a), len(b)
+    while i < len_a:
+        x = a[i]
+        while j < len_b and b[j] < x:
+            j += 1
+        if j == len_b or b[j] != x:
+            result.append(x)
+        i += 1
+    return result
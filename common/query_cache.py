@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """LRU-кэш результатов поиска с временем жизни записей.
+
+    Каждое обращение передает версию индекса (отметку сборки файла): если
+    индекс перестроен, все записи прежней версии удаляются, так что
+    результаты старого индекса не возвращаются"""
+
+    def __init__(self, max_size=1024, ttl=300.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()  # ключ -> (срок годности, результат)
+        self.version = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def check_version(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def get(self, key, version):
+        """Результат из кэша или None"""
+        self.check_version(version)
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, result = entry
+            if self.ttl is None or expires > self.clock():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return result
+            del self.entries[key]
+            self.evictions += 1
+        self.misses += 1
+        return None
+
+    def put(self, key, version, result):
+        if not self.max_size:
+            return
+        self.check_version(version)
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        self.entries[key] = (expires, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / requests if requests else 0.0,
+        }
@@ -0,0 +1,320 @@
+import sys
+from array import array
+from bisect import bisect_left
+
+from common.postings import intersect, union, difference, union_many
+from common.varbyte import encode_varbyte, read_varbyte
+
+# Номер документа делится на старшие 16 бит (номер контейнера)
+# и младшие 16 бит (значение внутри контейнера)
+CHUNK_BITS = 16
+LOW_MASK = (1 << CHUNK_BITS) - 1
+
+# Сжатая карта: число документов и число контейнеров, затем для каждого
+# контейнера номер и тип (номер * 2 + тип) и размер данных в байтах -
+# все числа переменной длины (большинство лемм встречаются в одной-двух
+# страницах, и заголовок не должен быть длиннее данных)
+ARRAY, BITMAP = 0, 1
+
+# Номера единичных бит для каждого значения байта
+BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+# ---------- контейнеры ----------
+#
+# Редкий контейнер - отсортированный array('H'), плотный - битовая карта
+# в виде целого числа Python: AND, OR и AND NOT над ним выполняются
+# машинными словами внутри интерпретатора, без цикла по документам.
+
+def bits_to_array(bits):
+    """Номера единичных бит битовой карты по возрастанию"""
+    values = array('H')
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for i, byte in enumerate(data):
+        if byte:
+            base = i * 8
+            values.extend(base + bit for bit in BYTE_BITS[byte])
+    return values
+
+
+def array_to_bits(values):
+    if not len(values):
+        return 0
+    data = bytearray((values[-1] >> 3) + 1)
+    for value in values:
+        data[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(data, 'little')
+
+
+def filter_array(values, bits, keep):
+    """Значения массива, бит которых в битовой карте равен keep"""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    size = len(data)
+    return array('H', (value for value in values
+                       if (value >> 3 < size and data[value >> 3] >> (value & 7) & 1) == keep))
+
+
+def cardinality(container):
+    if isinstance(container, int):
+        return container.bit_count()
+    return len(container)
+
+
+def optimize(container):
+    """Представление, которое занимает меньше места: массив (16 бит на номер)
+    или битовая карта до старшего номера. Пустой контейнер - None"""
+    if isinstance(container, int):
+        if not container:
+            return None
+        if container.bit_count() * CHUNK_BITS < container.bit_length():
+            return bits_to_array(container)
+        return container
+
+    if not len(container):
+        return None
+    if len(container) * CHUNK_BITS >= container[-1] + 1:
+        return array_to_bits(container)
+    if not isinstance(container, array) or container.typecode != 'H':
+        container = array('H', container)
+    return container
+
+
+def container_and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return optimize(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return optimize(filter_array(a, b, True))
+    return optimize(intersect(a, b))
+
+
+def container_or(a, b):
+    if isinstance(a, int) or isinstance(b, int):
+        if not isinstance(a, int):
+            a = array_to_bits(a)
+        if not isinstance(b, int):
+            b = array_to_bits(b)
+        return optimize(a | b)
+    return optimize(union(a, b))
+
+
+def container_andnot(a, b):
+    if isinstance(a, int):
+        if not isinstance(b, int):
+            b = array_to_bits(b)
+        return optimize(a & ~b)
+    if isinstance(b, int):
+        return optimize(filter_array(a, b, False))
+    return optimize(difference(a, b))
+
+
+def container_values(container):
+    if isinstance(container, int):
+        return bits_to_array(container)
+    return container
+
+
+def container_to_bytes(container):
+    if isinstance(container, int):
+        return BITMAP, container.to_bytes((container.bit_length() + 7) // 8, 'little')
+    values = array('H', container)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return ARRAY, values.tobytes()
+
+
+def container_from_bytes(kind, data):
+    if kind == BITMAP:
+        return int.from_bytes(data, 'little')
+    values = array('H')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+# ---------- битовая карта ----------
+
+class RoaringBitmap:
+    """Множество номеров документов из контейнеров по 65536 номеров
+    (в стиле Roaring): редкие части - массивы, плотные - битовые карты.
+
+    Может создаваться из сжатых данных индекса: контейнеры разбираются
+    при первом обращении, число документов читается из заголовка"""
+
+    __slots__ = ('_keys', '_containers', '_data')
+
+    def __init__(self, doc_ids=(), data=None):
+        self._data = data
+        self._keys = None
+        self._containers = None
+        if data is None:
+            self._keys, self._containers = self.split(sorted(doc_ids))
+
+    @staticmethod
+    def split(doc_ids):
+        """Отсортированные номера -> (номера контейнеров, контейнеры)"""
+        keys = []
+        containers = []
+        current = None
+        values = None
+        for doc_id in doc_ids:
+            key = doc_id >> CHUNK_BITS
+            if key != current:
+                if values is not None:
+                    keys.append(current)
+                    containers.append(optimize(values))
+                current = key
+                values = array('H')
+            values.append(doc_id & LOW_MASK)
+        if values is not None:
+            keys.append(current)
+            containers.append(optimize(values))
+        return keys, containers
+
+    @classmethod
+    def from_sorted(cls, doc_ids):
+        bitmap = cls()
+        bitmap._keys, bitmap._containers = cls.split(doc_ids)
+        return bitmap
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data=data)
+
+    @classmethod
+    def from_containers(cls, keys, containers):
+        bitmap = cls()
+        bitmap._keys = keys
+        bitmap._containers = containers
+        return bitmap
+
+    def load(self):
+        data = self._data
+        _, offset = read_varbyte(data, 0)
+        n_containers, offset = read_varbyte(data, offset)
+        keys = []
+        containers = []
+        for _ in range(n_containers):
+            key_kind, offset = read_varbyte(data, offset)
+            size, offset = read_varbyte(data, offset)
+            key, kind = key_kind >> 1, key_kind & 1
+            keys.append(key)
+            containers.append(container_from_bytes(kind, data[offset:offset + size]))
+            offset += size
+        self._keys = keys
+        self._containers = containers
+        self._data = None
+
+    @property
+    def keys(self):
+        if self._keys is None:
+            self.load()
+        return self._keys
+
+    @property
+    def containers(self):
+        if self._containers is None:
+            self.load()
+        return self._containers
+
+    def to_bytes(self):
+        if self._data is not None:
+            return self._data
+        parts = [encode_varbyte((len(self), len(self._keys)))]
+        for key, container in zip(self._keys, self._containers):
+            kind, data = container_to_bytes(container)
+            parts.append(encode_varbyte((key << 1 | kind, len(data))))
+            parts.append(data)
+        return b''.join(parts)
+
+    def __len__(self):
+        if self._data is not None:
+            return read_varbyte(self._data, 0)[0]
+        return sum(cardinality(container) for container in self._containers)
+
+    def __iter__(self):
+        for key, container in zip(self.keys, self.containers):
+            base = key << CHUNK_BITS
+            for value in container_values(container):
+                yield base + value
+
+    def __contains__(self, doc_id):
+        keys = self.keys
+        i = bisect_left(keys, doc_id >> CHUNK_BITS)
+        if i == len(keys) or keys[i] != doc_id >> CHUNK_BITS:
+            return False
+        container = self.containers[i]
+        value = doc_id & LOW_MASK
+        if isinstance(container, int):
+            return bool(container >> value & 1)
+        j = bisect_left(container, value)
+        return j < len(container) and container[j] == value
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"RoaringBitmap({list(self)})"
+
+    def merge(self, other, operation, keep_left, keep_right):
+        """Слияние по номерам контейнеров: operation - для общих контейнеров,
+        keep_left/keep_right - оставлять ли контейнеры только одной стороны"""
+        keys, containers = [], []
+        left_keys, left = self.keys, self.containers
+        right_keys, right = other.keys, other.containers
+        i = j = 0
+        while i < len(left_keys) or j < len(right_keys):
+            if j == len(right_keys) or (i < len(left_keys) and left_keys[i] < right_keys[j]):
+                if keep_left:
+                    keys.append(left_keys[i])
+                    containers.append(left[i])
+                i += 1
+            elif i == len(left_keys) or right_keys[j] < left_keys[i]:
+                if keep_right:
+                    keys.append(right_keys[j])
+                    containers.append(right[j])
+                j += 1
+            else:
+                container = operation(left[i], right[j])
+                if container is not None:
+                    keys.append(left_keys[i])
+                    containers.append(container)
+                i += 1
+                j += 1
+        return RoaringBitmap.from_containers(keys, containers)
+
+    def __and__(self, other):
+        return self.merge(other, container_and, False, False)
+
+    def __or__(self, other):
+        return self.merge(other, container_or, True, True)
+
+    def __sub__(self, other):
+        return self.merge(other, container_andnot, True, False)
+
+    @staticmethod
+    def union_many(bitmaps):
+        """Объединение нескольких карт: контейнеры с одним номером объединяются
+        сразу все - битовым OR или k-путевым слиянием массивов"""
+        groups = {}
+        for bitmap in bitmaps:
+            for key, container in zip(bitmap.keys, bitmap.containers):
+                groups.setdefault(key, []).append(container)
+
+        keys, containers = [], []
+        for key in sorted(groups):
+            group = groups[key]
+            if len(group) == 1:
+                container = group[0]
+            elif any(isinstance(c, int) for c in group):
+                bits = 0
+                for c in group:
+                    bits |= c if isinstance(c, int) else array_to_bits(c)
+                container = optimize(bits)
+            else:
+                container = optimize(union_many(group))
+            keys.append(key)
+            containers.append(container)
+        return RoaringBitmap.from_containers(keys, containers)
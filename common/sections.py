@@ -0,0 +1,111 @@
+import os
+import sys
+import mmap
+import struct
+from array import array
+
+# Заголовок файла: магия, версия формата, число секций;
+# затем таблица секций: имя, смещение, длина
+FILE_HEADER = struct.Struct('<8sII')
+SECTION_ENTRY = struct.Struct('<16sQQ')
+ALIGNMENT = 8
+
+
+def array_bytes(values, code):
+    """Числа в порядке байтов little-endian (как их читает SectionFile)"""
+    data = array(code, values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def write_sections(path, magic, version, sections):
+    """Записывает файл из именованных секций (name -> bytes), каждая секция
+    выровнена по 8 байт, чтобы массивы читались из mmap без копирования.
+
+    В секцию build_id пишется случайная отметка сборки: по ней читатели
+    (например, кэш результатов поиска) узнают, что файл перестроен"""
+    sections = dict(sections, build_id=os.urandom(16))
+    table_size = FILE_HEADER.size + SECTION_ENTRY.size * len(sections)
+    offset = table_size + (-table_size) % ALIGNMENT
+
+    entries = []
+    for name, data in sections.items():
+        entries.append(SECTION_ENTRY.pack(name.encode('ascii'), offset, len(data)))
+        offset += len(data) + (-len(data)) % ALIGNMENT
+
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(FILE_HEADER.pack(magic, version, len(sections)))
+        f.write(b''.join(entries))
+        f.write(b'\0' * ((-table_size) % ALIGNMENT))
+        for data in sections.values():
+            f.write(data)
+            f.write(b'\0' * ((-len(data)) % ALIGNMENT))
+    os.replace(tmp_file, path)
+
+
+class SectionFile:
+    """Файл с секциями, открытый через mmap: секции - представления memoryview,
+    страницы файла разделяются процессами через кэш ОС"""
+
+    def __init__(self, path, magic, version):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.mmap)
+        self.views = []
+
+        file_magic, file_version, count = FILE_HEADER.unpack_from(self.buffer, 0)
+        if file_magic != magic:
+            raise ValueError(f"{path}: неизвестный формат файла")
+        if file_version != version:
+            raise ValueError(f"{path}: версия формата {file_version}, ожидается {version}")
+
+        self.sections = {}
+        for i in range(count):
+            name, offset, length = SECTION_ENTRY.unpack_from(
+                self.buffer, FILE_HEADER.size + i * SECTION_ENTRY.size)
+            self.sections[name.rstrip(b'\0').decode('ascii')] = (offset, length)
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    @property
+    def build_id(self):
+        """Отметка сборки файла (None у файлов, записанных до ее появления)"""
+        if 'build_id' not in self.sections:
+            return None
+        offset, length = self.sections['build_id']
+        return self.buffer[offset:offset + length].hex()
+
+    def section(self, name):
+        offset, length = self.sections[name]
+        view = self.buffer[offset:offset + length]
+        self.views.append(view)
+        return view
+
+    def array(self, name, code):
+        """Секция как массив чисел (без копирования на little-endian машинах)"""
+        data = self.section(name)
+        if sys.byteorder == 'big':
+            values = array(code, bytes(data))
+            values.byteswap()
+            return values
+        view = data.cast(code)
+        self.views.append(view)
+        return view
+
+    def close(self):
+        # Представления нужно освободить до закрытия mmap
+        for view in reversed(self.views):
+            view.release()
+        self.views = []
+        self.buffer.release()
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,289 @@
+import re
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+
+from common.sections import array_bytes
+from common.postings import encode_postings, decode_postings, intersect
+from common.varbyte import encode_varbyte, read_varbyte
+
+# Терминов в блоке словаря с общими префиксами: первый термин блока
+# хранится целиком, остальные - длиной общего с предыдущим префикса и суффиксом
+BLOCK_SIZE = 16
+# Длина n-грамм для поиска по шаблону с * в середине или в начале
+KGRAM = 3
+# Сколько терминов подставляется вместо одного шаблона
+MAX_EXPANSIONS = 256
+
+
+def sorted_terms(terms):
+    return sorted(terms, key=lambda term: term.encode('utf-8'))
+
+
+# ---------- простой словарь (массив смещений) ----------
+
+def term_dictionary_sections(terms, name='terms', offsets_name='term_offsets'):
+    """Секции словаря: термины по порядку байтов UTF-8 и их смещения"""
+    encoded = [term.encode('utf-8') for term in terms]
+    offsets = [0]
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    return {name: b''.join(encoded), offsets_name: array_bytes(offsets, 'Q')}
+
+
+class TermDictionary:
+    """Отсортированный словарь из mmap: поиск номера термина двоичным
+    поиском по байтам, строки декодируются только при обращении"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+        self.find = lru_cache(maxsize=4096)(self.lookup)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def term_bytes(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+    def __getitem__(self, i):
+        return self.term_bytes(i).decode('utf-8')
+
+    def lookup(self, term):
+        """Номер термина или None"""
+        key = term.encode('utf-8')
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.term_bytes(lo) == key:
+            return lo
+        return None
+
+    def __contains__(self, term):
+        return self.find(term) is not None
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+# ---------- словарь с общими префиксами (front coding) ----------
+
+def shared_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def front_coded_sections(terms):
+    """Секции словаря блоками по BLOCK_SIZE терминов: в отсортированном
+    словаре соседние леммы обычно начинаются одинаково, поэтому общий
+    префикс не повторяется. Терминов должно быть передано в порядке sorted_terms"""
+    blocks = bytearray()
+    block_offsets = []
+    previous = b''
+    for i, term in enumerate(terms):
+        data = term.encode('utf-8')
+        if i % BLOCK_SIZE == 0:
+            block_offsets.append(len(blocks))
+            blocks += encode_varbyte((len(data),)) + data
+        else:
+            shared = shared_prefix(previous, data)
+            blocks += encode_varbyte((shared, len(data) - shared)) + data[shared:]
+        previous = data
+    block_offsets.append(len(blocks))
+    return {
+        'terms': bytes(blocks),
+        'term_blocks': array_bytes(block_offsets, 'Q'),
+        'term_count': array_bytes([len(terms)], 'Q'),
+    }
+
+
+class FrontCodedDictionary:
+    """Словарь из секций front_coded_sections (через mmap): двоичный поиск
+    по первым терминам блоков, затем просмотр одного блока"""
+
+    def __init__(self, blob, block_offsets, count):
+        self.blob = blob
+        self.block_offsets = block_offsets
+        self.count = count
+        self.find = lru_cache(maxsize=4096)(self.lookup)
+
+    def __len__(self):
+        return self.count
+
+    def first_term(self, block):
+        size, offset = read_varbyte(self.blob, self.block_offsets[block])
+        return bytes(self.blob[offset:offset + size])
+
+    def block_terms(self, block):
+        """Термины блока (в байтах) по порядку"""
+        offset = self.block_offsets[block]
+        end = self.block_offsets[block + 1]
+        size, offset = read_varbyte(self.blob, offset)
+        term = bytes(self.blob[offset:offset + size])
+        offset += size
+        terms = [term]
+        while offset < end:
+            shared, offset = read_varbyte(self.blob, offset)
+            size, offset = read_varbyte(self.blob, offset)
+            term = term[:shared] + bytes(self.blob[offset:offset + size])
+            offset += size
+            terms.append(term)
+        return terms
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self.block_terms(i // BLOCK_SIZE)[i % BLOCK_SIZE].decode('utf-8')
+
+    def rank(self, key):
+        """Число терминов, меньших key (байты UTF-8)"""
+        lo, hi = 0, len(self.block_offsets) - 1
+        # Последний блок, первый термин которого не больше key
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.first_term(mid) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        block = lo - 1
+        if block < 0:
+            return 0
+        terms = self.block_terms(block)
+        return block * BLOCK_SIZE + bisect_left(terms, key)
+
+    def lookup(self, term):
+        """Номер термина или None"""
+        key = term.encode('utf-8')
+        i = self.rank(key)
+        if i < self.count:
+            block = self.block_terms(i // BLOCK_SIZE)
+            if block[i % BLOCK_SIZE] == key:
+                return i
+        return None
+
+    def __contains__(self, term):
+        return self.find(term) is not None
+
+    def prefix_range(self, prefix):
+        """Номера терминов [lo, hi), которые начинаются с prefix.
+        В UTF-8 нет байта 0xFF, поэтому prefix + 0xFF больше любого продолжения"""
+        key = prefix.encode('utf-8')
+        return self.rank(key), self.rank(key + b'\xff')
+
+    def terms_in_range(self, lo, hi):
+        """(номер, термин) для номеров из [lo, hi) - блоки распаковываются подряд"""
+        block = lo // BLOCK_SIZE
+        i = block * BLOCK_SIZE
+        while i < hi:
+            for data in self.block_terms(block):
+                if lo <= i < hi:
+                    yield i, data.decode('utf-8')
+                i += 1
+            block += 1
+
+    def __iter__(self):
+        return (term for _, term in self.terms_in_range(0, self.count))
+
+
+# ---------- n-граммы для шаблонов ----------
+
+def term_kgrams(term):
+    """n-граммы термина с границами: "$петр$" -> $пе, пет, етр, тр$"""
+    marked = f"${term}$"
+    return {marked[i:i + KGRAM] for i in range(len(marked) - KGRAM + 1)}
+
+
+def kgram_sections(terms):
+    """Для каждой n-граммы - отсортированные номера терминов, где она есть
+    (терминов должно быть передано в порядке sorted_terms)"""
+    index = {}
+    for term_id, term in enumerate(terms):
+        for gram in term_kgrams(term):
+            index.setdefault(gram, array('I')).append(term_id)
+
+    grams = sorted_terms(index)
+    postings = [encode_postings(index[gram]) for gram in grams]
+    offsets = [0]
+    for data in postings:
+        offsets.append(offsets[-1] + len(data))
+    sections = term_dictionary_sections(grams, 'kgrams', 'kgrams_offsets')
+    sections.update({
+        'kgram_postings': b''.join(postings),
+        'kgram_offsets': array_bytes(offsets, 'Q'),
+    })
+    return sections
+
+
+class KGramIndex:
+    """n-грамма -> номера терминов (из секций kgram_sections)"""
+
+    def __init__(self, grams, postings, offsets):
+        self.grams = grams
+        self.postings = postings
+        self.offsets = offsets
+
+    def term_ids(self, gram):
+        gram_id = self.grams.find(gram)
+        if gram_id is None:
+            return array('I')
+        return decode_postings(self.postings[self.offsets[gram_id]:self.offsets[gram_id + 1]])
+
+
+def pattern_kgrams(pattern):
+    """n-граммы, которые обязательно есть в подходящем под шаблон термине"""
+    grams = set()
+    for segment in f"${pattern}$".split('*'):
+        for i in range(len(segment) - KGRAM + 1):
+            grams.add(segment[i:i + KGRAM])
+    return grams
+
+
+def pattern_regex(pattern):
+    return re.compile('.*'.join(re.escape(part) for part in pattern.split('*')) + r'\Z')
+
+
+def expand_pattern(dictionary, kgram_index, pattern, limit=MAX_EXPANSIONS):
+    """Термины словаря, подходящие под шаблон с * (не больше limit).
+
+    Часть до первой * сужает диапазон номеров в отсортированном словаре,
+    n-граммы остальных частей - множество кандидатов; кандидаты проверяются
+    регулярным выражением (n-граммы могут совпасть в другом порядке)"""
+    head = pattern.split('*', 1)[0]
+    lo, hi = dictionary.prefix_range(head)
+    if lo == hi:
+        return []
+
+    if pattern == head + '*':
+        # Только префикс: все термины диапазона подходят
+        return [term for _, term in dictionary.terms_in_range(lo, min(hi, lo + limit))]
+
+    regex = pattern_regex(pattern)
+    grams = pattern_kgrams(pattern)
+    if not grams:
+        # Слишком короткие части шаблона - просматриваем диапазон префикса
+        candidates = dictionary.terms_in_range(lo, hi)
+    else:
+        lists = sorted((kgram_index.term_ids(gram) for gram in grams), key=len)
+        term_ids = lists[0]
+        for other in lists[1:]:
+            if not term_ids:
+                break
+            term_ids = intersect(term_ids, other)
+        start = bisect_left(term_ids, lo)
+        end = bisect_left(term_ids, hi)
+        candidates = ((term_id, dictionary[term_id]) for term_id in term_ids[start:end])
+
+    expansions = []
+    for _, term in candidates:
+        if regex.match(term):
+            expansions.append(term)
+            if len(expansions) >= limit:
+                break
+    return expansions
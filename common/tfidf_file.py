@@ -0,0 +1,263 @@
+import json
+from functools import cached_property
+
+import numpy as np
+
+from common.sections import SectionFile, write_sections
+from common.term_dict import sorted_terms, term_dictionary_sections, TermDictionary
+from common.binary_index import int_keys
+from common.weights import tf_values, idf_values
+
+TFIDF_MAGIC = b'IRTFIDF\0'
+TFIDF_VERSION = 3
+# Веса считаются отдельно для терминов и для лемм
+KINDS = ('terms', 'lemmas')
+
+
+class DocumentFrequencies:
+    """Документные частоты терминов словаря (по номерам терминов) и число
+    документов. Документ добавляется и удаляется номерами своих терминов -
+    меняются только их счетчики, замена документа - удаление прежней строки
+    и добавление новой. idf по счетчикам считается при чтении весов"""
+
+    def __init__(self, size, df=None, total_docs=0):
+        self.df = np.zeros(size, dtype=np.int64) if df is None else np.array(df, dtype=np.int64)
+        self.total_docs = total_docs
+
+    def add(self, term_ids, docs=1):
+        """term_ids - номера терминов docs документов (в документе без повторов)"""
+        np.add.at(self.df, term_ids, 1)
+        self.total_docs += docs
+
+    def remove(self, term_ids, docs=1):
+        np.subtract.at(self.df, term_ids, 1)
+        self.total_docs -= docs
+
+    def idf(self, formula='smooth'):
+        return idf_values(self.df, self.total_docs, formula)
+
+
+class TfIdfColumns:
+    """Частоты одного вида (термины или леммы) по столбцам: словарь,
+    документные частоты, длины документов и строки документов в формате
+    CSR - границы строк (indptr), номера терминов и частоты в документе.
+    documents - номера документов по строкам. Веса не хранятся: tf и idf
+    считаются по формулам tf и idf при чтении строки, так что смена формул
+    и изменение документных частот не требуют пересчета строк"""
+
+    def __init__(self, terms, frequencies, documents, lengths, indptr, indices, counts,
+                 tf='relative', idf='smooth'):
+        self.terms = terms
+        self.frequencies = frequencies
+        self.documents = documents
+        self.lengths = lengths
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+        self.tf_formula = tf
+        self.idf_formula = idf
+
+    @classmethod
+    def from_matrix(cls, matrix, tf='relative', idf='smooth'):
+        """Столбцы из TfIdfMatrix (common/tfidf_matrix.py)"""
+        counts = matrix.counts
+        frequencies = DocumentFrequencies(len(matrix.terms), matrix.df, len(matrix.doc_ids))
+        return cls(matrix.terms, frequencies, np.array(matrix.doc_ids, dtype=np.int64),
+                   matrix.lengths, counts.indptr, counts.indices, counts.data, tf, idf)
+
+    @cached_property
+    def idf(self):
+        return self.frequencies.idf(self.idf_formula)
+
+    @cached_property
+    def rows(self):
+        return {doc_id: row for row, doc_id in enumerate(self.documents.tolist())}
+
+    @cached_property
+    def vocabulary(self):
+        """Все термины словаря строками (декодируются один раз)"""
+        return list(self.terms)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.rows
+
+    def row(self, doc_id):
+        """Номера терминов и частоты документа (представления массивов, без копирования)"""
+        row = self.rows.get(doc_id)
+        if row is None:
+            return self.indices[:0], self.counts[:0]
+        start, end = int(self.indptr[row]), int(self.indptr[row + 1])
+        return self.indices[start:end], self.counts[start:end]
+
+    def length(self, doc_id):
+        """Число слов документа"""
+        row = self.rows.get(doc_id)
+        return int(self.lengths[row]) if row is not None else 0
+
+    def weights(self, doc_id):
+        """Номера терминов и веса tf-idf документа"""
+        ids, counts = self.row(doc_id)
+        return ids, tf_values(counts, self.length(doc_id), self.tf_formula) * self.idf[ids]
+
+    def term_counts(self, doc_id):
+        """Частоты документа: термин -> число вхождений"""
+        ids, counts = self.row(doc_id)
+        vocabulary = self.vocabulary
+        return dict(zip([vocabulary[i] for i in ids.tolist()], counts.tolist()))
+
+    def vector(self, doc_id):
+        """Вектор документа: термин -> tf-idf"""
+        ids, weights = self.weights(doc_id)
+        vocabulary = self.vocabulary
+        return dict(zip([vocabulary[i] for i in ids.tolist()], weights.tolist()))
+
+    def items(self, doc_id):
+        """(термин, idf, tf-idf) документа"""
+        ids, weights = self.weights(doc_id)
+        vocabulary = self.vocabulary
+        return list(zip([vocabulary[i] for i in ids.tolist()],
+                        self.idf[ids].tolist(), weights.tolist()))
+
+    def row_bytes(self, doc_id):
+        """Содержимое строки документа для хеша в манифесте: термины,
+        частоты и число слов, без idf - изменение документных частот другими
+        документами строку не меняет"""
+        ids, counts = self.row(doc_id)
+        vocabulary = self.vocabulary
+        terms = ' '.join(vocabulary[i] for i in ids.tolist())
+        return (terms.encode('utf-8') + counts.astype('<u4').tobytes()
+                + self.length(doc_id).to_bytes(4, 'little'))
+
+    def sections(self, kind):
+        """Секции файла: словарь (по порядку байтов UTF-8), документные
+        частоты, длины документов, границы строк, номера терминов и частоты"""
+        sections = term_dictionary_sections(self.terms, kind + '_vocab', kind + '_vocab_off')
+        sections.update({
+            kind + '_df': np.asarray(self.frequencies.df, dtype='<u4').tobytes(),
+            kind + '_lengths': np.asarray(self.lengths, dtype='<u4').tobytes(),
+            kind + '_rows': np.asarray(self.indptr, dtype='<u8').tobytes(),
+            kind + '_ids': np.asarray(self.indices, dtype='<u4').tobytes(),
+            kind + '_counts': np.asarray(self.counts, dtype='<u4').tobytes(),
+        })
+        return sections
+
+
+def combine(doc_ids, fresh, previous=None, stale=(), tf='relative', idf='smooth'):
+    """Столбцы для документов doc_ids (по возрастанию) с отсортированным
+    словарем: строки пересчитанных документов берутся из fresh, остальных -
+    из previous (прежнего файла). Документные частоты переносятся из
+    previous: строки stale (измененных и удаленных документов) из них
+    вычитаются, строки fresh добавляются, так что меняются только счетчики
+    терминов этих документов. Термины без документов из словаря убираются"""
+    sources = [columns for columns in (previous, fresh) if columns is not None]
+    vocabulary = sorted_terms(set().union(*(columns.vocabulary for columns in sources)))
+    term_ids = {term: i for i, term in enumerate(vocabulary)}
+
+    # Номер термина в источнике -> номер в общем словаре
+    mappings = []
+    for columns in sources:
+        mapping = np.fromiter(map(term_ids.__getitem__, columns.vocabulary),
+                              dtype=np.int64, count=len(columns.vocabulary))
+        mappings.append((columns, mapping))
+
+    frequencies = DocumentFrequencies(len(vocabulary))
+    for columns, mapping in mappings:
+        if columns is previous:
+            frequencies.df[mapping] = columns.frequencies.df
+            frequencies.total_docs = columns.frequencies.total_docs
+            gone = [doc_id for doc_id in sorted(stale) if doc_id in columns]
+            if gone:
+                frequencies.remove(mapping[np.concatenate([columns.row(doc_id)[0] for doc_id in gone])],
+                                   len(gone))
+        else:
+            frequencies.add(mapping[columns.indices], len(columns.documents))
+
+    indptr = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+    lengths = np.zeros(len(doc_ids), dtype=np.int64)
+    id_parts, count_parts = [], []
+    for row, doc_id in enumerate(doc_ids):
+        indptr[row + 1] = indptr[row]
+        # Последний источник с документом - пересчитанный, если он есть
+        for columns, mapping in reversed(mappings):
+            if doc_id in columns:
+                ids, counts = columns.row(doc_id)
+                id_parts.append(mapping[ids])
+                count_parts.append(counts)
+                indptr[row + 1] += len(ids)
+                lengths[row] = columns.length(doc_id)
+                break
+    indices = np.concatenate(id_parts) if id_parts else np.zeros(0, dtype=np.int64)
+    counts = np.concatenate(count_parts) if count_parts else np.zeros(0, dtype=np.int64)
+
+    used = frequencies.df > 0
+    if not used.all():
+        renumber = np.cumsum(used) - 1
+        indices = renumber[indices]
+        vocabulary = [term for term, keep in zip(vocabulary, used.tolist()) if keep]
+        frequencies.df = frequencies.df[used]
+
+    return TfIdfColumns(vocabulary, frequencies, np.array(doc_ids, dtype=np.int64),
+                        lengths, indptr, indices, counts, tf, idf)
+
+
+def write_tfidf_file(path, doc_names, columns, params=None):
+    """Файл весов hw4: для терминов и лемм - столбцы TfIdfColumns с общей
+    таблицей документов (строки по возрастанию doc_id), имена файлов
+    документов и формулы весов в meta"""
+    doc_ids = sorted(doc_names)
+    sections = {'documents': np.asarray(doc_ids, dtype='<u4').tobytes()}
+    for kind, kind_columns in columns.items():
+        sections.update(kind_columns.sections(kind))
+    meta = {'doc_names': doc_names, 'params': params or {}}
+    sections['meta'] = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+    write_sections(path, TFIDF_MAGIC, TFIDF_VERSION, sections)
+
+
+class TfIdfFile:
+    """Файл весов через mmap: массивы - представления NumPy над секциями,
+    без разбора и копирования; строки словаря декодируются при обращении.
+    tf и idf - формулы для чтения весов (по умолчанию - записанные в файле)"""
+
+    def __init__(self, path, tf=None, idf=None):
+        self.path = path
+        self.file = SectionFile(path, TFIDF_MAGIC, TFIDF_VERSION)
+        meta = json.loads(bytes(self.file.section('meta')).decode('utf-8'))
+        self.doc_names = int_keys(meta['doc_names'])
+        self.params = meta['params']
+        self.tf = tf or self.params.get('tf', 'relative')
+        self.idf = idf or self.params.get('idf', 'smooth')
+        self.documents = self.numpy('documents', '<u4')
+        self.columns = {kind: self.load_columns(kind) for kind in KINDS
+                        if kind + '_ids' in self.file}
+
+    def numpy(self, name, dtype):
+        return np.frombuffer(self.file.section(name), dtype=dtype)
+
+    def load_columns(self, kind):
+        terms = TermDictionary(self.file.section(kind + '_vocab'),
+                               self.file.array(kind + '_vocab_off', 'Q'))
+        # Частоты копируются: их исправляет инкрементальный пересчет
+        frequencies = DocumentFrequencies(len(terms), self.numpy(kind + '_df', '<u4'),
+                                          len(self.documents))
+        return TfIdfColumns(terms, frequencies, self.documents,
+                            self.numpy(kind + '_lengths', '<u4'),
+                            self.numpy(kind + '_rows', '<u8'),
+                            self.numpy(kind + '_ids', '<u4'),
+                            self.numpy(kind + '_counts', '<u4'), self.tf, self.idf)
+
+    def close(self):
+        # Массивы NumPy держат буферы секций: вызывающий код отпускает свои
+        # строки и столбцы файла до закрытия, иначе mmap остался бы открытым
+        self.columns = {}
+        self.documents = None
+        try:
+            self.file.close()
+        except BufferError as e:
+            raise BufferError(f"{self.path}: массивы файла весов еще используются, "
+                              f"их нужно освободить до закрытия") from e
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,84 @@
+from itertools import chain
+from collections import defaultdict
+
+import numpy as np
+from scipy import sparse
+
+from common.weights import tf_values, idf_values
+
+
+class TfIdfMatrix:
+    """Корпус как разреженная матрица документ x термин (CSR) с номерами
+    терминов в словаре. Документные частоты, idf, веса tf-idf и нормы строк
+    считаются операциями NumPy над всей матрицей сразу, без цикла по парам
+    (документ, термин).
+
+    doc_counts - doc_id -> {термин: частота}, doc_lengths - doc_id -> число
+    слов. counts - частоты (их вместе с длинами документов и документными
+    частотами хранит файл весов hw4), df - документные частоты по столбцам"""
+
+    def __init__(self, doc_counts, doc_lengths, tf='relative', idf='smooth',
+                 total_docs=None):
+        self.doc_ids = list(doc_counts)
+        self.row_of = {doc_id: row for row, doc_id in enumerate(self.doc_ids)}
+        self.total_docs = len(self.doc_ids) if total_docs is None else total_docs
+
+        # Словарь терминов: номер столбца - в порядке первого появления
+        # (новый термин получает номер, равный текущему размеру словаря).
+        # Строки собираются через map и fromiter за один проход, без цикла
+        # интерпретатора по терминам
+        rows = [doc_counts[doc_id] for doc_id in self.doc_ids]
+        self.term_ids = defaultdict()
+        self.term_ids.default_factory = self.term_ids.__len__
+
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(term_counts) for term_counts in rows], out=indptr[1:])
+        nnz = int(indptr[-1])
+        indices = np.fromiter(map(self.term_ids.__getitem__, chain.from_iterable(rows)),
+                              dtype=np.int64, count=nnz)
+        self.term_ids = dict(self.term_ids)
+        self.terms = list(self.term_ids)
+        counts = np.fromiter(chain.from_iterable(term_counts.values() for term_counts in rows),
+                             dtype=np.float64, count=nnz)
+
+        shape = (len(self.doc_ids), len(self.terms))
+        self.counts = sparse.csr_matrix((counts, indices, indptr), shape=shape)
+        self.lengths = np.array([doc_lengths.get(doc_id, 0) for doc_id in self.doc_ids],
+                                dtype=np.float64)
+
+        self.df = np.bincount(indices, minlength=len(self.terms))
+        self.idf = idf_values(self.df, self.total_docs, idf)
+
+        # Длина документа - для каждого ненулевого элемента его строки
+        row_lengths = np.repeat(self.lengths, np.diff(indptr))
+        weights = tf_values(self.counts.data, row_lengths, tf) * self.idf[indices]
+
+        self.weights = sparse.csr_matrix((weights, indices, indptr),
+                                         shape=shape)
+        self.norms = np.sqrt(np.asarray(self.weights.multiply(self.weights).sum(axis=1)).ravel())
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.row_of
+
+    def row(self, doc_id):
+        """(термин, idf, tf-idf) документа в порядке появления терминов"""
+        row = self.row_of.get(doc_id)
+        if row is None:
+            return []
+        start, end = self.weights.indptr[row], self.weights.indptr[row + 1]
+        ids = self.weights.indices[start:end]
+        terms = self.terms
+        return list(zip([terms[i] for i in ids.tolist()],
+                        self.idf[ids].tolist(),
+                        self.weights.data[start:end].tolist()))
+
+    def vector(self, doc_id):
+        """Вектор документа: термин -> tf-idf"""
+        return {term: weight for term, _, weight in self.row(doc_id)}
+
+    def norm(self, doc_id):
+        row = self.row_of.get(doc_id)
+        return float(self.norms[row]) if row is not None else 0.0
@@ -0,0 +1,201 @@
+import os
+import sys
+import mmap
+import zlib
+import struct
+from array import array
+from collections import Counter
+
+from common.varbyte import encode_varbyte, decode_varbyte
+
+# Заголовок: магия, размер номера термина (2 или 4 байта), число терминов,
+# число лемм, число токенов, размер сжатого словаря, размер блока позиций
+STREAM_HEADER = struct.Struct('<4sB3xIIIII')
+STREAM_MAGIC = b'TKS1'
+
+
+def padded(size):
+    """Размер с выравниванием до 4 байт (массивы читаются без копирования)"""
+    return (size + 3) & ~3
+
+
+def pad(data):
+    return data + b'\0' * (padded(len(data)) - len(data))
+
+
+def to_bytes(values, code):
+    data = array(code, values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def write_token_stream(path, occurrences, lemma_of):
+    """Записывает последовательность токенов документа.
+
+    occurrences - список (токен, номер слова в тексте, смещение в символах),
+    lemma_of(токен) - лемма токена"""
+    terms = sorted({term for term, _, _ in occurrences})
+    term_to_id = {term: i for i, term in enumerate(terms)}
+    lemmas = sorted({lemma_of(term) for term in terms})
+    lemma_to_id = {lemma: i for i, lemma in enumerate(lemmas)}
+
+    # Словарь документа сжимается: отсортированные словоформы хорошо жмутся
+    vocab = zlib.compress('\n'.join(terms + lemmas).encode('utf-8'), 6)
+
+    # Номера слов и смещения растут, поэтому хранятся разности
+    gaps = []
+    last_position = last_start = 0
+    for _, position, start in occurrences:
+        gaps.append(position - last_position)
+        gaps.append(start - last_start)
+        last_position, last_start = position, start
+    gaps = encode_varbyte(gaps)
+
+    id_code = 'H' if max(len(terms), len(lemmas)) <= 0xFFFF else 'I'
+    parts = [
+        STREAM_HEADER.pack(STREAM_MAGIC, array(id_code).itemsize, len(terms), len(lemmas),
+                           len(occurrences), len(vocab), len(gaps)),
+        pad(to_bytes((lemma_to_id[lemma_of(term)] for term in terms), id_code)),
+        pad(vocab),
+        pad(to_bytes((term_to_id[term] for term, _, _ in occurrences), id_code)),
+        gaps,
+    ]
+
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(b''.join(parts))
+    os.replace(tmp_file, path)
+
+
+class TokenStream:
+    """Последовательность токенов документа, прочитанная через mmap.
+
+    term_ids и term_lemma - представления memoryview над файлом (частоты
+    считаются без копирования), словарь и позиции распаковываются при обращении"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.mmap)
+
+        magic, id_size, n_terms, n_lemmas, n_tokens, vocab_size, gaps_size = \
+            STREAM_HEADER.unpack_from(self.buffer, 0)
+        if magic != STREAM_MAGIC:
+            raise ValueError(f"{path}: не файл последовательности токенов")
+        self.n_terms = n_terms
+        self.n_lemmas = n_lemmas
+        self.n_tokens = n_tokens
+        id_code = 'H' if id_size == 2 else 'I'
+
+        offset = STREAM_HEADER.size
+        self.term_lemma, offset = self.view(offset, n_terms, id_code)
+        self.vocab = self.buffer[offset:offset + vocab_size]
+        offset += padded(vocab_size)
+        self.term_ids, offset = self.view(offset, n_tokens, id_code)
+        self.gaps = self.buffer[offset:offset + gaps_size]
+
+        self._terms = None
+        self._lemmas = None
+        self._positions = None
+        self._starts = None
+        self._id_counts = None
+
+    def view(self, offset, count, code):
+        """Массив чисел внутри файла; возвращает его и смещение следующего блока"""
+        size = count * array(code).itemsize
+        data = self.buffer[offset:offset + size]
+        if sys.byteorder == 'big':
+            values = array(code, bytes(data))
+            values.byteswap()
+        else:
+            values = data.cast(code)
+        return values, offset + padded(size)
+
+    def load_vocab(self):
+        words = zlib.decompress(self.vocab).decode('utf-8').split('\n') if self.vocab else []
+        self._terms = words[:self.n_terms]
+        self._lemmas = words[self.n_terms:self.n_terms + self.n_lemmas]
+
+    @property
+    def terms(self):
+        """Словарь документа: термины по номерам (по алфавиту)"""
+        if self._terms is None:
+            self.load_vocab()
+        return self._terms
+
+    @property
+    def lemmas(self):
+        if self._lemmas is None:
+            self.load_vocab()
+        return self._lemmas
+
+    def load_positions(self):
+        gaps = decode_varbyte(self.gaps)
+        positions = array('I')
+        starts = array('I')
+        position = start = 0
+        for i in range(0, len(gaps), 2):
+            position += gaps[i]
+            start += gaps[i + 1]
+            positions.append(position)
+            starts.append(start)
+        self._positions = positions
+        self._starts = starts
+
+    @property
+    def positions(self):
+        """Номера слов в тексте (стоп-слова тоже учитываются)"""
+        if self._positions is None:
+            self.load_positions()
+        return self._positions
+
+    @property
+    def starts(self):
+        """Смещения токенов в извлеченном тексте страницы (в символах)"""
+        if self._starts is None:
+            self.load_positions()
+        return self._starts
+
+    def __len__(self):
+        return self.n_tokens
+
+    def id_counts(self):
+        if self._id_counts is None:
+            self._id_counts = Counter(self.term_ids)
+        return self._id_counts
+
+    def term_counts(self):
+        """Частоты терминов в документе"""
+        terms = self.terms
+        return {terms[term_id]: count for term_id, count in self.id_counts().items()}
+
+    def lemma_counts(self):
+        """Частоты лемм в документе (по всем словоформам)"""
+        counts = Counter()
+        for term_id, count in self.id_counts().items():
+            counts[self.term_lemma[term_id]] += count
+        lemmas = self.lemmas
+        return {lemmas[lemma_id]: count for lemma_id, count in counts.items()}
+
+    def tokens(self):
+        """Токены по порядку: (термин, номер слова в тексте, начало, конец в символах)"""
+        terms = self.terms
+        for term_id, position, start in zip(self.term_ids, self.positions, self.starts):
+            term = terms[term_id]
+            yield term, position, start, start + len(term)
+
+    def close(self):
+        # Представления нужно освободить до закрытия mmap
+        for values in (self.term_lemma, self.term_ids, self.vocab, self.gaps):
+            if isinstance(values, memoryview):
+                values.release()
+        self.buffer.release()
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,197 @@
+import numpy as np
+
+# Документов в блоке списка термина: для блока хранятся последний документ
+# и наибольший вклад, по ним оценка уточняется без чтения самих документов
+BLOCK_SIZE = 64
+# Запас к верхним границам: оценки в float считаются в другом порядке, чем
+# итоговая, и документ не должен отбрасываться из-за ошибки округления
+SLACK = 1e-9
+# Документов, по которым набирается первый порог отбора top-k
+SEED_DOCS = 1024
+
+
+def block_maxima(posting_offsets, posting_docs, values, block_size=BLOCK_SIZE):
+    """Метаданные блоков обратного индекса: списки терминов делятся на блоки
+    по block_size документов. Возвращает границы блоков каждого термина,
+    последний документ каждого блока и наибольшие значения блоков (по
+    каждому массиву values, выровненному со списками документов)"""
+    offsets = np.asarray(posting_offsets, dtype=np.int64)
+    docs = np.asarray(posting_docs, dtype=np.int64)
+    lengths = np.diff(offsets)
+    counts = -(-lengths // block_size)
+    term_blocks = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(counts, out=term_blocks[1:])
+
+    # Начало блока: начало списка термина + номер блока в списке * block_size
+    in_term = np.arange(term_blocks[-1]) - np.repeat(term_blocks[:-1], counts)
+    starts = np.repeat(offsets[:-1], counts) + in_term * block_size
+    ends = np.append(starts[1:], len(docs)).astype(np.int64)
+    block_last = docs[ends - 1] if len(starts) else docs[:0]
+    maxima = [np.maximum.reduceat(np.asarray(v), starts) if len(starts) else np.asarray(v)[:0]
+              for v in values]
+    return term_blocks, block_last, maxima
+
+
+class QueryTerm:
+    """Список термина запроса для отбора top-k: документы и значения (веса
+    или вклады) термина, weight - множитель значений в оценке документа (вес
+    термина в запросе). Границы вклада термина в оценку документа (без
+    множителя weight): term_bound - по всему списку, block_bound - по блокам
+    списка с последними документами block_last"""
+
+    def __init__(self, docs, values, weight, term_bound, block_last, block_bound):
+        self.docs = np.asarray(docs)
+        self.values = np.asarray(values)
+        self.weight = weight
+        self.bound = float(term_bound) * weight
+        self.block_last = np.asarray(block_last)
+        self.block_bound = np.asarray(block_bound, dtype=np.float64) * weight
+
+
+def term_totals(terms, docs):
+    """Точные суммы weight * значение терминов для документов docs (по
+    возрастанию): термины складываются в их порядке, как при полном переборе,
+    списки не читаются целиком - документы находятся двоичным поиском"""
+    totals = None
+    for term in terms:
+        positions = np.searchsorted(term.docs, docs)
+        found = positions < len(term.docs)
+        found[found] = term.docs[positions[found]] == docs[found]
+        values = term.values[positions[found]]
+        if values.dtype.kind != 'f':
+            # Целые вклады складываются без переполнения
+            values = values.astype(np.int64)
+        contributions = values * term.weight
+        if totals is None:
+            totals = np.zeros(len(docs), dtype=contributions.dtype)
+        totals[found] += contributions
+    return totals
+
+
+def upper_bounds(terms, docs, listed, finish):
+    """Верхние границы оценок документов docs: вклады терминов listed
+    считаются точно (документы ищутся в их списках двоичным поиском),
+    остальных - по границам блоков, в которые попадают документы"""
+    bounds = np.asarray(finish(docs, term_totals(listed, docs)), dtype=np.float64)
+    for term in terms:
+        if term not in listed:
+            block = np.searchsorted(term.block_last, docs)
+            inside = block < len(term.block_last)
+            bounds[inside] += term.block_bound[block[inside]]
+    return bounds
+
+
+class TopK:
+    """Лучшие top_k документов по убыванию оценки (при равных - по
+    возрастанию номера) и порог - оценка k-го документа (None, пока их
+    меньше top_k)"""
+
+    def __init__(self, top_k):
+        self.top_k = top_k
+        self.docs = np.zeros(0, dtype=np.int64)
+        self.scores = None
+        self.threshold = None
+
+    def add(self, docs, scores):
+        if self.scores is not None:
+            docs = np.concatenate((self.docs, docs))
+            scores = np.concatenate((self.scores, scores))
+        positive = scores > 0
+        docs, scores = docs[positive], scores[positive]
+        keep = np.lexsort((docs, -scores))[:self.top_k]
+        self.docs, self.scores = docs[keep], scores[keep]
+        if len(self.scores) == self.top_k:
+            self.threshold = self.scores[-1]
+
+    def passes(self, bounds):
+        """Документы с такими границами еще могут попасть в top_k. Допуск
+        на округление: граница в float считается в другом порядке, чем
+        оценка, а документ с равной оценкой и меньшим номером вытесняет k-й"""
+        if self.threshold is None:
+            return np.ones(len(bounds), dtype=bool)
+        return bounds * (1 + SLACK) >= self.threshold
+
+    def items(self):
+        if self.scores is None:
+            return []
+        return list(zip(self.docs.tolist(), self.scores.tolist()))
+
+
+def block_max_top_k(terms, top_k, finish, stats=None):
+    """top_k документов по убыванию оценки (при равных - по возрастанию
+    номера) с отсечением по верхним границам терминов и блоков (MaxScore
+    с границами блоков).
+
+    Оценка документа - сумма weight * значение по терминам в их порядке,
+    которую finish(документы, суммы) -> оценки переводит в итоговую оценку
+    умножением на множитель документа (для BM25 - 1). Документы с оценкой
+    не больше нуля в результаты не попадают.
+
+    Сначала набирается порог - оценка k-го документа: точно оцениваются
+    документы самых коротких списков (редких терминов с большими весами),
+    пока их не наберется SEED_DOCS. Затем термины с наименьшими границами,
+    сумма которых ниже порога, становятся необязательными: документ только
+    с ними в top_k не попадет. Кандидаты - документы обязательных терминов,
+    их граница - точные вклады обязательных терминов и границы блоков
+    необязательных, в которые попадает документ. Кандидаты оцениваются по
+    убыванию границы, пачками вдвое больше предыдущей, с повышением порога,
+    пока граница не станет ниже порога. Списки необязательных терминов не
+    читаются: документы в них находятся двоичным поиском.
+
+    Суммы складываются в том же порядке, что и при полном переборе, так
+    что оценки совпадают с ним до последнего бита. stats - словарь
+    счетчиков: кандидаты и точно оцененные документы"""
+    terms = [term for term in terms if len(term.docs)]
+    if top_k <= 0 or not terms:
+        return []
+    best = TopK(top_k)
+    scored = []
+
+    def score(docs):
+        scored.append(docs)
+        best.add(docs, finish(docs, term_totals(terms, docs)))
+
+    # Порог по документам самых коротких списков
+    seed, size = [], 0
+    for term in sorted(terms, key=lambda term: len(term.docs)):
+        if seed and size + len(term.docs) > SEED_DOCS:
+            break
+        seed.append(term.docs)
+        size += len(term.docs)
+    score(np.unique(np.concatenate(seed)))
+
+    # Необязательные термины: наименьшие границы с суммой ниже порога
+    optional = set()
+    if best.threshold is not None:
+        total = 0.0
+        for term in sorted(terms, key=lambda term: term.bound):
+            total += term.bound
+            if best.passes(np.array([total])).all():
+                break
+            optional.add(term)
+    required = [term for term in terms if term not in optional]
+
+    candidates = 0
+    if required:
+        docs = np.unique(np.concatenate([term.docs for term in required]))
+        docs = docs[~np.isin(docs, scored[0])]
+        doc_bounds = upper_bounds(terms, docs, required, finish)
+        keep = best.passes(doc_bounds)
+        docs, doc_bounds = docs[keep], doc_bounds[keep]
+        candidates = len(docs)
+
+        by_bound = np.argsort(-doc_bounds, kind='stable')
+        done, size = 0, top_k
+        while done < len(by_bound):
+            batch = by_bound[done:done + size]
+            batch = batch[best.passes(doc_bounds[batch])]
+            if not len(batch):
+                break
+            done += size
+            size *= 2
+            score(np.sort(docs[batch]))
+
+    if stats is not None:
+        stats['candidates'] = stats.get('candidates', 0) + candidates
+        stats['scored'] = stats.get('scored', 0) + sum(len(docs) for docs in scored)
+    return best.items()
@@ -0,0 +1,37 @@
+from array import array
+
+
+def encode_varbyte(numbers):
+    """Числа переменной длины: по 7 бит в байте, старший бит - продолжение"""
+    out = bytearray()
+    for n in numbers:
+        while n >= 0x80:
+            out.append((n & 0x7F) | 0x80)
+            n >>= 7
+        out.append(n)
+    return bytes(out)
+
+
+def decode_varbyte(data):
+    numbers = array('I')
+    n = shift = 0
+    for byte in data:
+        n |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            numbers.append(n)
+            n = shift = 0
+    return numbers
+
+
+def read_varbyte(data, offset):
+    """Одно число переменной длины; возвращает его и смещение следующего"""
+    n = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        n |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return n, offset
+        shift += 7
@@ -0,0 +1,39 @@
+import numpy as np
+
+# Формулы tf: count - частоты терминов (по ненулевым элементам матрицы),
+# length - число слов документа для каждого элемента
+TF_WEIGHTS = {
+    'relative': lambda count, length: count / length,
+    'raw': lambda count, length: count,
+    'log': lambda count, length: 1 + np.log(count),
+    'binary': lambda count, length: np.ones_like(count),
+}
+
+# Формулы idf: df - документные частоты терминов, n - число документов
+IDF_WEIGHTS = {
+    'smooth': lambda df, n: np.log((n + 1) / (df + 1)) + 1,
+    'plain': lambda df, n: np.log(n / df),
+    'none': lambda df, n: np.ones_like(df),
+}
+
+
+def weighting(weights, name, kind):
+    if name not in weights:
+        raise ValueError(f"Неизвестная формула {kind}: {name} (есть: {', '.join(weights)})")
+    return weights[name]
+
+
+def tf_values(counts, lengths, tf='relative'):
+    """tf по частотам и длинам документов (для каждого элемента)"""
+    tf_weight = weighting(TF_WEIGHTS, tf, 'tf')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return tf_weight(np.asarray(counts, dtype=np.float64), lengths)
+
+
+def idf_values(df, total_docs, idf='smooth'):
+    """idf по массиву документных частот; термин без документов (df = 0)
+    получает нулевой idf"""
+    idf_weight = weighting(IDF_WEIGHTS, idf, 'idf')
+    df = np.asarray(df, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(df > 0, idf_weight(df, total_docs), 0.0)
@@ -0,0 +1,213 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import aiohttp
+
+from crawler import TextPageCrawler
+from crawl_journal import fsync_files, IN_FLIGHT, DONE, FAILED
+
+RETRY_STATUSES = {403, 429, 500, 502, 503, 504}
+
+
+class HostTokenBucket:
+    """Token bucket для одного хоста: ограничивает частоту запросов"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate  # токенов в секунду
+        self.burst = burst  # максимальный запас токенов
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # пауза после 429/503 (Retry-After)
+        self.lock = asyncio.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Ждет, пока хост можно будет снова нагрузить запросом"""
+        # Ожидающие запросы к одному хосту выстраиваются в очередь на lock,
+        # другие хосты при этом не блокируются
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self.refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, delay):
+        """Приостанавливает все запросы к хосту на delay секунд"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        self.tokens = 0
+
+
+def parse_retry_after(value):
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата)"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class AsyncPageCrawler(TextPageCrawler):
+    """Асинхронный краулер: ограниченное число запросов в полете,
+    token bucket на каждый хост и backoff с учетом Retry-After"""
+
+    def __init__(self, output_dir="pages", state_file=None, store_dir=None,
+                 journal_file=None, resume=False, concurrency=16, host_rate=1.0,
+                 host_burst=1, max_attempts=10, timeout=10,
+                 backoff_base=1.0, backoff_max=60.0):
+        super().__init__(output_dir, state_file, store_dir, journal_file, resume)
+        self.concurrency = concurrency
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.buckets = {}
+        self.downloaded = 0
+        # Ответы 304: страница не изменилась и заново не скачивалась
+        self.unchanged = 0
+
+    def get_bucket(self, host):
+        if host not in self.buckets:
+            self.buckets[host] = HostTokenBucket(self.host_rate, self.host_burst)
+        return self.buckets[host]
+
+    def backoff_delay(self, attempt, retry_after):
+        """Задержка перед повтором: Retry-After либо экспоненциальный backoff"""
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def fetch(self, session, semaphore, url):
+        """Загружает URL с повторами; возвращает (код, заголовки, HTML) или None"""
+        bucket = self.get_bucket(urlparse(url).netloc)
+
+        for attempt in range(self.max_attempts):
+            await bucket.acquire()
+            try:
+                async with semaphore:
+                    async with session.get(url, headers=self.request_headers(url)) as response:
+                        status = response.status
+                        headers = response.headers
+                        if status == 304:
+                            return status, headers, None
+                        if status == 200:
+                            content_type = headers.get('Content-Type', '')
+                            if 'text/html' not in content_type.lower():
+                                return None
+                            return status, headers, await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Ошибка загрузки {url}: {e!r}")
+                bucket.block(self.backoff_delay(attempt, None))
+                continue
+
+            if status not in RETRY_STATUSES:
+                print(f"Получен код {status}, пропуск: {url}")
+                return None
+
+            delay = self.backoff_delay(attempt, parse_retry_after(headers.get('Retry-After')))
+            print(f"Получен код {status}. Хост {urlparse(url).netloc} на паузе {delay:.1f} с")
+            bucket.block(delay)
+
+        print(f"Не удалось загрузить после {self.max_attempts} попыток: {url}")
+        return None
+
+    async def crawl_host(self, session, semaphore, queue):
+        """Обходит очередь URL одного хоста"""
+        while queue:
+            url = queue.popleft()
+            self.mark(url, IN_FLIGHT)
+            result = await self.fetch(session, semaphore, url)
+            if result is None:
+                self.mark(url, FAILED)
+                continue
+
+            # Нумерация в порядке завершения загрузок; цикл событий однопоточный,
+            # поэтому счетчик и состояние загрузок не требуют блокировки
+            status, headers, html = result
+            page_number = self.page_number_for(url, self.downloaded + 1)
+            if status == 304:
+                self.unchanged += 1
+            else:
+                self.downloaded += 1
+            await self.handle_page(status, page_number, url, headers, html)
+            await self.mark_done(url, page_number)
+
+    async def mark_done(self, url, page_number):
+        """Запись DONE, как в mark(): страница на диске раньше записи журнала.
+        fsync выполняется в потоке, загрузки тем временем продолжаются"""
+        if self.journal is None:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, fsync_files, self.page_files(page_number))
+        self.journal.record(url, DONE, page_number, sync=False)
+        await loop.run_in_executor(None, fsync_files, [self.journal.flush()])
+
+    async def handle_page(self, status, page_number, url, headers, html):
+        """Сохраняет загруженную страницу (наследники могут передавать ее дальше)"""
+        if status == 304:
+            self.keep_page(url, page_number)
+        else:
+            self.store_page(page_number, url, headers, html)
+
+    async def crawl_async(self, urls):
+        # Группируем URL по хостам: у каждого хоста своя очередь и свой
+        # лимит частоты, поэтому медленный хост не задерживает остальные
+        host_queues = OrderedDict()
+        for url in urls:
+            host_queues.setdefault(urlparse(url).netloc, deque()).append(url)
+
+        print(f"URL к загрузке: {len(urls)}, хостов: {len(host_queues)}")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        headers = {'User-Agent': self.session.headers['User-Agent']}
+        async with aiohttp.ClientSession(headers=headers, timeout=timeout,
+                                         connector=connector) as session:
+            # На хост не больше host_burst одновременных обходчиков
+            await asyncio.gather(*(self.crawl_host(session, semaphore, queue)
+                                   for queue in host_queues.values()
+                                   for _ in range(min(self.host_burst, len(queue)))))
+
+    def crawl(self, urls):
+        """Основной метод краулинга (асинхронный режим)"""
+        print(f"Начинаем асинхронный краулинг.")
+        urls, self.downloaded = self.start_crawl(self.filter_urls(urls))
+
+        try:
+            asyncio.run(self.crawl_async(urls))
+        finally:
+            self.finish_crawl()
+
+        print(f"\n Краулинг завершен. Скачано страниц: {self.downloaded}")
+        if self.unchanged:
+            print(f" Не изменилось (304): {self.unchanged}")
+        print(f" Файлы сохранены в папке: {self.store.store_dir if self.store else self.output_dir}")
+        print(f" Индекс сохранен в: {self.index_file}")
+
+        return self.downloaded
@@ -0,0 +1,125 @@
+import os
+
+QUEUED = 'queued'
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def fsync_files(paths):
+    """Сбрасывает на диск уже записанные файлы. Файлы открываются заново,
+    поэтому функцию можно вызывать в другом потоке, пока в них пишут"""
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class CrawlJournal:
+    """Журнал состояний URL (write-ahead log) для возобновления краулинга.
+
+    Каждая строка - переход состояния: "состояние, попытки, номер страницы, URL".
+    Записи сбрасываются на диск (fsync) пачками по sync_every строк, а запись
+    о скачанной странице (DONE) - сразу: страница уже сохранена, и после
+    аварийной остановки она не должна загружаться и дописываться повторно."""
+
+    def __init__(self, journal_file='crawl_journal.log', sync_every=50, max_failures=3):
+        self.journal_file = journal_file
+        self.sync_every = sync_every
+        self.max_failures = max_failures
+        self.entries = {}  # url -> {'state': ..., 'attempts': ..., 'page': ...}
+        self.writer = None
+        self.pending = 0
+
+    def replay(self):
+        """Восстанавливает последнее состояние каждого URL из журнала"""
+        self.entries = {}
+        if not os.path.exists(self.journal_file):
+            return False
+
+        with open(self.journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # Строка оборвана при аварийной остановке
+                    break
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 4:
+                    continue
+                state, attempts, page, url = parts
+                self.entries[url] = {
+                    'state': state,
+                    'attempts': int(attempts),
+                    'page': int(page) if page != '-' else None
+                }
+        return True
+
+    def open(self, truncate=False):
+        self.writer = open(self.journal_file, 'w' if truncate else 'a', encoding='utf-8')
+
+    def format_line(self, url, entry):
+        page = entry['page'] if entry['page'] is not None else '-'
+        return f"{entry['state']}\t{entry['attempts']}\t{page}\t{url}\n"
+
+    def record(self, url, state, page=None, sync=True):
+        """Записывает переход URL в новое состояние; sync=False - без fsync
+        (вызывающий код сбрасывает журнал сам: flush() и fsync_files)"""
+        entry = self.entries.setdefault(url, {'state': QUEUED, 'attempts': 0, 'page': None})
+        entry['state'] = state
+        if state == IN_FLIGHT:
+            entry['attempts'] += 1
+        if page is not None:
+            entry['page'] = page
+
+        self.writer.write(self.format_line(url, entry))
+        self.pending += 1
+        if sync and (state == DONE or self.pending >= self.sync_every):
+            self.sync()
+
+    def sync(self):
+        if self.writer is None or self.pending == 0:
+            return
+        self.writer.flush()
+        os.fsync(self.writer.fileno())
+        self.pending = 0
+
+    def flush(self):
+        """Записывает буфер в файл без fsync и возвращает путь журнала:
+        fsync по нему выполняет вызывающий код (например, вне цикла событий)"""
+        self.writer.flush()
+        self.pending = 0
+        return self.journal_file
+
+    def close(self):
+        if self.writer is not None:
+            self.sync()
+            self.writer.close()
+            self.writer = None
+
+    def compact(self):
+        """Переписывает журнал: по одной строке на URL"""
+        tmp_file = self.journal_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for url, entry in self.entries.items():
+                f.write(self.format_line(url, entry))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.journal_file)
+
+    def is_finished(self, url):
+        """URL не нужно загружать: он уже скачан или исчерпал попытки"""
+        entry = self.entries.get(url)
+        if entry is None:
+            return False
+        if entry['state'] == DONE:
+            return True
+        return entry['state'] == FAILED and entry['attempts'] >= self.max_failures
+
+    def done_pages(self):
+        """Скачанные страницы: список (номер страницы, URL) по возрастанию номера"""
+        return sorted((entry['page'], url) for url, entry in self.entries.items()
+                      if entry['state'] == DONE)
+
+    def last_page(self):
+        return max((page for page, _ in self.done_pages()), default=0)
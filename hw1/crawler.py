@@ -1,18 +1,42 @@
 import os
+import argparse
 import requests
 from urllib.parse import urlparse
+import sys
 import time
+from fetch_state import FetchStateStore, content_hash
+from crawl_journal import CrawlJournal, fsync_files, QUEUED, IN_FLIGHT, DONE, FAILED
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.page_store import PageStore
 
 class TextPageCrawler:
-    def __init__(self, output_dir="pages"):
+    def __init__(self, output_dir="pages", state_file=None, store_dir=None,
+                 journal_file=None, resume=False):
         self.output_dir = output_dir
         self.index_file = "index.txt"
+        self.changed_file = "changed_pages.txt"
+        self.index_writer = None
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (compatible; MyBot/1.0; +https://example.com/bot-info)',
         })
 
-        if not os.path.exists(output_dir):
+        # Состояние прошлых загрузок (только для инкрементального режима)
+        self.state = None
+        if state_file:
+            self.state = FetchStateStore(state_file)
+            self.state.load()
+        self.changed_pages = []
+
+        # Сжатое хранилище страниц вместо отдельных HTML-файлов
+        self.store = PageStore(store_dir) if store_dir else None
+
+        # Журнал состояний URL для продолжения прерванного обхода
+        self.journal = CrawlJournal(journal_file) if journal_file else None
+        self.resume = resume and self.journal is not None
+
+        if self.store is None and not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
     def is_valid_text_page(self, url):
@@ -29,67 +53,219 @@ class TextPageCrawler:
         parsed = urlparse(url)
         return parsed.scheme in ['http', 'https']
 
+    def request_headers(self, url):
+        """Заголовки условного GET, если URL уже скачивался"""
+        if self.state is None:
+            return {}
+        return self.state.conditional_headers(url)
+
+    def page_number_for(self, url, default):
+        """Номер страницы: в инкрементальном режиме он закреплен за URL"""
+        if self.state is None:
+            return default
+        return self.state.page_number(url)
+
     def download_page(self, url, page_number):
         """Скачивает страницу и сохраняет в файл"""
         for attempt in range(10):
-            response = self.session.get(url, timeout=10)
+            response = self.session.get(url, timeout=10, headers=self.request_headers(url))
 
             if response.status_code == 403 or response.status_code == 429:
                 print(f"Получен код {response.status_code}. Ожидание 60 секунд...")
                 time.sleep(60)
                 continue
 
+            if response.status_code == 304:
+                filepath = self.keep_page(url, page_number)
+                time.sleep(10)
+                return filepath
+
             response.raise_for_status()
 
             content_type = response.headers.get('Content-Type', '')
             if 'text/html' not in content_type.lower():
                 return None
 
-            filename = f"page_{page_number:03d}.html"
-            filepath = os.path.join(self.output_dir, filename)
+            filepath = self.store_page(page_number, url, response.headers, response.text)
+            time.sleep(10)
+            return filepath
+        return None
 
+    def page_path(self, page_number):
+        """Путь к файлу страницы (для хранилища - путь внутри него)"""
+        directory = self.store.store_dir if self.store else self.output_dir
+        return os.path.join(directory, f"page_{page_number:03d}.html")
+
+    def has_page(self, page_number):
+        if self.store is not None:
+            return page_number in self.store.entries
+        return os.path.exists(self.page_path(page_number))
+
+    def keep_page(self, url, page_number):
+        """Сервер ответил 304: страница не изменилась, файл не трогаем"""
+        print(f"Не изменилась (304): {url}")
+        return self.page_path(page_number)
+
+    def store_page(self, page_number, url, headers, html):
+        """Сохраняет загруженную страницу; в инкрементальном режиме
+        перезаписывает файл только при изменении содержимого"""
+        if self.state is None:
+            return self.save_page(page_number, url, html)
+
+        is_new = self.state.get(url) is None
+        changed = self.state.update(url, page_number,
+                                    headers.get('ETag'),
+                                    headers.get('Last-Modified'),
+                                    content_hash(html))
+
+        if not changed and self.has_page(page_number):
+            print(f"Не изменилась (тот же хеш): {url}")
+            return self.page_path(page_number)
+
+        self.changed_pages.append(page_number)
+        return self.save_page(page_number, url, html, add_to_index=is_new)
+
+    def save_page(self, page_number, url, html, add_to_index=True):
+        """Сохраняет HTML страницы в файл и добавляет запись в индекс"""
+        filepath = self.page_path(page_number)
+
+        if self.store is not None:
+            self.store.append(page_number, url, html)
+        else:
             with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(response.text)
+                f.write(html)
 
+        if add_to_index:
             self.add_to_index(page_number, url)
 
-            print(f"Загружена страница {page_number}: {filename}")
-            time.sleep(10)
-            return filepath
-        return None
+        print(f"Загружена страница {page_number}: {os.path.basename(filepath)}")
+        return filepath
 
     def add_to_index(self, page_number, url):
-        with open(self.index_file, 'a', encoding='utf-8') as f:
-            f.write(f"page_{page_number:03d}.html | {url}\n")
-
-    def crawl(self, urls):
-        """Основной метод краулинга"""
-        print(f"Начинаем краулинг.")
+        # Файл индекса держим открытым на все время обхода
+        if self.index_writer is None:
+            self.index_writer = open(self.index_file, 'a', encoding='utf-8')
+        self.index_writer.write(f"page_{page_number:03d}.html | {url}\n")
+        self.index_writer.flush()
 
+    def reset_index(self):
         with open(self.index_file, 'w', encoding='utf-8') as f:
             f.write("# имя_файла | URL\n")
 
-        downloaded = 0
-        processed_urls = set()
+    def start_crawl(self, urls):
+        """Готовит индекс и журнал; возвращает URL, которые осталось загрузить,
+        и номер последней уже скачанной страницы"""
+        self.changed_pages = []
+
+        if self.resume:
+            self.journal.replay()
+            self.journal.compact()
+
+        if self.state is not None and self.state.states and os.path.exists(self.index_file):
+            # Повторный инкрементальный обход: индекс сохраняется
+            pass
+        elif self.resume:
+            self.restore_index()
+        else:
+            self.reset_index()
+
+        if self.journal is None:
+            return urls, 0
+
+        self.journal.open(truncate=not self.resume)
+        for url in urls:
+            if url not in self.journal.entries:
+                self.journal.record(url, QUEUED)
+        self.journal.sync()
+
+        pending = [url for url in urls if not self.journal.is_finished(url)]
+        if self.resume:
+            print(f"Продолжение обхода: уже обработано {len(urls) - len(pending)} URL")
+        return pending, self.journal.last_page()
+
+    def restore_index(self):
+        """Переписывает index.txt по страницам, скачанным до остановки"""
+        self.reset_index()
+        for page_number, url in self.journal.done_pages():
+            self.add_to_index(page_number, url)
 
+    def page_files(self, page_number):
+        """Файлы страницы, которые должны быть на диске раньше ее записи DONE
+        (буферы хранилища записываются в файлы)"""
+        if self.store is not None:
+            return self.store.flush()
+        path = self.page_path(page_number)
+        return [path] if os.path.exists(path) else []
+
+    def mark(self, url, state, page_number=None):
+        if self.journal is None:
+            return
+        if state == DONE:
+            # Страница и ее запись DONE попадают на диск вместе: после
+            # аварийной остановки --resume не допишет ее в хранилище второй раз
+            fsync_files(self.page_files(page_number))
+        self.journal.record(url, state, page_number)
+
+    def finish_crawl(self):
+        """Закрывает файлы и сохраняет состояние загрузок со списком
+        изменившихся страниц"""
+        if self.journal is not None:
+            self.journal.close()
+        if self.index_writer is not None:
+            self.index_writer.close()
+            self.index_writer = None
+        if self.store is not None:
+            self.store.close()
+
+        if self.state is None:
+            return
+
+        self.state.save()
+        with open(self.changed_file, 'w', encoding='utf-8') as f:
+            for page_number in sorted(self.changed_pages):
+                f.write(f"page_{page_number:03d}.html\n")
+
+        print(f" Изменившихся страниц: {len(self.changed_pages)} (список в {self.changed_file})")
+
+    def filter_urls(self, urls):
+        """Убирает пустые, повторяющиеся и нетекстовые URL, сохраняя порядок"""
+        result = []
+        seen = set()
         for url in urls:
             url = url.strip()
-            if not url or url in processed_urls:
+            if not url or url in seen:
                 continue
+            seen.add(url)
 
             if not self.is_valid_text_page(url):
                 print(f"Пропущен (не текстовая страница): {url}")
                 continue
+            result.append(url)
+        return result
 
-            print(f"Обработка URL {downloaded + 1}/{len(urls)}: {url}")
-            processed_urls.add(url)
+    def crawl(self, urls):
+        """Основной метод краулинга"""
+        print(f"Начинаем краулинг.")
+
+        urls, downloaded = self.start_crawl(self.filter_urls(urls))
 
-            result = self.download_page(url, downloaded + 1)
-            if result:
-                downloaded += 1
+        try:
+            for url in urls:
+                print(f"Обработка URL {downloaded + 1}/{len(urls)}: {url}")
+
+                page_number = self.page_number_for(url, downloaded + 1)
+                self.mark(url, IN_FLIGHT)
+                result = self.download_page(url, page_number)
+                if result:
+                    downloaded += 1
+                    self.mark(url, DONE, page_number)
+                else:
+                    self.mark(url, FAILED)
+        finally:
+            self.finish_crawl()
 
         print(f"\n Краулинг завершен. Скачано страниц: {downloaded}")
-        print(f" Файлы сохранены в папке: {self.output_dir}")
+        print(f" Файлы сохранены в папке: {self.store.store_dir if self.store else self.output_dir}")
         print(f" Индекс сохранен в: {self.index_file}")
 
         return downloaded
@@ -251,11 +427,58 @@ def get_url_list():
     ]
 
 
+def load_url_file(path):
+    """Читает список URL из файла (по одному на строку, # - комментарий)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f
+                if line.strip() and not line.startswith('#')]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Краулер текстовых страниц")
+    parser.add_argument('--urls', help="файл со списком URL (по умолчанию - встроенный список)")
+    parser.add_argument('--output-dir', default='pages', help="папка для сохранения страниц")
+    parser.add_argument('--store', help="сохранять страницы в сжатое хранилище "
+                                        "(папка с сегментами) вместо отдельных HTML-файлов")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="асинхронный режим с параллельной загрузкой")
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help="максимум одновременных запросов (async)")
+    parser.add_argument('--host-rate', type=float, default=1.0,
+                        help="запросов в секунду к одному хосту (async)")
+    parser.add_argument('--host-burst', type=int, default=1,
+                        help="размер пачки запросов к одному хосту (async)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="повторный обход: условный GET, перезапись только изменившихся страниц")
+    parser.add_argument('--state-file', default='fetch_state.json',
+                        help="файл состояния загрузок для --incremental")
+    parser.add_argument('--journal', default='crawl_journal.log',
+                        help="журнал состояний URL")
+    parser.add_argument('--resume', action='store_true',
+                        help="продолжить прерванный обход по журналу")
+    return parser.parse_args()
+
+
 def main():
-    urls = get_url_list()
+    args = parse_args()
+    urls = load_url_file(args.urls) if args.urls else get_url_list()
     print(f"Подготовлено URL для краулинга: {len(urls)}")
 
-    crawler = TextPageCrawler()
+    state_file = args.state_file if args.incremental else None
+    if args.use_async:
+        from async_crawler import AsyncPageCrawler
+        crawler = AsyncPageCrawler(output_dir=args.output_dir,
+                                   state_file=state_file,
+                                   store_dir=args.store,
+                                   journal_file=args.journal,
+                                   resume=args.resume,
+                                   concurrency=args.concurrency,
+                                   host_rate=args.host_rate,
+                                   host_burst=args.host_burst)
+    else:
+        crawler = TextPageCrawler(output_dir=args.output_dir, state_file=state_file,
+                                  store_dir=args.store, journal_file=args.journal,
+                                  resume=args.resume)
     downloaded = crawler.crawl(urls)
 
     print(f"\nСкачано {downloaded} страниц.")
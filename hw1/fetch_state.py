@@ -0,0 +1,68 @@
+import os
+import json
+import hashlib
+
+
+def content_hash(html):
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+
+class FetchStateStore:
+    """Хранит состояние прошлых загрузок по URL: номер страницы, ETag,
+    Last-Modified и хеш содержимого"""
+
+    def __init__(self, state_file='fetch_state.json'):
+        self.state_file = state_file
+        self.states = {}  # url -> {'page': ..., 'etag': ..., 'last_modified': ..., 'hash': ...}
+
+    def load(self):
+        if not os.path.exists(self.state_file):
+            return False
+
+        with open(self.state_file, 'r', encoding='utf-8') as f:
+            self.states = json.load(f)
+        return True
+
+    def save(self):
+        # Пишем во временный файл и подменяем, чтобы не оставить битое состояние
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.states, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    def get(self, url):
+        return self.states.get(url)
+
+    def next_page_number(self):
+        return max((state['page'] for state in self.states.values()), default=0) + 1
+
+    def page_number(self, url):
+        """Номер страницы для URL: прежний, если URL уже скачивался, иначе новый"""
+        state = self.states.get(url)
+        if state:
+            return state['page']
+        return self.next_page_number()
+
+    def conditional_headers(self, url):
+        """Заголовки условного GET для повторной загрузки"""
+        state = self.states.get(url)
+        if not state:
+            return {}
+
+        headers = {}
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+        return headers
+
+    def update(self, url, page_number, etag, last_modified, page_hash):
+        """Запоминает результат загрузки; возвращает True, если содержимое изменилось"""
+        previous = self.states.get(url)
+        self.states[url] = {
+            'page': page_number,
+            'etag': etag,
+            'last_modified': last_modified,
+            'hash': page_hash
+        }
+        return previous is None or previous.get('hash') != page_hash
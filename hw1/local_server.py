@@ -0,0 +1,77 @@
+import os
+import argparse
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Локальная замена сайта для проверки краулера: отдает страницы из папки
+    (с ETag и ответом 304 на If-None-Match) и каждые N запросов отвечает 429
+    с заголовком Retry-After"""
+
+    pages_dir = 'pages'
+    throttle_every = 0
+    retry_after = 1
+    counter = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.counter += 1
+            throttled = cls.throttle_every and cls.counter % cls.throttle_every == 0
+
+        if throttled:
+            self.send_response(429)
+            self.send_header('Retry-After', str(cls.retry_after))
+            self.end_headers()
+            return
+
+        filename = os.path.basename(self.path.split('?')[0]) or 'index.html'
+        filepath = os.path.join(cls.pages_dir, filename)
+        if not os.path.isfile(filepath):
+            self.send_error(404)
+            return
+
+        with open(filepath, 'rb') as f:
+            body = f.read()
+
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный HTTP-сервер для проверки краулера")
+    parser.add_argument('--pages-dir', default='pages')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--throttle-every', type=int, default=0,
+                        help="отвечать 429 на каждый N-й запрос (0 - никогда)")
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    StandInHandler.pages_dir = args.pages_dir
+    StandInHandler.throttle_every = args.throttle_every
+    StandInHandler.retry_after = args.retry_after
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), StandInHandler)
+    print(f"Сервер запущен: http://127.0.0.1:{args.port}/ (страницы из {args.pages_dir})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
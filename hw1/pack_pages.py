@@ -0,0 +1,50 @@
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.page_store import PageStore, parse_page_name
+
+
+def read_index(index_file):
+    """Читает index.txt: имя файла -> URL"""
+    urls = {}
+    with open(index_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#') or '|' not in line:
+                continue
+            filename, url = line.split('|', 1)
+            urls[filename.strip()] = url.strip()
+    return urls
+
+
+def pack_pages(pages_dir, index_file, store_dir):
+    """Переносит скачанные HTML-файлы в сжатое хранилище страниц"""
+    urls = read_index(index_file)
+    files = sorted(f for f in os.listdir(pages_dir) if f.endswith('.html'))
+
+    raw_size = 0
+    with PageStore(store_dir) as store:
+        for filename in files:
+            with open(os.path.join(pages_dir, filename), 'r', encoding='utf-8') as f:
+                html = f.read()
+            raw_size += os.path.getsize(os.path.join(pages_dir, filename))
+            store.append(parse_page_name(filename), urls.get(filename, ''), html)
+
+    packed_size = sum(os.path.getsize(os.path.join(store_dir, f)) for f in os.listdir(store_dir))
+    print(f"Упаковано страниц: {len(files)}")
+    print(f"Размер: {raw_size / 2**20:.1f} МБ -> {packed_size / 2**20:.1f} МБ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Упаковка HTML-страниц в сжатое хранилище")
+    parser.add_argument('--pages-dir', default='pages')
+    parser.add_argument('--index-file', default='index.txt')
+    parser.add_argument('--store', default='page_store')
+    args = parser.parse_args()
+
+    pack_pages(args.pages_dir, args.index_file, args.store)
+
+
+if __name__ == "__main__":
+    main()
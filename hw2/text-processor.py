@@ -1,63 +1,76 @@
 import os
 import re
-from bs4 import BeautifulSoup
-import pymorphy3
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from nltk.corpus import stopwords
 import nltk
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.page_store import open_pages
+from common.lemmatizer import Lemmatizer
+from common.html_extract import get_extractor, load_titles
+from common.manifest import Manifest, content_hash
+from common.token_stream import write_token_stream
+
 class TextProcessor:
     """Класс для обработки текста: токенизация и лемматизация"""
-    def __init__(self, pages_dir='../hw1/pages', output_dir='.'):
+    def __init__(self, pages_dir='../hw1/pages', output_dir='.', extractor='bs4', wiki=False,
+                 record_lemmas=True):
         self.pages_dir = pages_dir
+        self.pages = open_pages(pages_dir)  # папка с HTML или сжатое хранилище
         self.output_dir = output_dir
         self.tokens_dir = os.path.join(output_dir, 'tokens')
         self.lemmas_dir = os.path.join(output_dir, 'lemmas')
+        self.positions_dir = os.path.join(output_dir, 'positions')
 
-        os.makedirs(self.tokens_dir, exist_ok=True)
-        os.makedirs(self.lemmas_dir, exist_ok=True)
+        # Способ извлечения текста: bs4 (дерево разбора) или fast (потоковый),
+        # wiki - только текст статьи без навигации, сносок и боковых панелей
+        self.extractor_name = extractor
+        self.wiki = wiki
+        self.extractor = get_extractor(extractor, wiki)
+
+        # Названия страниц получаются при том же разборе HTML, что и текст
+        self.titles_file = os.path.join(output_dir, 'titles.txt')
+        self.titles = {}
+        self.removed_titles = set()
+
+        # Манифест: хеши обработанных страниц для инкрементального режима
+        self.manifest_file = os.path.join(output_dir, 'manifest.json')
+        self.page_hashes = {}
 
         # Загружаем стоп-слова (предлоги, союзы и т.д.)
         nltk.download('stopwords', quiet=True)
         self.stop_words = set(stopwords.words('russian'))
 
-        # Инициализируем лемматизатор
-        self.morph = pymorphy3.MorphAnalyzer()
+        # Инициализируем лемматизатор: словарь слово -> лемма с прошлых запусков
+        # и LRU-кэш, pymorphy3 вызывается только для новых слов. Новые пары
+        # копятся для записи в словарь (record_lemmas), если он сохраняется
+        self.dictionary_file = os.path.join(output_dir, 'lemma_dictionary.txt')
+        self.lemmatizer = Lemmatizer(self.dictionary_file, record_new=record_lemmas)
 
     def extract_text_from_html(self, html_content):
         """Извлекает чистый текст из HTML"""
-        soup = BeautifulSoup(html_content, 'html.parser')
-
-        # Удаляем скрипты, стили и другие ненужные элементы
-        for script in soup(['script', 'style', 'meta', 'link']):
-            script.decompose()
-
-        # Получаем текст
-        text = soup.get_text()
-
-        # Очищаем от лишних пробелов и переносов
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = ' '.join(chunk for chunk in chunks if chunk)
-
-        return text
+        return self.extractor.extract(html_content)[1]
 
     def tokenize(self, text):
         """Разбивает текст на токены и очищает от мусора"""
-        # Регулярное выражение для поиска слов (только буквы, минимум 2 символа)
-        words = re.findall(r'\b[а-яА-ЯёЁ]{2,}\b', text.lower())
-
-        # Фильтрация
-        clean_words = []
-        for word in words:
-            # Пропускаем стоп-слова (предлоги, союзы)
+        return [word for word, _, _ in self.tokenize_with_offsets(text)]
+
+    def tokenize_with_offsets(self, text):
+        """Токены с местом в тексте: (токен, номер слова, смещение в символах)"""
+        occurrences = []
+        # Регулярное выражение для поиска слов (только буквы, минимум 2 символа);
+        # слова ищутся в исходном тексте, чтобы смещения указывали в него
+        for position, match in enumerate(re.finditer(r'\b[а-яА-ЯёЁ]{2,}\b', text)):
+            word = match.group().lower()
+            # Пропускаем стоп-слова (предлоги, союзы); номера слов не сдвигаются,
+            # чтобы расстояния между оставшимися словами сохранялись
             if word in self.stop_words:
                 continue
-            # Пропускаем слишком короткие
-            if len(word) < 2:
-                continue
-            clean_words.append(word)
+            occurrences.append((word, position, match.start()))
 
-        return clean_words
+        return occurrences
 
     def lemmatize_words(self, words):
         """Группирует слова по леммам"""
@@ -65,7 +78,7 @@ class TextProcessor:
 
         for word in words:
             # Получаем нормальную форму (лемму)
-            lemma = self.morph.parse(word)[0].normal_form
+            lemma = self.lemmatizer.lemmatize(word)
             lemma_dict.setdefault(lemma, set()).add(word)
 
         # Преобразуем множества в списки для сортировки
@@ -76,14 +89,9 @@ class TextProcessor:
         return result
 
     def get_html_files(self):
-        """Возвращает список всех HTML-файлов в папке ../hw1/pages"""
-        html_files = []
-        for file in os.listdir(self.pages_dir):
-            if file.endswith('.html'):
-                html_files.append(os.path.join(self.pages_dir, file))
-
-        html_files.sort()
-        return html_files
+        """Возвращает список всех HTML-файлов в папке ../hw1/pages
+        (для хранилища - пути к страницам внутри него)"""
+        return [os.path.join(self.pages_dir, name + '.html') for name in self.pages.names()]
 
     def get_page_number(self, file_path):
         """Извлекает номер страницы из имени файла"""
@@ -92,11 +100,14 @@ class TextProcessor:
 
     def process_file(self, html_file_path):
         """Обрабатывает один HTML-файл: возвращает токены и леммы"""
-        with open(html_file_path, 'r', encoding='utf-8') as f:
-            html_content = f.read()
+        return self.process_html(self.pages.read(html_file_path))[:2]
 
-        text = self.extract_text_from_html(html_content)
-        tokens = self.tokenize(text)
+    def process_html(self, html_content):
+        """Обрабатывает HTML страницы: возвращает токены, леммы, название страницы
+        и все вхождения токенов с позициями"""
+        title, text = self.extractor.extract(html_content)
+        occurrences = self.tokenize_with_offsets(text)
+        tokens = [word for word, _, _ in occurrences]
 
         # Убираем дубликаты
         unique_tokens = []
@@ -108,7 +119,7 @@ class TextProcessor:
 
         lemmas = self.lemmatize_words(tokens)
 
-        return unique_tokens, lemmas
+        return unique_tokens, lemmas, title, occurrences
 
     def save_tokens(self, tokens, output_file):
         """Сохраняет токены в файл"""
@@ -123,40 +134,178 @@ class TextProcessor:
             for lemma, words in sorted(lemmas.items()):
                 f.write(f"{lemma} {' '.join(words)}\n")
 
-    def process_all_pages(self):
-        """Обрабатывает все HTML-файлы"""
+    def load_changed_pages(self, changed_file):
+        """Читает список изменившихся страниц, записанный краулером"""
+        with open(changed_file, 'r', encoding='utf-8') as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def save_page(self, page_num, html_content):
+        """Обрабатывает страницу и сохраняет ее токены и леммы;
+        возвращает число токенов и лемм"""
+        tokens, lemmas, title, occurrences = self.process_html(html_content)
+        if title:
+            self.titles[page_num] = title
+        self.page_hashes[page_num] = content_hash(html_content)
+
+        tokens_file = os.path.join(self.tokens_dir, f"{page_num}.txt")
+        lemmas_file = os.path.join(self.lemmas_dir, f"{page_num}.txt")
+
+        self.save_tokens(tokens, tokens_file)
+        self.save_lemmas(lemmas, lemmas_file)
+        # Полная последовательность токенов с позициями (для частот и фраз)
+        positions_file = os.path.join(self.positions_dir, f"{page_num}.bin")
+        write_token_stream(positions_file, occurrences, self.lemmatizer.lemmatize)
+
+        return len(tokens), len(lemmas)
+
+    def remove_pages(self, page_nums):
+        """Удаляет результаты страниц, которых больше нет среди входных"""
+        for page_num in page_nums:
+            for output_file in (os.path.join(self.tokens_dir, f"{page_num}.txt"),
+                                os.path.join(self.lemmas_dir, f"{page_num}.txt"),
+                                os.path.join(self.positions_dir, f"{page_num}.bin")):
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+            self.removed_titles.add(page_num)
+            print(f"✗ {page_num}: страница удалена")
+
+    def process_all_pages(self, only=None, workers=1, incremental=False):
+        """Обрабатывает все HTML-файлы (или только страницы из only);
+        incremental - только новые и изменившиеся с прошлого запуска страницы"""
+        manifest = Manifest(self.manifest_file,
+                            params={'extractor': self.extractor_name, 'wiki': self.wiki})
         html_files = self.get_html_files()
 
+        if incremental:
+            # Содержимое читается только у страниц с новой отметкой в хранилище
+            # (или новым размером и временем изменения файла)
+            changed, removed = manifest.changes(self.pages.names(), self.pages.stamp,
+                                                self.pages.read)
+            self.remove_pages(removed)
+            only = {name + '.html' for name in changed}
+        elif only is None:
+            manifest.clear()
+
+        if only is not None:
+            html_files = [f for f in html_files if os.path.basename(f) in only]
+
         print(f"Найдено HTML-файлов: {len(html_files)}")
         print("Начинаем обработку...")
 
+        os.makedirs(self.tokens_dir, exist_ok=True)
+        os.makedirs(self.lemmas_dir, exist_ok=True)
+        os.makedirs(self.positions_dir, exist_ok=True)
+
+        if workers > 1:
+            # Страницы раздаются процессам пачками; каждый процесс сам читает
+            # страницы и пишет свои файлы, а map возвращает результаты в исходном
+            # порядке, поэтому вывод и статистика совпадают с последовательным режимом
+            page_nums = [self.get_page_number(f) for f in html_files]
+            chunksize = max(1, len(page_nums) // (workers * 4))
+            executor = ProcessPoolExecutor(workers, initializer=init_worker,
+                                           initargs=(self.pages_dir, self.output_dir,
+                                                     self.extractor_name, self.wiki))
+            new_entries = {}
+            with executor:
+                results = executor.map(process_page, page_nums, chunksize=chunksize)
+                self.report(self.collect_results(page_nums, results, new_entries))
+            self.save_dictionary(new_entries)
+        else:
+            # Страницы читаются последовательно (для хранилища - сегментами целиком)
+            if only is None:
+                pages = self.pages.scan()
+            else:
+                pages = ((self.get_page_number(f), self.pages.read(f)) for f in html_files)
+
+            self.report((page_num, self.save_page(page_num, html_content))
+                        for page_num, html_content in pages)
+            self.save_dictionary()
+
+        self.save_titles()
+
+        # Манифест пишется последним: после сбоя страницы обработаются заново
+        for page_num, digest in self.page_hashes.items():
+            manifest.record(page_num, self.pages.stamp(page_num), digest)
+        manifest.save()
+
+    def collect_results(self, page_nums, results, new_entries):
+        """Результаты процессов: статистика по страницам, названия и новые слова словаря"""
+        for page_num, (counts, title, digest, entries) in zip(page_nums, results):
+            new_entries.update(entries)
+            if title:
+                self.titles[page_num] = title
+            self.page_hashes[page_num] = digest
+            yield page_num, counts
+
+    def save_titles(self):
+        """Сохраняет названия страниц для индексов hw3 и hw5
+        (при обработке части страниц остальные названия сохраняются)"""
+        titles = load_titles(self.titles_file)
+        titles.update(self.titles)
+        for page_num in self.removed_titles:
+            titles.pop(page_num, None)
+        with open(self.titles_file, 'w', encoding='utf-8') as f:
+            for page_num, title in sorted(titles.items()):
+                f.write(f"{page_num}\t{title}\n")
+
+    def save_dictionary(self, extra_entries=None):
+        """Сохраняет словарь слово -> лемма для следующих запусков и поиска"""
+        new_words = len(self.lemmatizer.new_entries) + len(extra_entries or {})
+        self.lemmatizer.save(extra_entries=extra_entries)
+        print(f"Словарь лемм: {len(self.lemmatizer.dictionary)} слов "
+              f"(новых: {new_words}) сохранен в {self.dictionary_file}")
+
+    def report(self, results):
+        """Печатает статистику по мере обработки страниц"""
         total_tokens = 0
 
-        for html_file in html_files:
-            # Получаем номер страницы
-            page_num = self.get_page_number(html_file)
+        for page_num, (tokens_count, lemmas_count) in results:
+            # Статистика
+            total_tokens += tokens_count
 
-            # Обрабатываем файл
-            tokens, lemmas = self.process_file(html_file)
+            print(f"✓ {page_num}: {tokens_count} токенов, {lemmas_count} лемм")
 
-            # Сохраняем результаты
-            tokens_file = os.path.join(self.tokens_dir, f"{page_num}.txt")
-            lemmas_file = os.path.join(self.lemmas_dir, f"{page_num}.txt")
+        print(f"\nОбработка завершена!")
+        print(f"Всего уникальных токенов (по всем страницам): {total_tokens}")
 
-            self.save_tokens(tokens, tokens_file)
-            self.save_lemmas(lemmas, lemmas_file)
 
-            # Статистика
-            total_tokens += len(tokens)
+# Обработчик страниц в процессе-исполнителе: создается один раз на процесс,
+# вместе с ним один раз загружаются MorphAnalyzer и стоп-слова
+worker_processor = None
 
-            print(f"✓ {page_num}: {len(tokens)} токенов, {len(lemmas)} лемм")
 
-        print(f"\nОбработка завершена!")
-        print(f"Всего уникальных токенов (по всем страницам): {total_tokens}")
+def init_worker(pages_dir, output_dir, extractor='bs4', wiki=False):
+    global worker_processor
+    worker_processor = TextProcessor(pages_dir, output_dir, extractor, wiki)
+
+
+def process_page(page_num):
+    counts = worker_processor.save_page(page_num, worker_processor.pages.read(page_num))
+    # Название, хеш страницы и новые пары слово -> лемма возвращаются главному процессу
+    title = worker_processor.titles.pop(page_num, None)
+    digest = worker_processor.page_hashes.pop(page_num)
+    return counts, title, digest, worker_processor.lemmatizer.take_new_entries()
+
 
 def main():
-    processor = TextProcessor()
-    processor.process_all_pages()
+    parser = argparse.ArgumentParser(description="Токенизация и лемматизация страниц")
+    parser.add_argument('--pages-dir', default='../hw1/pages',
+                        help="папка с HTML-страницами или сжатое хранилище страниц")
+    parser.add_argument('--changed', help="обработать только страницы из списка "
+                                          "(например, ../hw1/changed_pages.txt)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="число процессов для обработки страниц")
+    parser.add_argument('--extractor', choices=['bs4', 'fast'], default='bs4',
+                        help="извлечение текста: bs4 (BeautifulSoup) или fast (потоковый разбор)")
+    parser.add_argument('--wiki', action='store_true',
+                        help="брать только текст статьи Википедии (без навигации и сносок)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="обработать только новые и изменившиеся страницы (по manifest.json)")
+    args = parser.parse_args()
+
+    processor = TextProcessor(pages_dir=args.pages_dir, extractor=args.extractor, wiki=args.wiki)
+    only = processor.load_changed_pages(args.changed) if args.changed else None
+    processor.process_all_pages(only, args.workers, args.incremental)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
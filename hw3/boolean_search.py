@@ -1,125 +1,182 @@
 import os
-import json
-from collections import defaultdict
-import pymorphy3
+import sys
+import time
+import argparse
+from functools import lru_cache
 from index_builder import IndexBuilder
+from query_planner import QueryPlanner, normalize_query
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.lemmatizer import Lemmatizer
+from common.roaring import RoaringBitmap
+from common.binary_index import BooleanIndexFile
+from common.manifest import file_stamp
+from common.query_cache import QueryCache
+from common.batch_search import read_queries, run_batch
 
 class BooleanSearch:
     """Класс для поиска по индексу"""
 
-    def __init__(self, index_file='inverted_index.json'):
+    def __init__(self, index_file='inverted_index.bin',
+                 dictionary_file='../hw2/lemma_dictionary.txt',
+                 cache_size=1024, cache_ttl=300.0):
         self.index_file = index_file
-        self.inverted_index = defaultdict(set)
-        self.doc_ids = {}
-        self.id_to_file = {}
-        self.id_to_title = {}
-        self.morph = pymorphy3.MorphAnalyzer()
+        self.index = None
+        self.index_stamp = None
+        self.inverted_index = {}
+        self.all_docs = RoaringBitmap()
+        self.planner = QueryPlanner(self.inverted_index, self.all_docs)
+        # Словарь лемм из hw2: частые слова запроса не требуют разбора pymorphy3
+        self.lemmatizer = Lemmatizer(dictionary_file)
+        self.stop_words = self.load_stop_words()
+        # Результаты повторяющихся запросов; сбрасываются при перестройке индекса
+        self.cache = QueryCache(cache_size, cache_ttl)
+
+    def load_stop_words(self):
+        """Стоп-слова hw2: во фразах они не ищутся, но занимают место между словами"""
+        try:
+            from nltk.corpus import stopwords
+            return set(stopwords.words('russian'))
+        except (ImportError, LookupError):
+            return set()
 
     def load_index(self):
         if not os.path.exists(self.index_file):
             return False
 
-        with open(self.index_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        previous = self.index
+        try:
+            # Файл открывается через mmap: время запуска не зависит от размера
+            # индекса, списки страниц читаются только для лемм из запроса
+            stamp = file_stamp(self.index_file)
+            self.index = BooleanIndexFile(self.index_file)
+            self.index_stamp = stamp
+        except ValueError as e:
+            print(f"{e}, нужно построить индекс заново")
+            return False
 
-        for lemma, doc_list in data['index'].items():
-            self.inverted_index[lemma] = set(doc_list)
+        self.inverted_index = self.index
+        self.all_docs = self.index.all_docs()
+        self.planner = QueryPlanner(self.inverted_index, self.all_docs)
+        if previous is not None:
+            # Прежний файл закрывается, когда планировщик и кэш переключены
+            # на новый: иначе каждая перестройка оставляла бы открытыми mmap
+            # и дескриптор файла
+            self.cache.check_version(self.index_version)
+            previous.close()
+
+        print(f"Индекс загружен. Документов: {len(self.index.documents)}, лемм: {len(self.index)}")
+        return True
 
-        self.doc_ids = data['doc_ids']
-        self.id_to_file = {int(k): v for k, v in data['id_to_file'].items()}
-        self.id_to_title = {int(k): v for k, v in data['id_to_title'].items()}
+    def refresh_index(self):
+        """Перезагружает индекс, если построитель записал новый файл"""
+        if self.index is not None and file_stamp(self.index_file) != self.index_stamp:
+            self.load_index()
 
-        print(f"Индекс загружен. Документов: {len(self.doc_ids)}, лемм: {len(self.inverted_index)}")
-        return True
+    @property
+    def index_version(self):
+        """Отметка сборки индекса (ключ актуальности кэша)"""
+        return self.index.file.build_id if self.index else None
+
+    # Таблицы документов читаются из индекса при первом обращении
+    @property
+    def doc_ids(self):
+        return self.index.doc_ids if self.index else {}
+
+    @property
+    def id_to_file(self):
+        return self.index.id_to_file if self.index else {}
+
+    @property
+    def id_to_title(self):
+        return self.index.id_to_title if self.index else {}
 
     def build_index_from_scratch(self):
         """Автоматически строит индекс если файл не найден"""
         print("Файл индекса не найден. Строим индекс...")
         builder = IndexBuilder()
-        builder.build()
-        builder.save(self.index_file)
+        builder.update(self.index_file, full=True)
         return self.load_index()
 
     def lemmatize_query_term(self, term):
         term = term.lower().strip()
-        return self.morph.parse(term)[0].normal_form
-
-    def tokenize_query(self, query):
-        query = query.replace('(', ' ( ').replace(')', ' ) ')
-        return query.split()
-
-    def apply_operator(self, operator, value_stack):
-        if operator == 'NOT':
-            if len(value_stack) >= 1:
-                set1 = value_stack.pop()
-                all_docs = set(self.id_to_file.keys())
-                value_stack.append(all_docs - set1)
-        else:
-            if len(value_stack) >= 2:
-                set2 = value_stack.pop()
-                set1 = value_stack.pop()
-                if operator == 'AND':
-                    value_stack.append(set1 & set2)
-                elif operator == 'OR':
-                    value_stack.append(set1 | set2)
-
-    def parse_query(self, query):
+        return self.lemmatizer.lemmatize(term)
+
+    def parse_query(self, query, lemmatize=None):
+        """Запрос разбирается в дерево, которое оптимизируется по длинам
+        списков страниц и выполняется (query_planner.py)"""
+        lemmatize = lemmatize or self.lemmatize_query_term
         query = query.strip()
-        if ' ' not in query and '(' not in query:
-            lemma = self.lemmatize_query_term(query)
-            return self.inverted_index.get(lemma, set())
-
-        tokens = self.tokenize_query(query)
-        value_stack = []
-        op_stack = []
-        precedence = {'NOT': 3, 'AND': 2, 'OR': 1}
-
-        i = 0
-        while i < len(tokens):
-            token = tokens[i].upper()
-            if token == '(':
-                op_stack.append(token)
-            elif token == ')':
-                while op_stack and op_stack[-1] != '(':
-                    self.apply_operator(op_stack.pop(), value_stack)
-                op_stack.pop()
-            elif token in precedence:
-                while (op_stack and op_stack[-1] != '(' and
-                       precedence.get(op_stack[-1], 0) >= precedence[token]):
-                    self.apply_operator(op_stack.pop(), value_stack)
-                op_stack.append(token)
-            else:
-                lemma = self.lemmatize_query_term(token)
-                doc_set = self.inverted_index.get(lemma, set())
-                value_stack.append(doc_set)
-            i += 1
-
-        while op_stack:
-            self.apply_operator(op_stack.pop(), value_stack)
-
-        return value_stack[0] if value_stack else set()
+        if not any(c in query for c in ' ("*'):
+            lemma = lemmatize(query)
+            if self.planner.in_batch:
+                return self.planner.term_postings(lemma)
+            return self.inverted_index.get(lemma, RoaringBitmap())
+
+        tree = self.planner.plan(query, lemmatize, self.stop_words)
+        return self.planner.execute(tree)
+
+    def explain(self, query):
+        """Дерево запроса после оптимизации (в порядке выполнения)"""
+        return self.planner.plan(query, self.lemmatize_query_term, self.stop_words)
 
     def search(self, query):
         print(f"\nЗапрос: {query}")
-        doc_ids = self.parse_query(query)
+        self.refresh_index()
+        results, _ = self.lookup(query)
 
-        if not doc_ids:
+        if not results:
             print("Ничего не найдено")
             return []
 
+        print(f"Найдено: {len(results)}")
+        # Копии: изменения результатов вызывающим кодом не попадут в кэш
+        return [dict(r) for r in results]
+
+    def lookup(self, query, lemmatize=None):
+        """Результаты запроса (из кэша или из индекса) и признак попадания в кэш"""
+        lemmatize = lemmatize or self.lemmatize_query_term
+        key = ('boolean', normalize_query(query, lemmatize, self.stop_words))
+        results = self.cache.get(key, self.index_version)
+        if results is not None:
+            return results, True
+        results = self.find_documents(query, lemmatize)
+        self.cache.put(key, self.index_version, results)
+        return results, False
+
+    def search_many(self, queries):
+        """Пакет запросов без вывода на экран: для каждого - найденные
+        страницы и время выполнения. Леммы слов и списки страниц лемм
+        берутся из индекса один раз на весь пакет, повторы запросов - из кэша"""
+        self.refresh_index()
+        lemmatize = lru_cache(maxsize=None)(self.lemmatize_query_term)
+
+        records = []
+        with self.planner.batch():
+            for query in queries:
+                start = time.perf_counter()
+                results, cached = self.lookup(query, lemmatize)
+                records.append({
+                    'query': query,
+                    'count': len(results),
+                    'results': [dict(r) for r in results],
+                    'latency_ms': (time.perf_counter() - start) * 1000,
+                    'cached': cached,
+                })
+        return records
+
+    def find_documents(self, query, lemmatize=None):
         results = []
-        for doc_id in sorted(doc_ids):
+        for doc_id in sorted(self.parse_query(query, lemmatize)):
             results.append({
                 'title': self.id_to_title[doc_id],
                 'file': self.id_to_file[doc_id]
             })
-
-        print(f"Найдено: {len(results)}")
         return results
 
     def interactive_mode(self):
-        print("\nБулев поиск. Операторы: AND, OR, NOT, скобки")
-        print("Для выхода: exit\n")
+        print("\nБулев поиск. Операторы: AND, OR, NOT, NEAR/k, скобки, \"фраза\", шаблоны с *")
+        print("Статистика кэша: stats, для выхода: exit\n")
 
         while True:
             query = input(">> ").strip()
@@ -127,6 +184,9 @@ class BooleanSearch:
                 break
             if not query:
                 continue
+            if query.lower() == 'stats':
+                print(f"Кэш: {self.cache.stats()}")
+                continue
 
             results = self.search(query)
             if results:
@@ -135,7 +195,22 @@ class BooleanSearch:
 
 
 def main():
-    search = BooleanSearch()
+    parser = argparse.ArgumentParser(description="Булев поиск по инвертированному индексу")
+    parser.add_argument('--index-file', default='inverted_index.bin')
+    parser.add_argument('--queries', metavar='FILE',
+                        help="выполнить запросы из файла (по строке на запрос, '-' - stdin) "
+                             "и записать результаты в JSONL")
+    parser.add_argument('--output', help="файл для результатов (по умолчанию stdout)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="процессов для пакетного поиска")
+    args = parser.parse_args()
+
+    # В пакетном режиме stdout занят результатами, сообщения - в stderr
+    stdout = sys.stdout
+    if args.queries:
+        sys.stdout = sys.stderr
+
+    search = BooleanSearch(args.index_file)
 
     # Пытаемся загрузить индекс, если нет - строим автоматически
     if not search.load_index():
@@ -143,7 +218,17 @@ def main():
             print("Не удалось построить индекс")
             return
 
-    search.interactive_mode()
+    if not args.queries:
+        search.interactive_mode()
+        return
+
+    queries = read_queries(args.queries)
+    output = open(args.output, 'w', encoding='utf-8') if args.output else stdout
+    try:
+        run_batch(search, queries, output, args.workers, {'index_file': args.index_file})
+    finally:
+        if output is not stdout:
+            output.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,32 +1,54 @@
 import re
-import json
+import sys
+import argparse
+from array import array
 from collections import defaultdict
 import os
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.page_store import open_pages
+from common.html_extract import clean_title, load_titles
+from common.manifest import Manifest, file_stamp, read_files
+from common.binary_index import BooleanIndexFile, write_boolean_index
+from common.token_stream import TokenStream
+
 class IndexBuilder:
     """Класс для построения инвертированного индекса"""
 
-    def __init__(self, lemmas_dir='../hw2/lemmas', pages_dir='../hw1/pages'):
+    def __init__(self, lemmas_dir='../hw2/lemmas', pages_dir='../hw1/pages',
+                 titles_file='../hw2/titles.txt', positions_dir='../hw2/positions'):
         self.lemmas_dir = lemmas_dir
+        # Последовательности токенов hw2: из них строится позиционный индекс
+        self.positions_dir = positions_dir
         self.pages_dir = pages_dir
+        self.pages = open_pages(pages_dir)  # папка с HTML или сжатое хранилище
+        # Названия, полученные hw2 при разборе страниц (HTML повторно не читается)
+        self.titles = load_titles(titles_file)
         self.inverted_index = defaultdict(set)
+        self.positions = defaultdict(dict)  # лемма -> {doc_id: номера слов}
         self.doc_ids = {}
         self.id_to_file = {}
         self.id_to_title = {}
 
     def extract_title_from_html(self, html_file):
+        title = self.titles.get(os.path.splitext(os.path.basename(html_file))[0])
+        if title:
+            return title
         try:
-            with open(html_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-            title_match = re.search(r'<title>(.*?)</title>', content, re.IGNORECASE)
-            if title_match:
-                title = title_match.group(1)
-                title = re.sub(r'[-–—]\s*Википедия.*$', '', title).strip()
+            title = self.extract_title(self.pages.read(html_file))
+            if title:
                 return title
         except:
             pass
         return os.path.basename(html_file)
 
+    def extract_title(self, content):
+        """Название страницы из HTML (без суффикса "- Википедия")"""
+        title_match = re.search(r'<title>(.*?)</title>', content, re.IGNORECASE)
+        if title_match:
+            return clean_title(title_match.group(1))
+        return None
+
     def extract_page_number(self, filename):
         match = re.search(r'page_(\d+)\.txt', filename)
         if match:
@@ -43,45 +65,168 @@ class IndexBuilder:
                 lemma = parts[0]
                 self.inverted_index[lemma].add(doc_id)
 
-    def build(self):
-        print("Построение индекса...")
-        lemma_files = [f for f in os.listdir(self.lemmas_dir) if f.endswith('.txt')]
-        lemma_files.sort()
+    def stream_path(self, filename):
+        return os.path.join(self.positions_dir, filename.replace('.txt', '.bin'))
+
+    def load_positions_file(self, filepath, doc_id):
+        """Номера слов каждой леммы документа из последовательности токенов"""
+        with TokenStream(filepath) as stream:
+            by_lemma = defaultdict(lambda: array('I'))
+            term_lemma = stream.term_lemma
+            for term_id, position in zip(stream.term_ids, stream.positions):
+                by_lemma[term_lemma[term_id]].append(position)
+            lemmas = stream.lemmas
+            for lemma_id, positions in by_lemma.items():
+                self.positions[lemmas[lemma_id]][doc_id] = positions
 
-        for filename in lemma_files:
-            page_num = self.extract_page_number(filename)
-            if page_num is None:
-                print(f"Пропущен файл: {filename}")
-                continue
+    def add_document(self, doc_id, filename, title, lemmas, occurrences=None):
+        """Добавляет в индекс уже обработанный документ (без чтения файлов);
+        occurrences - пары (лемма, номер слова) для позиционного индекса"""
+        self.doc_ids[filename] = doc_id
+        self.id_to_file[doc_id] = filename
+        self.id_to_title[doc_id] = title
+        for lemma in lemmas:
+            self.inverted_index[lemma].add(doc_id)
+        for lemma, position in occurrences or ():
+            self.positions[lemma].setdefault(doc_id, array('I')).append(position)
 
-            filepath = os.path.join(self.lemmas_dir, filename)
-            doc_id = page_num
-            self.doc_ids[filename] = doc_id
-            self.id_to_file[doc_id] = filename
+    def lemma_files(self):
+        return sorted(f for f in os.listdir(self.lemmas_dir) if f.endswith('.txt'))
 
-            html_filename = filename.replace('.txt', '.html')
-            html_filepath = os.path.join(self.pages_dir, html_filename)
-            self.id_to_title[doc_id] = self.extract_title_from_html(html_filepath)
+    def load_document(self, filename):
+        """Читает файл лемм документа и добавляет документ в индекс"""
+        page_num = self.extract_page_number(filename)
+        if page_num is None:
+            print(f"Пропущен файл: {filename}")
+            return
 
-            self.load_lemmas_file(filepath, doc_id)
+        filepath = os.path.join(self.lemmas_dir, filename)
+        doc_id = page_num
+        self.doc_ids[filename] = doc_id
+        self.id_to_file[doc_id] = filename
+
+        html_filename = filename.replace('.txt', '.html')
+        html_filepath = os.path.join(self.pages_dir, html_filename)
+        self.id_to_title[doc_id] = self.extract_title_from_html(html_filepath)
+
+        self.load_lemmas_file(filepath, doc_id)
+        if os.path.exists(self.stream_path(filename)):
+            self.load_positions_file(self.stream_path(filename), doc_id)
+
+    def remove_documents(self, doc_ids):
+        """Убирает документы из индекса (перед повторным добавлением измененных)"""
+        doc_ids = set(doc_ids)
+        for lemma in list(self.inverted_index):
+            postings = self.inverted_index[lemma]
+            postings -= doc_ids
+            if not postings:
+                del self.inverted_index[lemma]
+        for lemma in list(self.positions):
+            doc_positions = self.positions[lemma]
+            for doc_id in doc_ids:
+                doc_positions.pop(doc_id, None)
+            if not doc_positions:
+                del self.positions[lemma]
+
+        for doc_id in doc_ids:
+            filename = self.id_to_file.pop(doc_id, None)
+            self.doc_ids.pop(filename, None)
+            self.id_to_title.pop(doc_id, None)
+
+    def build(self):
+        print("Построение индекса...")
+        for filename in self.lemma_files():
+            self.load_document(filename)
 
         print(f"Индекс построен. Документов: {len(self.doc_ids)}, лемм: {len(self.inverted_index)}")
+        if not self.positions:
+            print(f"Нет последовательностей токенов в {self.positions_dir}: "
+                  f"фразы и NEAR будут проверяться только по наличию слов")
         return self.inverted_index, self.doc_ids, self.id_to_file, self.id_to_title
 
-    def save(self, index_file='inverted_index.json'):
-        index_to_save = {}
-        for lemma, doc_set in self.inverted_index.items():
-            index_to_save[lemma] = list(doc_set)
+    def document_stamp(self, filename):
+        return file_stamp(os.path.join(self.lemmas_dir, filename), self.stream_path(filename))
+
+    def document_content(self, filename):
+        # Название входит в хеш: оно тоже хранится в индексе
+        title = self.titles.get(os.path.splitext(filename)[0], '')
+        return (read_files(os.path.join(self.lemmas_dir, filename), self.stream_path(filename)) +
+                title.encode('utf-8'))
+
+    def update(self, index_file='inverted_index.bin', full=False):
+        """Обновляет сохраненный индекс: перечитываются только новые и изменившиеся
+        файлы лемм, удаленные документы убираются из списков страниц
+        (full - построить индекс заново и записать манифест)"""
+        manifest = Manifest(os.path.splitext(index_file)[0] + '.manifest.json')
+        if full or not manifest.entries or not self.load(index_file):
+            # Прошлой версии нет - строим индекс целиком
+            manifest.clear()
+            self.build()
+            manifest.changes(self.lemma_files(), self.document_stamp, self.document_content)
+        else:
+            changed, removed = manifest.changes(self.lemma_files(), self.document_stamp,
+                                                self.document_content)
+            if not changed and not removed:
+                print("Изменений нет, индекс актуален")
+                return index_file
+
+            self.remove_documents(self.extract_page_number(f) for f in changed + removed)
+            for filename in changed:
+                self.load_document(filename)
+            print(f"Индекс обновлен: изменено {len(changed)}, удалено {len(removed)}. "
+                  f"Документов: {len(self.doc_ids)}, лемм: {len(self.inverted_index)}")
+
+        self.save(index_file)
+        manifest.save()
+        return index_file
+
+    def load(self, index_file='inverted_index.bin'):
+        """Загружает сохраненный индекс для обновления"""
+        if not os.path.exists(index_file):
+            return False
+        try:
+            index = BooleanIndexFile(index_file)
+        except ValueError as e:
+            # Индекс в другом формате или другой версии - строится заново
+            print(e)
+            return False
 
-        data = {
-            'index': index_to_save,
-            'doc_ids': self.doc_ids,
-            'id_to_file': self.id_to_file,
-            'id_to_title': self.id_to_title
-        }
+        for lemma, postings in index.items():
+            self.inverted_index[lemma] = set(postings)
+        self.load_positions(index)
+        self.doc_ids = index.doc_ids
+        self.id_to_file = index.id_to_file
+        self.id_to_title = index.id_to_title
+        index.close()
+        return True
 
-        with open(index_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    def load_positions(self, index):
+        # Отдельный метод: представления над mmap освобождаются при выходе
+        # из него, до закрытия файла индекса
+        for lemma, term_positions in index.positions_items():
+            doc_positions = dict(term_positions.items())
+            if doc_positions:
+                self.positions[lemma] = doc_positions
 
+    def save(self, index_file='inverted_index.bin'):
+        # Двоичный индекс: словарь лемм, битовые карты страниц, позиции лемм
+        # и таблица документов в секциях, которые поиск читает через mmap
+        write_boolean_index(index_file, self.inverted_index, self.doc_ids,
+                            self.id_to_file, self.id_to_title, self.positions)
         print(f"Индекс сохранен в {index_file}")
-        return index_file
\ No newline at end of file
+        return index_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Построение инвертированного индекса")
+    parser.add_argument('--index-file', default='inverted_index.bin')
+    parser.add_argument('--incremental', action='store_true',
+                        help="обновить сохраненный индекс только по изменившимся документам")
+    args = parser.parse_args()
+
+    builder = IndexBuilder()
+    builder.update(args.index_file, full=not args.incremental)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+import os
+import re
+import sys
+from bisect import bisect_left
+from contextlib import contextmanager
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.roaring import RoaringBitmap
+from common.term_dict import MAX_EXPANSIONS, pattern_regex
+
+# NEAR/k связывает сильнее NOT: NOT a NEAR/3 b = NOT (a NEAR/3 b)
+PRECEDENCE = {'NEAR': 4, 'NOT': 3, 'AND': 2, 'OR': 1}
+
+# Токены запроса: фраза в кавычках, скобка или слово
+QUERY_TOKEN = re.compile(r'"[^"]*"?|[()]|[^\s()"]+')
+NEAR_OPERATOR = re.compile(r'NEAR/(\d+)$')
+# Слова фразы - как при токенизации в hw2 (номера слов считаются так же)
+WORD = re.compile(r'\b[а-яА-ЯёЁ]{2,}\b')
+
+
+# ---------- дерево запроса ----------
+
+class Term:
+    def __init__(self, lemma):
+        self.lemma = lemma
+
+    def __repr__(self):
+        return self.lemma
+
+
+class Wildcard:
+    """Шаблон с * - заменяется на OR подходящих лемм при оптимизации"""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def __repr__(self):
+        return self.pattern
+
+
+class Phrase:
+    """Фраза: леммы со смещениями относительно первого слова
+    (стоп-слова не индексируются, но занимают свое место)"""
+
+    def __init__(self, words):
+        self.words = words
+
+    def __repr__(self):
+        return '"' + ' '.join(lemma for _, lemma in self.words) + '"'
+
+
+class Near:
+    """Операнды на расстоянии не больше distance слов друг от друга"""
+
+    def __init__(self, left, right, distance):
+        self.left = left
+        self.right = right
+        self.distance = distance
+
+    def __repr__(self):
+        return f"({self.left!r} NEAR/{self.distance} {self.right!r})"
+
+
+class Not:
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return f"NOT {self.child!r}"
+
+
+class And:
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return '(' + ' AND '.join(map(repr, self.children)) + ')'
+
+
+class Or:
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return '(' + ' OR '.join(map(repr, self.children)) + ')'
+
+
+def tokenize_query(query):
+    return QUERY_TOKEN.findall(query)
+
+
+def parse_phrase(text, lemmatize, stop_words=()):
+    """Фраза в кавычках -> Phrase (из одного слова - Term)"""
+    words = []
+    for position, match in enumerate(WORD.finditer(text)):
+        word = match.group().lower()
+        if word in stop_words:
+            continue
+        words.append((position, lemmatize(word)))
+    if len(words) == 1:
+        return Term(words[0][1])
+    first = words[0][0] if words else 0
+    return Phrase([(position - first, lemma) for position, lemma in words])
+
+
+def operator_name(token):
+    if NEAR_OPERATOR.match(token):
+        return 'NEAR'
+    return token if token in PRECEDENCE and token != 'NEAR' else None
+
+
+def parse_query(query, lemmatize, stop_words=()):
+    """Разбор запроса в дерево алгоритмом сортировочной станции.
+
+    Приоритеты и обработка ошибок как у прежнего вычисления по стеку:
+    оператор без операндов пропускается, из нескольких выражений подряд
+    без оператора берется первое. Пустой запрос - None"""
+    value_stack = []
+    op_stack = []
+
+    def apply(operator):
+        if operator == 'NOT':
+            if value_stack:
+                value_stack.append(Not(value_stack.pop()))
+        elif len(value_stack) >= 2:
+            right = value_stack.pop()
+            left = value_stack.pop()
+            if operator == 'AND':
+                value_stack.append(And([left, right]))
+            elif operator == 'OR':
+                value_stack.append(Or([left, right]))
+            else:
+                distance = int(NEAR_OPERATOR.match(operator).group(1))
+                value_stack.append(Near(left, right, distance))
+
+    for token in tokenize_query(query):
+        upper = token.upper()
+        name = operator_name(upper)
+        if upper == '(':
+            op_stack.append(upper)
+        elif upper == ')':
+            while op_stack and op_stack[-1] != '(':
+                apply(op_stack.pop())
+            if op_stack:
+                op_stack.pop()
+        elif name:
+            while (op_stack and op_stack[-1] != '(' and
+                   PRECEDENCE[operator_name(op_stack[-1])] >= PRECEDENCE[name]):
+                apply(op_stack.pop())
+            op_stack.append(upper)
+        elif token.startswith('"'):
+            value_stack.append(parse_phrase(token, lemmatize, stop_words))
+        elif '*' in token:
+            # Шаблон не лемматизируется: он сравнивается с леммами словаря
+            value_stack.append(Wildcard(token.lower()))
+        else:
+            value_stack.append(Term(lemmatize(token)))
+
+    while op_stack:
+        operator = op_stack.pop()
+        if operator != '(':
+            apply(operator)
+
+    return value_stack[0] if value_stack else None
+
+
+def normalize_query(query, lemmatize, stop_words=()):
+    """Запрос в каноническом виде (ключ кэша): слова заменены леммами,
+    операторы - в верхнем регистре, фразы - леммами со смещениями"""
+    parts = []
+    for token in tokenize_query(query):
+        upper = token.upper()
+        if upper in ('(', ')') or operator_name(upper):
+            parts.append(upper)
+        elif token.startswith('"'):
+            node = parse_phrase(token, lemmatize, stop_words)
+            if isinstance(node, Term):
+                parts.append(f'"{node.lemma}"')
+            else:
+                parts.append('"' + ' '.join(f"{offset}:{lemma}" for offset, lemma in node.words) + '"')
+        elif '*' in token:
+            parts.append(token.lower())
+        else:
+            parts.append(lemmatize(token))
+    return ' '.join(parts)
+
+
+# ---------- оптимизация и выполнение ----------
+
+class DocSet:
+    """Результат подзапроса: множество страниц или его дополнение.
+
+    NOT только меняет флаг negated, дополнение до всех страниц строится
+    один раз - если оно нужно в итоговом результате"""
+
+    __slots__ = ('doc_ids', 'negated')
+
+    def __init__(self, doc_ids, negated=False):
+        self.doc_ids = doc_ids
+        self.negated = negated
+
+    def invert(self):
+        return DocSet(self.doc_ids, not self.negated)
+
+    def count(self, total):
+        return total - len(self.doc_ids) if self.negated else len(self.doc_ids)
+
+    def materialize(self, all_docs):
+        if self.negated:
+            return all_docs - self.doc_ids
+        return self.doc_ids
+
+
+class QueryPlanner:
+    """Оптимизирует дерево запроса по длинам списков страниц и выполняет его.
+
+    - вложенные AND и OR сливаются в один узел с несколькими операндами;
+    - операнды AND пересекаются от самого короткого списка, пересечение
+      прекращается, как только результат стал пустым;
+    - a AND NOT b выполняется как разность, без дополнения b до всех страниц;
+    - OR из нескольких операндов - одно k-путевое слияние;
+    - NOT не строит дополнение: подзапрос возвращает DocSet с флагом
+      отрицания, NOT a AND NOT b = NOT (a OR b), NOT a OR NOT b = NOT (a AND b),
+      a OR NOT b = NOT (b AND NOT a). Дополнение строится только для
+      итогового результата, если он отрицательный;
+    - шаблон с * заменяется на OR подходящих лемм (не больше MAX_EXPANSIONS),
+      которые объединяются одним k-путевым слиянием;
+    - фраза и NEAR/k сначала сужаются до страниц со всеми словами (обычным
+      AND), и только для этих страниц сливаются позиции слов.
+
+    Списки страниц - битовые карты (common/roaring.py): плотные части
+    пересекаются и объединяются машинными словами, редкие - слиянием массивов
+    с галопом. Длины списков берутся из заголовков сжатых карт, поэтому
+    оценка стоимости их не распаковывает"""
+
+    def __init__(self, inverted_index, all_docs):
+        self.inverted_index = inverted_index
+        self.all_docs = all_docs
+        # Без позиций (индекс построен без последовательностей токенов hw2)
+        # фразы и NEAR проверяются только по наличию всех слов
+        self.has_positions = getattr(inverted_index, 'has_positions', False)
+        self.postings = {}
+        self.positions = {}
+        self.in_batch = False
+
+    @contextmanager
+    def batch(self):
+        """Пакет запросов: списки страниц и позиции лемм читаются из индекса
+        один раз на весь пакет, а не на каждый запрос"""
+        self.in_batch = True
+        try:
+            yield self
+        finally:
+            self.in_batch = False
+            self.reset()
+
+    def reset(self):
+        self.postings = {}
+        self.positions = {}
+
+    def term_postings(self, lemma):
+        if lemma not in self.postings:
+            self.postings[lemma] = self.inverted_index.get(lemma, RoaringBitmap())
+        return self.postings[lemma]
+
+    def term_positions(self, lemma, doc_id):
+        if lemma not in self.positions:
+            self.positions[lemma] = self.inverted_index.positions(lemma)
+        term_positions = self.positions[lemma]
+        return term_positions.get(doc_id) if term_positions is not None else ()
+
+    def optimize(self, node):
+        if isinstance(node, Not):
+            child = self.optimize(node.child)
+            if isinstance(child, Not):
+                return child.child
+            return Not(child)
+
+        if isinstance(node, (And, Or)):
+            kind = type(node)
+            children = []
+            for child in node.children:
+                child = self.optimize(child)
+                if isinstance(child, kind):
+                    children.extend(child.children)
+                else:
+                    children.append(child)
+            if all(isinstance(child, Not) for child in children):
+                # Законы де Моргана: одно отрицание вместо нескольких
+                inverse = Or if kind is And else And
+                return Not(self.optimize(inverse([child.child for child in children])))
+            if kind is And:
+                # Сначала самые редкие операнды, отрицания - в конце
+                children.sort(key=lambda child: (isinstance(child, Not), self.cost(child)))
+            return kind(children)
+
+        if isinstance(node, Near):
+            return Near(self.optimize(node.left), self.optimize(node.right), node.distance)
+
+        if isinstance(node, Wildcard):
+            lemmas = self.expand(node.pattern)
+            if not lemmas:
+                # Такого термина в индексе нет - пустой результат
+                return Term(node.pattern)
+            if len(lemmas) == 1:
+                return Term(lemmas[0])
+            return Or([Term(lemma) for lemma in lemmas])
+
+        return node
+
+    def expand(self, pattern):
+        if hasattr(self.inverted_index, 'expand'):
+            return self.inverted_index.expand(pattern, MAX_EXPANSIONS)
+        # Индекс в памяти (словарь) - простой перебор
+        regex = pattern_regex(pattern)
+        return sorted(lemma for lemma in self.inverted_index if regex.match(lemma))[:MAX_EXPANSIONS]
+
+    def cost(self, node):
+        """Оценка числа страниц в результате узла"""
+        if isinstance(node, Term):
+            return len(self.term_postings(node.lemma))
+        if isinstance(node, Not):
+            return len(self.all_docs) - self.cost(node.child)
+        if isinstance(node, And):
+            return min(self.cost(child) for child in node.children)
+        if isinstance(node, Phrase):
+            return min((self.cost(Term(lemma)) for _, lemma in node.words), default=0)
+        if isinstance(node, Near):
+            return min(self.cost(node.left), self.cost(node.right))
+        return min(len(self.all_docs), sum(self.cost(child) for child in node.children))
+
+    def evaluate(self, node):
+        """DocSet узла: номера страниц или (для отрицания) номера исключенных"""
+        if isinstance(node, Term):
+            return DocSet(self.term_postings(node.lemma))
+
+        if isinstance(node, Not):
+            return self.evaluate(node.child).invert()
+
+        if isinstance(node, (Phrase, Near)):
+            return self.evaluate_positional(node)
+
+        if isinstance(node, Or):
+            positive, negative = self.evaluate_children(node.children)
+            union = RoaringBitmap.union_many(positive)
+            if not negative:
+                return DocSet(union)
+            # a OR NOT b OR NOT c = NOT ((b AND c) AND NOT a)
+            excluded = negative[0]
+            for doc_ids in negative[1:]:
+                excluded = excluded & doc_ids
+            return DocSet(excluded - union, negated=True)
+
+        positive, negative = self.evaluate_children(node.children, stop_on_empty=True)
+        if not positive:
+            # NOT a AND NOT b = NOT (a OR b)
+            return DocSet(RoaringBitmap.union_many(negative), negated=True)
+        if not negative or not positive[0]:
+            return DocSet(positive[0])
+        # a AND NOT b AND NOT c = a AND NOT (b OR c): одна разность
+        return DocSet(positive[0] - RoaringBitmap.union_many(negative))
+
+    def evaluate_children(self, children, stop_on_empty=False):
+        """Операнды AND или OR: положительные списки и списки отрицаний.
+
+        Для AND положительные операнды сразу пересекаются (в порядке
+        стоимости), и при пустом пересечении остальные не вычисляются"""
+        positive = []
+        negative = []
+        for child in children:
+            doc_set = self.evaluate(child)
+            if doc_set.negated:
+                negative.append(doc_set.doc_ids)
+            elif not stop_on_empty:
+                positive.append(doc_set.doc_ids)
+            elif positive:
+                positive[0] = positive[0] & doc_set.doc_ids
+            else:
+                positive.append(doc_set.doc_ids)
+            if stop_on_empty and positive and not positive[0]:
+                return positive, []
+        return positive, negative
+
+    # ---------- фразы и NEAR ----------
+
+    def is_positional(self, node):
+        if isinstance(node, (Term, Phrase)):
+            return True
+        if isinstance(node, Near):
+            return self.is_positional(node.left) and self.is_positional(node.right)
+        if isinstance(node, Or):
+            return all(self.is_positional(child) for child in node.children)
+        return False
+
+    def candidates(self, node):
+        """Страницы, где есть все слова фразы или операнды NEAR"""
+        if isinstance(node, Phrase):
+            lemmas = {lemma for _, lemma in node.words}
+            return self.optimize(And([Term(lemma) for lemma in lemmas]))
+        return self.optimize(And([node.left, node.right]))
+
+    def evaluate_positional(self, node):
+        if isinstance(node, Phrase) and not node.words:
+            return DocSet(RoaringBitmap())
+
+        candidates = self.evaluate(self.candidates(node))
+        if not self.has_positions or not self.is_positional(node):
+            # NEAR над выражением с AND или NOT - как AND
+            return candidates
+        return DocSet(RoaringBitmap.from_sorted(
+            doc_id for doc_id in candidates.doc_ids if self.match_positions(node, doc_id)))
+
+    def match_positions(self, node, doc_id):
+        """Отсортированные номера слов, с которых начинаются совпадения узла"""
+        if isinstance(node, Term):
+            return self.term_positions(node.lemma, doc_id)
+
+        if isinstance(node, Phrase):
+            starts = None
+            # Начинаем с самого редкого в документе слова фразы
+            words = sorted(node.words, key=lambda word: len(self.term_positions(word[1], doc_id)))
+            for offset, lemma in words:
+                shifted = {position - offset for position in self.term_positions(lemma, doc_id)}
+                starts = shifted if starts is None else starts & shifted
+                if not starts:
+                    return []
+            return sorted(starts)
+
+        if isinstance(node, Or):
+            matches = set()
+            for child in node.children:
+                matches.update(self.match_positions(child, doc_id))
+            return sorted(matches)
+
+        left = self.match_positions(node.left, doc_id)
+        right = self.match_positions(node.right, doc_id)
+        return sorted(set(within(left, right, node.distance)) |
+                      set(within(right, left, node.distance)))
+
+    def plan(self, query, lemmatize, stop_words=()):
+        if not self.in_batch:
+            self.reset()
+        tree = parse_query(query, lemmatize, stop_words)
+        return self.optimize(tree) if tree is not None else None
+
+    def execute(self, tree):
+        if tree is None:
+            return RoaringBitmap()
+        result = self.evaluate(tree).materialize(self.all_docs)
+        if not self.in_batch:
+            self.reset()
+        return result
+
+
+def within(positions, others, distance):
+    """Позиции, у которых в others есть позиция не дальше distance слов"""
+    for position in positions:
+        i = bisect_left(others, position - distance)
+        if i < len(others) and others[i] <= position + distance:
+            yield position
@@ -1,8 +1,15 @@
 import os
 import re
-import math
+import sys
+import argparse
 from collections import defaultdict, Counter
-import pymorphy3
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.manifest import Manifest, file_stamp, read_files
+from common.token_stream import TokenStream
+from common.tfidf_matrix import TfIdfMatrix
+from common.weights import TF_WEIGHTS, IDF_WEIGHTS
+from common.tfidf_file import TfIdfColumns, TfIdfFile, KINDS, combine, write_tfidf_file
 
 class TfIdfCalculator:
     """Класс для подсчета TF-IDF"""
@@ -10,18 +17,28 @@ class TfIdfCalculator:
     def __init__(self,
                  tokens_dir='../hw2/tokens',
                  lemmas_dir='../hw2/lemmas',
-                 output_dir='tfidf_results'):
+                 output_dir='tfidf_results',
+                 positions_dir='../hw2/positions',
+                 tf='relative',
+                 idf='smooth'):
 
         self.tokens_dir = tokens_dir
         self.lemmas_dir = lemmas_dir
+        # Последовательности токенов hw2: если есть, частоты берутся из них
+        self.positions_dir = positions_dir
         self.output_dir = output_dir
-
+        # Формулы весов (common/tfidf_matrix.py): по умолчанию tf - доля
+        # слов документа, idf - сглаженный логарифм
+        self.tf = tf
+        self.idf = idf
+
+        # Веса всех документов - в одном файле (common/tfidf_file.py);
+        # текстовые файлы по документам пишутся только для отладки (export_text)
+        self.output_file = os.path.join(output_dir, 'tfidf.bin')
         self.terms_output = os.path.join(output_dir, 'terms')
         self.lemmas_output = os.path.join(output_dir, 'lemmas')
-        os.makedirs(self.terms_output, exist_ok=True)
-        os.makedirs(self.lemmas_output, exist_ok=True)
-
-        self.morph = pymorphy3.MorphAnalyzer()
+        # Манифест входных файлов для инкрементального пересчета
+        self.manifest_file = os.path.join(output_dir, 'manifest.json')
 
         # Данные для подсчета
         self.doc_id_to_name = {}
@@ -29,12 +46,11 @@ class TfIdfCalculator:
         self.lemma_freq = defaultdict(dict)
         self.doc_term_count = {}
         self.doc_lemma_count = {}
-
-        # Глобальная статистика
-        self.docs_with_term = defaultdict(int)
-        self.docs_with_lemma = defaultdict(int)
         self.total_docs = 0
 
+        # Матрицы весов терминов и лемм; строятся заново после изменения статистики
+        self.matrices = {}
+
     def extract_page_number(self, filename):
         match = re.search(r'page_(\d+)', filename)
         if match:
@@ -45,12 +61,15 @@ class TfIdfCalculator:
         with open(filepath, 'r', encoding='utf-8') as f:
             terms = [line.strip() for line in f if line.strip()]
 
-        term_counter = Counter(terms)
-        self.term_freq[doc_id] = dict(term_counter)
-        self.doc_term_count[doc_id] = len(terms)
+        self.add_terms(doc_id, terms)
+
+    def add_terms(self, doc_id, terms):
+        self.add_term_counts(doc_id, Counter(terms), len(terms))
 
-        for term in set(terms):
-            self.docs_with_term[term] += 1
+    def add_term_counts(self, doc_id, term_counts, total_terms):
+        self.term_freq[doc_id] = dict(term_counts)
+        self.doc_term_count[doc_id] = total_terms
+        self.matrices.pop('terms', None)
 
     def load_lemmas_file(self, filepath, doc_id):
         lemmas_list = []
@@ -63,99 +82,220 @@ class TfIdfCalculator:
                 lemma = parts[0]
                 lemmas_list.append(lemma)
 
-        lemma_counter = Counter(lemmas_list)
-        self.lemma_freq[doc_id] = dict(lemma_counter)
-        self.doc_lemma_count[doc_id] = len(lemmas_list)
+        self.add_lemmas(doc_id, lemmas_list)
 
-        for lemma in set(lemmas_list):
-            self.docs_with_lemma[lemma] += 1
+    def add_lemmas(self, doc_id, lemmas_list):
+        self.add_lemma_counts(doc_id, Counter(lemmas_list), len(lemmas_list))
 
-    def collect_documents(self):
-        print("Сбор статистики по документам...")
+    def add_lemma_counts(self, doc_id, lemma_counts, total_lemmas):
+        self.lemma_freq[doc_id] = dict(lemma_counts)
+        self.doc_lemma_count[doc_id] = total_lemmas
+        self.matrices.pop('lemmas', None)
 
-        term_files = [f for f in os.listdir(self.tokens_dir) if f.endswith('.txt')]
-        term_files.sort()
-
-        for filename in term_files:
-            page_num = self.extract_page_number(filename)
-            if page_num is None:
-                continue
-
-            doc_id = page_num
-            self.doc_id_to_name[doc_id] = filename
+    def load_stream_file(self, filepath, doc_id):
+        """Настоящие частоты терминов и лемм из последовательности токенов hw2
+        (в tokens/ каждый токен записан один раз)"""
+        with TokenStream(filepath) as stream:
+            self.add_term_counts(doc_id, stream.term_counts(), len(stream))
+            self.add_lemma_counts(doc_id, stream.lemma_counts(), len(stream))
 
-            term_path = os.path.join(self.tokens_dir, filename)
-            self.load_terms_file(term_path, doc_id)
+    def collect_documents(self):
+        print("Сбор статистики по документам...")
 
-            lemma_path = os.path.join(self.lemmas_dir, filename)
-            if os.path.exists(lemma_path):
-                self.load_lemmas_file(lemma_path, doc_id)
+        for filename in self.document_files():
+            self.load_document(filename)
 
         self.total_docs = len(self.doc_id_to_name)
         print(f"Найдено документов: {self.total_docs}")
 
-    def calculate_idf(self, doc_count):
-        if doc_count == 0:
-            return 0
-        return math.log((self.total_docs + 1) / (doc_count + 1)) + 1
-
-    def calculate_tf(self, term_freq, total_terms):
-        if total_terms == 0:
-            return 0
-        return term_freq / total_terms
-
-    def process_terms(self):
-        print("\nПодсчет TF-IDF для терминов...")
-
-        for doc_id in self.doc_id_to_name.keys():
-            filename = self.doc_id_to_name[doc_id]
-            output_file = os.path.join(self.terms_output, filename)
-
-            total_terms = self.doc_term_count.get(doc_id, 0)
-            if total_terms == 0:
-                continue
-
-            with open(output_file, 'w', encoding='utf-8') as f:
-                for term, freq in self.term_freq.get(doc_id, {}).items():
-                    tf = self.calculate_tf(freq, total_terms)
-                    doc_count = self.docs_with_term.get(term, 0)
-                    idf = self.calculate_idf(doc_count)
-                    tf_idf = tf * idf
-                    f.write(f"{term} {idf:.6f} {tf_idf:.6f}\n")
-
-            print(f"  ✓ {filename}")
-
-    def process_lemmas(self):
-        print("\nПодсчет TF-IDF для лемм...")
-
-        for doc_id in self.doc_id_to_name.keys():
-            filename = self.doc_id_to_name[doc_id]
-            output_file = os.path.join(self.lemmas_output, filename)
-
-            total_lemmas = self.doc_lemma_count.get(doc_id, 0)
-            if total_lemmas == 0:
+    def document_files(self):
+        term_files = [f for f in os.listdir(self.tokens_dir) if f.endswith('.txt')]
+        return sorted(f for f in term_files if self.extract_page_number(f) is not None)
+
+    def stream_path(self, filename):
+        return os.path.join(self.positions_dir, os.path.splitext(filename)[0] + '.bin')
+
+    def load_document(self, filename):
+        doc_id = self.extract_page_number(filename)
+        self.doc_id_to_name[doc_id] = filename
+
+        stream_path = self.stream_path(filename)
+        if os.path.exists(stream_path):
+            self.load_stream_file(stream_path, doc_id)
+            return doc_id
+
+        term_path = os.path.join(self.tokens_dir, filename)
+        self.load_terms_file(term_path, doc_id)
+
+        lemma_path = os.path.join(self.lemmas_dir, filename)
+        if os.path.exists(lemma_path):
+            self.load_lemmas_file(lemma_path, doc_id)
+        return doc_id
+
+    def weight_matrix(self, kind):
+        """Матрица TF-IDF терминов ('terms') или лемм ('lemmas'): корпус
+        собирается в разреженную матрицу один раз, веса считаются над ней целиком"""
+        matrix = self.matrices.get(kind)
+        if matrix is not None and matrix.total_docs == self.total_docs:
+            return matrix
+
+        if kind == 'terms':
+            freq, lengths = self.term_freq, self.doc_term_count
+        else:
+            freq, lengths = self.lemma_freq, self.doc_lemma_count
+
+        matrix = TfIdfMatrix(freq, lengths, self.tf, self.idf, self.total_docs)
+        self.matrices[kind] = matrix
+        return matrix
+
+    def term_weights(self, doc_id):
+        """TF-IDF терминов документа: список (термин, idf, tf-idf)"""
+        return self.weight_matrix('terms').row(doc_id)
+
+    def lemma_weights(self, doc_id):
+        """TF-IDF лемм документа: список (лемма, idf, tf-idf)"""
+        return self.weight_matrix('lemmas').row(doc_id)
+
+    def combine_results(self, previous=None, stale=()):
+        """Частоты, длины документов и документные частоты терминов и лемм
+        всех документов. При инкрементальном пересчете загружены только
+        пересчитанные документы: строки остальных переносятся из прежнего
+        файла previous, а его документные частоты исправляются по строкам
+        документов stale (измененных и удаленных). Результат не ссылается на
+        массивы previous, так что его можно закрыть до записи"""
+        columns = {}
+        for kind in KINDS:
+            fresh = TfIdfColumns.from_matrix(self.weight_matrix(kind), self.tf, self.idf)
+            columns[kind] = combine(sorted(self.doc_id_to_name), fresh,
+                                    previous.columns.get(kind) if previous else None,
+                                    stale, self.tf, self.idf)
+        return columns
+
+    def save_results(self, columns=None):
+        """Записывает столбцы combine_results() в tfidf.bin за один проход"""
+        print("\nЗапись весов терминов и лемм...")
+        os.makedirs(self.output_dir, exist_ok=True)
+        if columns is None:
+            columns = self.combine_results()
+        write_tfidf_file(self.output_file, self.doc_id_to_name, columns,
+                         {'tf': self.tf, 'idf': self.idf})
+        print(f"Веса сохранены в {self.output_file}")
+
+    def export_text(self):
+        """Текстовые файлы terms/ и lemmas/ ("термин idf tf-idf" по строкам) из tfidf.bin - для отладки"""
+        with TfIdfFile(self.output_file) as tfidf:
+            self.write_text(tfidf.columns['terms'], tfidf.doc_names, self.terms_output)
+            self.write_text(tfidf.columns['lemmas'], tfidf.doc_names, self.lemmas_output)
+        print(f"Текстовые файлы записаны в {self.terms_output}/ и {self.lemmas_output}/")
+
+    def write_text(self, columns, doc_names, output_dir):
+        # Отдельный метод: строки файла (представления mmap) освобождаются
+        # при выходе из него, до закрытия файла
+        os.makedirs(output_dir, exist_ok=True)
+        for doc_id, filename in doc_names.items():
+            weights = columns.items(doc_id)
+            if not weights:
                 continue
-
-            with open(output_file, 'w', encoding='utf-8') as f:
-                for lemma, freq in self.lemma_freq.get(doc_id, {}).items():
-                    tf = self.calculate_tf(freq, total_lemmas)
-                    doc_count = self.docs_with_lemma.get(lemma, 0)
-                    idf = self.calculate_idf(doc_count)
-                    tf_idf = tf * idf
-                    f.write(f"{lemma} {idf:.6f} {tf_idf:.6f}\n")
-
-            print(f"  ✓ {filename}")
+            with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f:
+                f.write(''.join(f"{term} {idf:.6f} {tf_idf:.6f}\n" for term, idf, tf_idf in weights))
+
+    def add_document(self, doc_id, filename, terms, lemmas_list):
+        """Добавляет в статистику уже обработанный документ (без чтения файлов)"""
+        self.doc_id_to_name[doc_id] = filename
+        self.add_terms(doc_id, terms)
+        self.add_lemmas(doc_id, lemmas_list)
+        self.total_docs = len(self.doc_id_to_name)
 
     def run(self):
         self.collect_documents()
-        self.process_terms()
-        self.process_lemmas()
+        self.save_results()
         print(f"\nГотово! Результаты в папке {self.output_dir}/")
 
+    # ---------- инкрементальный пересчет ----------
+
+    def document_stamp(self, filename):
+        return file_stamp(os.path.join(self.tokens_dir, filename),
+                          os.path.join(self.lemmas_dir, filename),
+                          self.stream_path(filename))
+
+    def document_content(self, filename):
+        return read_files(os.path.join(self.tokens_dir, filename),
+                          os.path.join(self.lemmas_dir, filename),
+                          self.stream_path(filename))
+
+    def open_previous(self):
+        """Прежний файл весов для инкрементального пересчета (None - его нет
+        или он записан в другом формате)"""
+        if not os.path.exists(self.output_file):
+            return None
+        try:
+            return TfIdfFile(self.output_file, self.tf, self.idf)
+        except ValueError as e:
+            print(f"{e}, веса пересчитываются заново")
+            return None
+
+    def update(self, full=False):
+        """Пересчитывает частоты только новых и измененных документов: веса
+        в файле не хранятся, поэтому строки остальных документов переносятся
+        без изменений, а у документных частот меняются только счетчики
+        терминов измененных и удаленных документов - даже если изменилось
+        число документов. full - полный пересчет"""
+        # Формулы tf и idf применяются при чтении весов, от их смены строки не зависят
+        manifest = Manifest(self.manifest_file)
+        names = self.document_files()
+        previous = None if full or not manifest.entries else self.open_previous()
+        if previous is None:
+            manifest.clear()
+            self.run()
+            manifest.changes(names, self.document_stamp, self.document_content)
+            manifest.save()
+            return
+
+        try:
+            changed, removed = manifest.changes(names, self.document_stamp, self.document_content)
+            params = {'tf': self.tf, 'idf': self.idf}
+            if not changed and not removed and previous.params == params:
+                print("Изменений нет, результаты актуальны")
+                return
+
+            # Таблица документов - из прежнего файла, частоты загружаются
+            # только для новых и измененных документов
+            stale = {self.extract_page_number(f) for f in changed + removed}
+            self.doc_id_to_name = {doc_id: filename for doc_id, filename in previous.doc_names.items()
+                                   if doc_id not in stale}
+            for filename in changed:
+                self.load_document(filename)
+            self.total_docs = len(self.doc_id_to_name)
+
+            columns = self.combine_results(previous, stale)
+        finally:
+            # Прежний файл закрывается до записи нового на его место
+            previous.close()
+
+        self.save_results(columns)
+        manifest.save()
+        print(f"\nИзменено {len(changed)}, удалено {len(removed)}, "
+              f"пересчитано документов: {len(changed)} из {self.total_docs}")
+
 
 def main():
-    calculator = TfIdfCalculator()
-    calculator.run()
+    parser = argparse.ArgumentParser(description="Подсчет TF-IDF для терминов и лемм")
+    parser.add_argument('--incremental', action='store_true',
+                        help="пересчитать только документы, затронутые изменениями")
+    parser.add_argument('--tf', choices=list(TF_WEIGHTS), default='relative',
+                        help="формула tf: relative - доля слов документа, raw - частота, "
+                             "log - 1 + log(частота), binary - 1 (применяется при чтении весов)")
+    parser.add_argument('--idf', choices=list(IDF_WEIGHTS), default='smooth',
+                        help="формула idf: smooth - log((N + 1) / (df + 1)) + 1, "
+                             "plain - log(N / df), none - 1 (применяется при чтении весов)")
+    parser.add_argument('--export-text', action='store_true',
+                        help="дополнительно записать веса текстовыми файлами terms/ и lemmas/ (для отладки)")
+    args = parser.parse_args()
+
+    calculator = TfIdfCalculator(tf=args.tf, idf=args.idf)
+    calculator.update(full=not args.incremental)
+    if args.export_text:
+        calculator.export_text()
 
 
 if __name__ == "__main__":
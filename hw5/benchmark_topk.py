@@ -0,0 +1,164 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from collections import Counter
+from vector_search import VectorSearchEngine, RANKINGS
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.binary_index import write_vector_index
+from common.batch_search import read_queries
+
+# Слов в словаре темы синтетического корпуса
+TOPIC_TERMS = 50
+
+
+def build_synthetic_index(path, docs, vocabulary, doc_terms, topics, seed):
+    """Индекс из случайных документов: слова выбираются по закону Ципфа, как
+    в текстах (частые слова есть почти везде, редкие - в немногих
+    документах). Если topics больше нуля, у каждого документа есть тема:
+    десятая часть его слов - из словаря темы (TOPIC_TERMS редких слов)"""
+    rng = random.Random(seed)
+    terms, ranks = vocabulary_ranks(vocabulary)
+    topic_vocabularies = topic_terms(terms, topics, seed)
+
+    doc_counts, doc_lengths = {}, {}
+    for doc_id in range(1, docs + 1):
+        length = rng.randint(doc_terms // 2, doc_terms * 3 // 2)
+        words = []
+        if topic_vocabularies:
+            topic = rng.choice(topic_vocabularies)
+            words = rng.choices(topic, k=length // 10)
+        words += rng.choices(terms, ranks, k=length - len(words))
+        doc_counts[doc_id] = dict(Counter(words))
+        doc_lengths[doc_id] = length
+
+    titles = {doc_id: f"Документ {doc_id}" for doc_id in doc_counts}
+    files = {doc_id: f"page_{doc_id:03d}.txt" for doc_id in doc_counts}
+    write_vector_index(path, doc_counts, doc_lengths, titles, files)
+
+
+def vocabulary_ranks(vocabulary):
+    """Слова синтетического словаря и их веса по закону Ципфа"""
+    return [f"t{i}" for i in range(vocabulary)], [1 / (i + 1) for i in range(vocabulary)]
+
+
+def topic_terms(terms, topics, seed):
+    """Словари тем: по TOPIC_TERMS слов из редкой части словаря"""
+    rng = random.Random(seed + 2)
+    rare = terms[len(terms) // 50:]
+    return [rng.sample(rare, TOPIC_TERMS) for _ in range(topics)]
+
+
+def synthetic_queries(vocabulary, topics, count, length, seed):
+    """Запросы из слов с той же частотой, что и в документах; при темах
+    половина слов запроса - из словаря одной темы"""
+    rng = random.Random(seed + 1)
+    terms, ranks = vocabulary_ranks(vocabulary)
+    topic_vocabularies = topic_terms(terms, topics, seed)
+    queries = []
+    for _ in range(count):
+        query = []
+        if topic_vocabularies:
+            query = rng.sample(rng.choice(topic_vocabularies), length // 2)
+        queries.append(query + rng.choices(terms, ranks, k=length - len(query)))
+    return queries
+
+
+def matching_docs(engine, query_terms):
+    """Документы хотя бы с одним термином запроса (их оценивает полный перебор)"""
+    docs = set()
+    for term in set(query_terms):
+        docs.update(engine.term_to_docs.get(term, ()))
+    return len(docs)
+
+
+def run(engine, queries, top_k):
+    """Время и результаты запросов (без кэша)"""
+    results = []
+    start = time.perf_counter()
+    for query_terms in queries:
+        results.append(engine.rank(sorted(query_terms), top_k))
+    return time.perf_counter() - start, results
+
+
+def benchmark(index_file, queries, ranking, top_k):
+    exhaustive = VectorSearchEngine(index_file, ranking=ranking, pruning=False)
+    pruned = VectorSearchEngine(index_file, ranking=ranking, pruning=True)
+    exhaustive.load_index()
+    pruned.load_index()
+
+    full_time, expected = run(exhaustive, queries, top_k)
+    pruned_time, actual = run(pruned, queries, top_k)
+
+    matching = sum(matching_docs(exhaustive, query_terms) for query_terms in queries)
+    scored = pruned.pruning_stats.get('scored', 0)
+    same = sum(a == b for a, b in zip(expected, actual))
+    skipped = 1 - scored / matching if matching else 0.0
+
+    print(f"\n{ranking}: запросов {len(queries)}, top_k {top_k}")
+    print(f"  полный перебор: {full_time / len(queries) * 1000:.2f} мс на запрос")
+    print(f"  с отсечением:   {pruned_time / len(queries) * 1000:.2f} мс на запрос "
+          f"(быстрее в {full_time / pruned_time if pruned_time else 0:.1f} раза)")
+    print(f"  документов с терминами запроса: {matching}, досчитано: {scored}, "
+          f"пропущено {skipped:.1%}")
+    print(f"  результаты совпадают: {same} из {len(queries)}")
+    return same == len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Сравнение отбора top-k с отсечением и полного перебора")
+    parser.add_argument('--index-file', default='vector_index.bin')
+    parser.add_argument('--queries', metavar='FILE',
+                        help="запросы по строке (по умолчанию - случайные запросы "
+                             "из слов синтетического индекса)")
+    parser.add_argument('--ranking', choices=RANKINGS + ('all',), default='all')
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--synthetic-docs', type=int, default=0, metavar='N',
+                        help="построить синтетический индекс из N документов вместо --index-file")
+    parser.add_argument('--vocabulary', type=int, default=50000,
+                        help="слов в словаре синтетического индекса")
+    parser.add_argument('--doc-terms', type=int, default=300,
+                        help="средняя длина синтетического документа")
+    parser.add_argument('--topics', type=int, default=200,
+                        help="тем синтетического корпуса (0 - слова только по закону Ципфа)")
+    parser.add_argument('--query-terms', type=int, default=8,
+                        help="слов в синтетическом запросе")
+    parser.add_argument('--query-count', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    index_file = args.index_file
+    tmp_dir = None
+    if args.synthetic_docs:
+        tmp_dir = tempfile.TemporaryDirectory()
+        index_file = os.path.join(tmp_dir.name, 'vector_index.bin')
+        print(f"Построение синтетического индекса: {args.synthetic_docs} документов...")
+        build_synthetic_index(index_file, args.synthetic_docs, args.vocabulary,
+                              args.doc_terms, args.topics, args.seed)
+
+    if args.queries:
+        engine = VectorSearchEngine(index_file)
+        queries = [engine.preprocess_query(query) for query in read_queries(args.queries)]
+        queries = [query_terms for query_terms in queries if query_terms]
+    elif args.synthetic_docs:
+        queries = synthetic_queries(args.vocabulary, args.topics, args.query_count,
+                                    args.query_terms, args.seed)
+    else:
+        parser.error("для своего индекса нужен файл запросов --queries")
+
+    rankings = RANKINGS if args.ranking == 'all' else (args.ranking,)
+    try:
+        ok = all([benchmark(index_file, queries, ranking, args.top_k) for ranking in rankings])
+    finally:
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,46 @@
 import os
 import re
-import math
-import json
+import sys
+import argparse
 from collections import defaultdict, Counter
-import pymorphy3
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.page_store import open_pages
+from common.html_extract import clean_title, load_titles
+from common.manifest import Manifest, file_stamp
+from common.binary_index import VectorIndexFile, write_vector_index
+from common.tfidf_file import TfIdfFile
+from common.bm25 import K1, B
 
 class IndexBuilder:
-    """Класс для построения векторного индекса из TF-IDF файлов"""
+    """Класс для построения векторного индекса из весов TF-IDF (hw4)"""
 
     def __init__(self,
-                 tfidf_terms_dir='../hw4/tfidf_results/terms',
-                 tfidf_lemmas_dir='../hw4/tfidf_results/lemmas',
+                 tfidf_file='../hw4/tfidf_results/tfidf.bin',
                  pages_dir='../hw1/pages',
-                 index_file='vector_index.json'):
+                 index_file='vector_index.bin',
+                 titles_file='../hw2/titles.txt',
+                 k1=K1, b=B, tf='relative', idf='smooth'):
 
-        self.tfidf_terms_dir = tfidf_terms_dir
-        self.tfidf_lemmas_dir = tfidf_lemmas_dir
+        # Веса всех документов в одном файле, открывается через mmap на время построения
+        self.tfidf_file = tfidf_file
+        self.tfidf = None
         self.pages_dir = pages_dir
+        self.pages = open_pages(pages_dir)  # папка с HTML или сжатое хранилище
         self.index_file = index_file
-
-        self.morph = pymorphy3.MorphAnalyzer()
-
-        # Данные для поиска
-        self.doc_vectors = {}  # doc_id -> вектор (словарь терм->tfidf)
-        self.doc_norms = {}  # doc_id -> норма вектора
+        # Названия, полученные hw2 при разборе страниц (HTML повторно не читается)
+        self.titles = load_titles(titles_file)
+        # Параметры BM25: вклады пар (термин, документ) считаются при записи индекса
+        self.k1 = k1
+        self.b = b
+        # Формулы tf и idf (при обновлении - из файла весов): веса, их нормы
+        # и idf терминов считаются при записи индекса
+        self.tf = tf
+        self.idf = idf
+
+        # Данные для поиска: строки документов без idf
+        self.doc_counts = {}  # doc_id -> частоты терминов
+        self.doc_lengths = {}  # doc_id -> число слов документа
         self.doc_titles = {}  # doc_id -> название страницы
         self.doc_files = {}  # doc_id -> имя файла
         self.all_terms = set()  # все термины в индексе
@@ -38,117 +55,216 @@ class IndexBuilder:
             return int(match.group(1))
         return None
 
-    def load_tfidf_file(self, filepath, doc_id):
-        """Загружает TF-IDF файл и строит вектор документа"""
-        vector = {}
-
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                parts = line.split()
-                if len(parts) >= 3:
-                    term = parts[0]
-                    tfidf = float(parts[2])
-
-                    vector[term] = tfidf
-                    self.all_terms.add(term)
-                    self.term_to_docs[term].add(doc_id)
-
-        return vector
-
     def extract_title_from_html(self, html_file):
         """Извлекает название страницы из HTML файла"""
+        title = self.titles.get(os.path.splitext(os.path.basename(html_file))[0])
+        if title:
+            return title
         try:
-            with open(html_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-            title_match = re.search(r'<title>(.*?)</title>', content, re.IGNORECASE)
-            if title_match:
-                title = title_match.group(1)
-                title = re.sub(r'[-–—]\s*Википедия.*$', '', title).strip()
+            title = self.extract_title(self.pages.read(html_file))
+            if title:
                 return title
         except:
             pass
         return os.path.basename(html_file)
 
-    def calculate_norm(self, vector):
-        """Считает норму вектора"""
-        return math.sqrt(sum(val ** 2 for val in vector.values()))
-
-    def build(self):
-        """Строит индекс из TF-IDF файлов"""
-        print("Построение векторного индекса...")
+    def extract_title(self, content):
+        """Название страницы из HTML (без суффикса "- Википедия")"""
+        title_match = re.search(r'<title>(.*?)</title>', content, re.IGNORECASE)
+        if title_match:
+            return clean_title(title_match.group(1))
+        return None
 
-        # Получаем все TF-IDF файлы для терминов
-        term_files = [f for f in os.listdir(self.tfidf_terms_dir) if f.endswith('.txt')]
-        term_files.sort()
+    def tfidf_files(self):
+        return sorted(f for f in self.tfidf.doc_names.values()
+                      if self.extract_page_number(f) is not None)
 
-        print(f"Найдено файлов: {len(term_files)}")
+    def load_document(self, filename):
+        """Берет частоты документа из файла весов и добавляет его в индекс"""
+        doc_id = self.extract_page_number(filename)
 
-        for filename in term_files:
-            page_num = self.extract_page_number(filename)
-            if page_num is None:
-                continue
-
-            doc_id = page_num
+        # Частоты терминов и число слов документа
+        terms = self.tfidf.columns['terms']
+        term_counts = terms.term_counts(doc_id)
+        length = terms.length(doc_id)
 
-            # Загружаем вектор для терминов
-            term_path = os.path.join(self.tfidf_terms_dir, filename)
-            term_vector = self.load_tfidf_file(term_path, doc_id)
+        # Частоты лемм (если есть)
+        lemma_counts = None
+        lemmas = self.tfidf.columns.get('lemmas')
+        if lemmas is not None and doc_id in lemmas:
+            lemma_counts = lemmas.term_counts(doc_id)
 
-            # Загружаем вектор для лемм (если есть)
-            lemma_path = os.path.join(self.tfidf_lemmas_dir, filename)
-            if os.path.exists(lemma_path):
-                lemma_vector = self.load_tfidf_file(lemma_path, doc_id)
-                # Объединяем векторы - берем сумму значений
-                for lemma, val in lemma_vector.items():
-                    if lemma in term_vector:
-                        term_vector[lemma] = max(term_vector[lemma], val)
-                    else:
-                        term_vector[lemma] = val
+        # Пытаемся получить название из HTML
+        html_filename = filename.replace('.txt', '.html')
+        html_path = os.path.join(self.pages_dir, html_filename)
+        title = self.extract_title_from_html(html_path)
 
-            self.doc_vectors[doc_id] = term_vector
+        self.add_document(doc_id, filename, title, term_counts, lemma_counts, length)
 
-            # Сохраняем информацию о документе
-            self.doc_files[doc_id] = filename
+    def build(self):
+        """Строит индекс из файла весов TF-IDF"""
+        print("Построение векторного индекса...")
 
-            # Пытаемся получить название из HTML
-            html_filename = filename.replace('.txt', '.html')
-            html_path = os.path.join(self.pages_dir, html_filename)
-            self.doc_titles[doc_id] = self.extract_title_from_html(html_path)
+        # Документы из таблицы файла весов
+        term_files = self.tfidf_files()
+        print(f"Найдено документов: {len(term_files)}")
 
-            # Считаем норму вектора
-            self.doc_norms[doc_id] = self.calculate_norm(self.doc_vectors[doc_id])
+        for filename in term_files:
+            self.load_document(filename)
 
-        print(f"Индекс построен. Документов: {len(self.doc_vectors)}")
+        print(f"Индекс построен. Документов: {len(self.doc_counts)}")
         print(f"Уникальных терминов: {len(self.all_terms)}")
 
         # Сохраняем индекс
         self.save_index()
         return True
 
+    def document_stamp(self, filename):
+        # Отметка общего файла весов: после его перезаписи документы
+        # сравниваются по содержимому своих строк
+        return file_stamp(self.tfidf_file)
+
+    def document_content(self, filename):
+        # Хешируются частоты и длина документа без idf: изменение документных
+        # частот другими документами строку не меняет. Название входит в хеш:
+        # оно тоже хранится в индексе
+        doc_id = self.extract_page_number(filename)
+        title = self.titles.get(os.path.splitext(filename)[0], '')
+        content = b''.join(columns.row_bytes(doc_id) + b'\0'
+                           for columns in self.tfidf.columns.values())
+        return content + title.encode('utf-8')
+
+    def update(self, full=False):
+        """Обновляет сохраненный индекс: заменяются частоты только новых и
+        изменившихся документов, idf и нормы всех документов пересчитываются
+        при записи по новым документным частотам (full - построить индекс заново)"""
+        if not os.path.exists(self.tfidf_file):
+            print(f"Файл весов {self.tfidf_file} не найден, сначала запустите hw4/tf_idf.py")
+            return False
+
+        self.tfidf = TfIdfFile(self.tfidf_file)
+        self.tf, self.idf = self.tfidf.tf, self.tfidf.idf
+        try:
+            return self.update_from_tfidf(full)
+        finally:
+            self.tfidf.close()
+            self.tfidf = None
+
+    def update_from_tfidf(self, full):
+        """Обновление при открытом файле весов (self.tfidf)"""
+        # При смене параметров BM25 или формул весов индекс строится заново
+        manifest = Manifest(os.path.splitext(self.index_file)[0] + '.manifest.json',
+                            params={'k1': self.k1, 'b': self.b, 'tf': self.tf, 'idf': self.idf})
+        if full or not manifest.entries or not self.load_index():
+            manifest.clear()
+            self.build()
+            manifest.changes(self.tfidf_files(), self.document_stamp, self.document_content)
+            manifest.save()
+            return True
+
+        changed, removed = manifest.changes(self.tfidf_files(), self.document_stamp,
+                                            self.document_content)
+        if not changed and not removed:
+            print("Изменений нет, индекс актуален")
+            return True
+
+        for filename in changed + removed:
+            self.remove_document(self.extract_page_number(filename))
+        for filename in changed:
+            self.load_document(filename)
+
+        print(f"Индекс обновлен: изменено {len(changed)}, удалено {len(removed)}. "
+              f"Документов: {len(self.doc_counts)}")
+        self.save_index()
+        manifest.save()
+        return True
+
+    def remove_document(self, doc_id):
+        """Убирает строку документа из индекса"""
+        counts = self.doc_counts.pop(doc_id, None)
+        if counts is None:
+            return
+        for term in counts:
+            docs = self.term_to_docs.get(term)
+            if docs is None:
+                continue
+            docs.discard(doc_id)
+            if not docs:
+                del self.term_to_docs[term]
+                self.all_terms.discard(term)
+
+        self.doc_lengths.pop(doc_id, None)
+        self.doc_titles.pop(doc_id, None)
+        self.doc_files.pop(doc_id, None)
+
+    def load_index(self):
+        """Загружает сохраненный индекс для обновления"""
+        if not os.path.exists(self.index_file):
+            return False
+
+        try:
+            index = VectorIndexFile(self.index_file)
+        except ValueError as e:
+            # Индекс в другом формате или другой версии - строится заново
+            print(e)
+            return False
+
+        self.doc_counts = index.counts()
+        self.doc_lengths = {doc_id: index.doc_lengths[doc_id] for doc_id in index.documents}
+        self.doc_titles = index.doc_titles
+        self.doc_files = index.doc_files
+        self.all_terms = set()
+        self.term_to_docs = defaultdict(set)
+        for doc_id, counts in self.doc_counts.items():
+            for term in counts:
+                self.all_terms.add(term)
+                self.term_to_docs[term].add(doc_id)
+        index.close()
+        return True
+
+    def add_document(self, doc_id, filename, title, term_counts, lemma_counts=None, length=0):
+        """Добавляет в индекс частоты терминов и лемм документа и число его
+        слов (без чтения файлов): веса tf-idf, нормы и вклады BM25 считаются
+        по ним при записи индекса"""
+        # Объединяем частоты терминов и лемм - берем максимум
+        counts = dict(term_counts)
+        for lemma, count in (lemma_counts or {}).items():
+            counts[lemma] = max(counts.get(lemma, 0), count)
+
+        self.doc_counts[doc_id] = counts
+        self.doc_lengths[doc_id] = length
+        for term in counts:
+            self.all_terms.add(term)
+            self.term_to_docs[term].add(doc_id)
+
+        # Сохраняем информацию о документе
+        self.doc_files[doc_id] = filename
+        self.doc_titles[doc_id] = title
+
     def save_index(self):
         """Сохраняет индекс в файл"""
-        # Преобразуем для JSON
-        index_data = {
-            'doc_vectors': {str(k): v for k, v in self.doc_vectors.items()},
-            'doc_norms': {str(k): v for k, v in self.doc_norms.items()},
-            'doc_titles': {str(k): v for k, v in self.doc_titles.items()},
-            'doc_files': {str(k): v for k, v in self.doc_files.items()},
-            'all_terms': list(self.all_terms),
-            'term_to_docs': {k: list(v) for k, v in self.term_to_docs.items()}
-        }
-
-        with open(self.index_file, 'w', encoding='utf-8') as f:
-            json.dump(index_data, f, ensure_ascii=False, indent=2)
+        # Двоичный индекс: словарь терминов, обратный индекс (документы и tf
+        # термина), прямой индекс (термины и частоты документа), idf терминов
+        # и нормы в секциях, которые поиск читает через mmap
+        write_vector_index(self.index_file, self.doc_counts, self.doc_lengths,
+                           self.doc_titles, self.doc_files, self.k1, self.b,
+                           self.tf, self.idf)
 
         print(f"Индекс сохранен в {self.index_file}")
 
 
 def main():
-    builder = IndexBuilder()
-    builder.build()
+    parser = argparse.ArgumentParser(description="Построение векторного индекса")
+    parser.add_argument('--incremental', action='store_true',
+                        help="обновить сохраненный индекс только по изменившимся документам")
+    parser.add_argument('--k1', type=float, default=K1,
+                        help="BM25: насыщение частоты термина в документе")
+    parser.add_argument('--b', type=float, default=B,
+                        help="BM25: нормализация по длине документа (0 - без нормализации)")
+    args = parser.parse_args()
+
+    builder = IndexBuilder(k1=args.k1, b=args.b)
+    builder.update(full=not args.incremental)
 
 
 if __name__ == "__main__":
@@ -1,53 +1,116 @@
 import os
 import re
+import sys
 import math
-import json
-from collections import defaultdict
-import pymorphy3
+import time
+import heapq
+import argparse
+from functools import lru_cache
+from collections import defaultdict, Counter
+import numpy as np
 from index_builder import IndexBuilder
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.lemmatizer import Lemmatizer
+from common.binary_index import VectorIndexFile
+from common.manifest import file_stamp
+from common.query_cache import QueryCache
+from common.batch_search import read_queries, run_batch
+from common.topk import QueryTerm, block_max_top_k
+from common.weights import IDF_WEIGHTS, tf_values
+
+# Ранжирование: косинусное сходство векторов TF-IDF или BM25 по вкладам из индекса
+RANKINGS = ('cosine', 'bm25')
+
 class VectorSearchEngine:
     """Класс для поиска по векторному индексу"""
 
-    def __init__(self, index_file='vector_index.json'):
+    def __init__(self, index_file='vector_index.bin',
+                 dictionary_file='../hw2/lemma_dictionary.txt',
+                 cache_size=1024, cache_ttl=300.0, ranking='cosine', pruning=True):
+        if ranking not in RANKINGS:
+            raise ValueError(f"Неизвестное ранжирование: {ranking} (есть: {', '.join(RANKINGS)})")
         self.index_file = index_file
-        self.morph = pymorphy3.MorphAnalyzer()
+        self.ranking = ranking
+        # Отбор top-k с отсечением (common/topk.py); без него - полный перебор
+        # документов с терминами запроса, результаты одинаковые
+        self.pruning = pruning
+        self.pruning_stats = {}
+        # Словарь лемм из hw2: частые слова запроса не требуют разбора pymorphy3
+        self.lemmatizer = Lemmatizer(dictionary_file)
 
         # Данные будут загружены из индекса
+        self.index = None
         self.doc_vectors = {}
         self.doc_norms = {}
-        self.doc_titles = {}
-        self.doc_files = {}
         self.all_terms = set()
         self.term_to_docs = defaultdict(set)
+        self.term_postings = {}  # термин -> (документы, tf без idf)
+        self.index_stamp = None
+
+        # Результаты повторяющихся запросов; сбрасываются при перестройке индекса
+        self.cache = QueryCache(cache_size, cache_ttl)
 
     def load_index(self):
         """Загружает индекс из файла"""
         if not os.path.exists(self.index_file):
             return False
 
-        with open(self.index_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        previous = self.index
+        try:
+            # Файл открывается через mmap: векторы, нормы и списки документов
+            # читаются из секций индекса только при обращении
+            stamp = file_stamp(self.index_file)
+            self.index = VectorIndexFile(self.index_file)
+            self.index_stamp = stamp
+        except ValueError as e:
+            print(f"{e}, нужно построить индекс заново")
+            return False
 
-        self.doc_vectors = {int(k): v for k, v in data['doc_vectors'].items()}
-        self.doc_norms = {int(k): v for k, v in data['doc_norms'].items()}
-        self.doc_titles = {int(k): v for k, v in data['doc_titles'].items()}
-        self.doc_files = {int(k): v for k, v in data['doc_files'].items()}
-        self.all_terms = set(data['all_terms'])
-        self.term_to_docs = {k: set(v) for k, v in data['term_to_docs'].items()}
+        self.doc_vectors = self.index.doc_vectors
+        self.doc_norms = self.index.doc_norms
+        self.all_terms = self.index.terms
+        self.term_to_docs = self.index.term_to_docs
+        self.term_postings = self.index.term_postings
+        if previous is not None:
+            # Прежний файл закрывается, когда таблицы и кэш переключены на
+            # новый: иначе каждая перестройка оставляла бы открытыми mmap и
+            # дескриптор файла
+            self.cache.check_version(self.index_version)
+            previous.close()
 
         print(f"Индекс загружен. Документов: {len(self.doc_vectors)}")
         return True
 
-    def preprocess_query(self, query):
+    def refresh_index(self):
+        """Перезагружает индекс, если построитель записал новый файл"""
+        if self.index is not None and file_stamp(self.index_file) != self.index_stamp:
+            self.load_index()
+
+    @property
+    def index_version(self):
+        """Отметка сборки индекса (ключ актуальности кэша)"""
+        return self.index.file.build_id if self.index else None
+
+    # Названия и файлы документов читаются из индекса при первом обращении
+    @property
+    def doc_titles(self):
+        return self.index.doc_titles if self.index else {}
+
+    @property
+    def doc_files(self):
+        return self.index.doc_files if self.index else {}
+
+    def preprocess_query(self, query, lemmatize=None):
         """Обрабатывает запрос: токенизация и лемматизация"""
+        lemmatize = lemmatize or self.lemmatizer.lemmatize
         # Простая токенизация
         words = re.findall(r'\b[а-яА-ЯёЁa-zA-Z]+\b', query.lower())
 
         # Лемматизация
         lemmas = []
         for word in words:
-            lemma = self.morph.parse(word)[0].normal_form
+            lemma = lemmatize(word)
             lemmas.append(lemma)
 
         return lemmas
@@ -68,39 +131,27 @@ class VectorSearchEngine:
         if total_terms == 0:
             return {}
 
-        # Строим вектор запроса
+        # Строим вектор запроса по формулам tf и idf, с которыми построен индекс
         query_vector = {}
         for term, freq in term_freq.items():
             # TF для запроса
-            tf = freq / total_terms
-
-            # IDF берем из индекса (сглаживание)
-            doc_count = len(self.term_to_docs.get(term, []))
-            idf = math.log((len(self.doc_vectors) + 1) / (doc_count + 1)) + 1
+            tf = float(tf_values(freq, total_terms, self.index.weights['tf']))
 
-            # TF-IDF для запроса
-            query_vector[term] = tf * idf
+            # TF-IDF для запроса (idf документов умножается при оценке)
+            query_vector[term] = tf * self.query_idf(term)
 
         return query_vector
 
-    def cosine_similarity(self, query_vector, doc_id):
-        """Считает косинусное сходство между запросом и документом"""
-        doc_vector = self.doc_vectors[doc_id]
-
-        # Скалярное произведение
-        dot_product = 0
-        for term, q_val in query_vector.items():
-            if term in doc_vector:
-                dot_product += q_val * doc_vector[term]
-
-        # Нормы
-        query_norm = self.calculate_norm(query_vector)
-        doc_norm = self.doc_norms[doc_id]
-
-        if query_norm == 0 or doc_norm == 0:
-            return 0
-
-        return dot_product / (query_norm * doc_norm)
+    def query_idf(self, term):
+        """idf термина запроса: для термина из индекса - idf этой сборки. Термин
+        без документов входит в норму запроса со значением формулы при df = 0,
+        если оно конечно (smooth, none), иначе - с нулевым весом"""
+        if term in self.term_to_docs:
+            return self.index.idf(term)
+        idf_weight = IDF_WEIGHTS[self.index.weights['idf']]
+        with np.errstate(divide='ignore'):
+            idf = float(idf_weight(np.float64(0), len(self.doc_vectors)))
+        return idf if math.isfinite(idf) else 0.0
 
     def search(self, query, top_k=10):
         """Выполняет поиск по запросу"""
@@ -113,35 +164,166 @@ class VectorSearchEngine:
 
         print(f"Термы запроса: {query_terms}")
 
-        # Строим вектор запроса
+        self.refresh_index()
+        results, _ = self.lookup(query_terms, top_k)
+
+        print(f"Найдено результатов: {len(results)}")
+        # Копии: изменения результатов вызывающим кодом не попадут в кэш
+        return [dict(r) for r in results]
+
+    def lookup(self, query_terms, top_k):
+        """Результаты (из кэша или из индекса) и признак попадания в кэш"""
+        # Вектор запроса зависит только от набора лемм и их частот; леммы
+        # сортируются, чтобы и оценки не зависели от порядка слов в запросе
+        query_terms = sorted(query_terms)
+        key = (self.ranking, tuple(query_terms), top_k)
+        results = self.cache.get(key, self.index_version)
+        if results is not None:
+            return results, True
+        results = self.rank(query_terms, top_k)
+        self.cache.put(key, self.index_version, results)
+        return results, False
+
+    def search_many(self, queries, top_k=10):
+        """Пакет запросов без вывода на экран: для каждого - top_k документов
+        и время выполнения. Каждое слово лемматизируется один раз на весь
+        пакет, повторы запросов (с точностью до порядка слов) - из кэша"""
+        self.refresh_index()
+        lemmatize = lru_cache(maxsize=None)(self.lemmatizer.lemmatize)
+
+        records = []
+        for query in queries:
+            start = time.perf_counter()
+            query_terms = self.preprocess_query(query, lemmatize)
+            results, cached = self.lookup(query_terms, top_k) if query_terms else ([], False)
+            records.append({
+                'query': query,
+                'count': len(results),
+                'results': [dict(r) for r in results],
+                'latency_ms': (time.perf_counter() - start) * 1000,
+                'cached': cached,
+            })
+        return records
+
+    def rank(self, query_terms, top_k):
+        """Документы по убыванию оценки выбранного ранжирования"""
+        if self.ranking == 'bm25':
+            return self.rank_bm25(query_terms, top_k)
+        return self.rank_cosine(query_terms, top_k)
+
+    def result(self, doc_id, score):
+        return {
+            'doc_id': doc_id,
+            'title': self.doc_titles.get(doc_id, f"Документ {doc_id}"),
+            'file': self.doc_files.get(doc_id, f"page_{doc_id:03d}.txt"),
+            'score': score
+        }
+
+    def rank_bm25(self, query_terms, top_k):
+        """Документы по убыванию BM25: оценка - сумма заранее посчитанных
+        целых вкладов терминов запроса, без норм и деления"""
+        scale = self.index.bm25['scale']
+        query_freq = Counter(query_terms)
+        if self.pruning:
+            best = self.top_k_bm25(query_freq, top_k)
+            return [self.result(doc_id, total * scale) for doc_id, total in best]
+
+        scores = defaultdict(int)
+        for term, freq in query_freq.items():
+            docs, impacts = self.index.term_impacts(term)
+            for doc_id, impact in zip(docs, impacts):
+                scores[doc_id] += impact * freq
+
+        # При равных оценках - по возрастанию номера документа
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [self.result(doc_id, total * scale) for doc_id, total in best]
+
+    def rank_cosine(self, query_terms, top_k):
+        """Документы по убыванию косинусного сходства с запросом. Скалярные
+        произведения накапливаются по спискам документов терминов запроса
+        (термин за термином), так что затрагиваются только документы хотя бы
+        с одним термином запроса, а не весь корпус"""
+        # Строим вектор запроса; его норма считается один раз
         query_vector = self.query_to_vector(query_terms)
+        query_norm = self.calculate_norm(query_vector)
+        if query_norm == 0:
+            return []
+        if self.pruning:
+            best = self.top_k_cosine(query_vector, query_norm, top_k)
+            return [self.result(doc_id, score) for doc_id, score in best]
 
-        # Считаем сходство со всеми документами
+        # Скалярные произведения: слагаемые каждого документа складываются
+        # в порядке терминов запроса, как при обходе вектора запроса
+        dot_products = defaultdict(float)
+        for term, q_val in query_vector.items():
+            docs, tfs = self.term_postings.get(term, ((), ()))
+            # В индексе хранится tf без idf: idf документа умножается здесь, один
+            # раз на термин (в q_val - tf-idf самого запроса)
+            weight = q_val * self.index.idf(term)
+            for doc_id, tf in zip(docs, tfs):
+                dot_products[doc_id] += weight * tf
+
+        # Нормы документов посчитаны при записи индекса по его документным частотам
         similarities = []
-        for doc_id in self.doc_vectors.keys():
-            score = self.cosine_similarity(query_vector, doc_id)
+        for doc_id, dot_product in dot_products.items():
+            doc_norm = self.doc_norms[doc_id]
+            if doc_norm == 0:
+                continue
+            score = dot_product / (query_norm * doc_norm)
             if score > 0:
                 similarities.append((doc_id, score))
 
-        # Сортируем по убыванию
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        # Сортируем по убыванию (при равном сходстве - по номеру документа)
+        similarities.sort(key=lambda x: (-x[1], x[0]))
 
-        results = []
-        for doc_id, score in similarities[:top_k]:
-            results.append({
-                'doc_id': doc_id,
-                'title': self.doc_titles.get(doc_id, f"Документ {doc_id}"),
-                'file': self.doc_files.get(doc_id, f"page_{doc_id:03d}.txt"),
-                'score': score
-            })
+        return [self.result(doc_id, score) for doc_id, score in similarities[:top_k]]
 
-        print(f"Найдено результатов: {len(results)}")
-        return results
+    def top_k_bm25(self, query_freq, top_k):
+        """top_k документов по BM25 с отсечением по наибольшим вкладам терминов и блоков"""
+        terms = []
+        for term, freq in query_freq.items():
+            docs, impacts = self.index.term_impacts(term)
+            _, max_impact, block_last, _, block_impact = self.index.term_bounds(term)
+            terms.append(QueryTerm(docs, impacts, freq, max_impact, block_last, block_impact))
+
+        def finish(docs, totals):
+            return totals
+
+        return block_max_top_k(terms, top_k, finish, self.pruning_stats)
+
+    def top_k_cosine(self, query_vector, query_norm, top_k):
+        """top_k документов по косинусу с отсечением: граница вклада термина в
+        документы блока - наибольшее отношение tf к норме документа,
+        умноженное на idf и вес термина в запросе и деленное на норму
+        запроса. Скалярные произведения складываются в порядке терминов
+        запроса, как при полном переборе, поэтому оценки совпадают с ним до
+        последнего бита"""
+        terms = []
+        for term, q_val in query_vector.items():
+            docs, tfs = self.term_postings.get(term, ((), ()))
+            max_cosine, _, block_last, block_cosine, _ = self.index.term_bounds(term)
+            weight = q_val * self.index.idf(term)
+            terms.append(QueryTerm(docs, tfs, weight, max_cosine / query_norm, block_last,
+                                   np.asarray(block_cosine) / query_norm))
+
+        documents = np.asarray(self.index.documents)
+        norms = np.asarray(self.index.norms)
+
+        def finish(docs, dot_products):
+            # Документы с нулевой нормой не оцениваются, как при полном переборе
+            doc_norms = norms[np.searchsorted(documents, docs)]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.where(doc_norms != 0, dot_products / (query_norm * doc_norms), 0.0)
+
+        return block_max_top_k(terms, top_k, finish, self.pruning_stats)
 
     def interactive_mode(self):
         """Интерактивный режим поиска"""
-        print("ВЕКТОРНЫЙ ПОИСК (TF-IDF + косинусное сходство)")
-        print("Для выхода: exit\n")
+        if self.ranking == 'bm25':
+            print("ВЕКТОРНЫЙ ПОИСК (BM25)")
+        else:
+            print("ВЕКТОРНЫЙ ПОИСК (TF-IDF + косинусное сходство)")
+        print("Статистика кэша: stats, для выхода: exit\n")
 
         while True:
             query = input(">> ").strip()
@@ -149,6 +331,11 @@ class VectorSearchEngine:
                 break
             if not query:
                 continue
+            if query.lower() == 'stats':
+                print(f"Кэш: {self.cache.stats()}")
+                if self.pruning_stats:
+                    print(f"Отсечение top-k: {self.pruning_stats}")
+                continue
 
             results = self.search(query)
             if results:
@@ -159,19 +346,54 @@ class VectorSearchEngine:
                 print("Ничего не найдено")
 
 def main():
-    searcher = VectorSearchEngine()
+    parser = argparse.ArgumentParser(description="Векторный поиск (TF-IDF + косинусное сходство)")
+    parser.add_argument('--index-file', default='vector_index.bin')
+    parser.add_argument('--queries', metavar='FILE',
+                        help="выполнить запросы из файла (по строке на запрос, '-' - stdin) "
+                             "и записать результаты в JSONL")
+    parser.add_argument('--output', help="файл для результатов (по умолчанию stdout)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="процессов для пакетного поиска")
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--ranking', choices=RANKINGS, default='cosine',
+                        help="cosine - косинусное сходство векторов TF-IDF, bm25 - сумма "
+                             "вкладов BM25 из индекса (k1 и b задаются при построении)")
+    parser.add_argument('--exhaustive', action='store_true',
+                        help="оценивать все документы с терминами запроса (без отсечения top-k)")
+    args = parser.parse_args()
+
+    # В пакетном режиме stdout занят результатами, сообщения - в stderr
+    stdout = sys.stdout
+    if args.queries:
+        sys.stdout = sys.stderr
+
+    searcher = VectorSearchEngine(args.index_file, ranking=args.ranking,
+                                  pruning=not args.exhaustive)
 
     if not searcher.load_index():
         print("Индекс не найден. Запускаем построение...")
 
         builder = IndexBuilder()
-        if builder.build():
+        if builder.update(full=True):
             searcher.load_index()
         else:
             print("Не удалось построить индекс")
             return
 
-    searcher.interactive_mode()
+    if not args.queries:
+        searcher.interactive_mode()
+        return
+
+    queries = read_queries(args.queries)
+    output = open(args.output, 'w', encoding='utf-8') if args.output else stdout
+    try:
+        run_batch(searcher, queries, output, args.workers,
+                  {'index_file': args.index_file, 'ranking': args.ranking,
+                   'pruning': not args.exhaustive},
+                  {'top_k': args.top_k})
+    finally:
+        if output is not stdout:
+            output.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,225 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'hw1'))
+
+from crawler import get_url_list, load_url_file
+from async_crawler import AsyncPageCrawler
+
+
+def load_stage(name, path):
+    """Загружает модуль этапа по пути (в hw3 и hw5 модули называются одинаково,
+    а text-processor.py нельзя импортировать обычным import)"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+text_processor = load_stage('text_processor', 'hw2/text-processor.py')
+boolean_index = load_stage('boolean_index_builder', 'hw3/index_builder.py')
+tf_idf = load_stage('tf_idf', 'hw4/tf_idf.py')
+vector_index = load_stage('vector_index_builder', 'hw5/index_builder.py')
+
+
+# ---------- этап обработки текста (в отдельных процессах) ----------
+
+worker_processor = None
+
+
+def init_worker(extractor='bs4', wiki=False):
+    global worker_processor
+    # Словарь лемм пайплайн не сохраняет: новые слова держит только LRU-кэш
+    worker_processor = text_processor.TextProcessor(extractor=extractor, wiki=wiki,
+                                                    record_lemmas=False)
+
+
+def process_page(html):
+    """Все токены страницы, их леммы, номера слов и название (за один разбор HTML)"""
+    _, _, title, occurrences = worker_processor.process_html(html)
+    terms = [term for term, _, _ in occurrences]
+    lemmas = [worker_processor.lemmatizer.lemmatize(term) for term in terms]
+    positions = [position for _, position, _ in occurrences]
+    return terms, lemmas, positions, title
+
+
+class StreamingCrawler(AsyncPageCrawler):
+    """Краулер, который передает скачанные страницы в очередь пайплайна"""
+
+    def __init__(self, pages_queue, keep_pages=False, **kwargs):
+        super().__init__(**kwargs)
+        self.pages_queue = pages_queue
+        self.keep_pages = keep_pages
+
+    async def handle_page(self, status, page_number, url, headers, html):
+        if status == 304:
+            # Страница не изменилась - переиндексировать нечего
+            return
+        if self.keep_pages:
+            self.store_page(page_number, url, headers, html)
+        else:
+            self.add_to_index(page_number, url)
+        # put ждет, если обработка не успевает: так работает backpressure
+        await self.pages_queue.put((page_number, url, html, time.monotonic()))
+
+
+class StreamingPipeline:
+    """Потоковый пайплайн: загрузка -> токенизация и лемматизация ->
+    булев индекс (hw3) и TF-IDF (hw4) -> векторный индекс (hw5).
+    Этапы связаны ограниченными очередями, промежуточные файлы не пишутся."""
+
+    def __init__(self, workers=None, queue_size=32, checkpoint_every=0,
+                 boolean_index_file='../hw3/inverted_index.bin',
+                 vector_index_file='../hw5/vector_index.bin',
+                 extractor='bs4', wiki=False,
+                 **crawler_options):
+        self.workers = workers or os.cpu_count() or 1
+        self.extractor = extractor
+        self.wiki = wiki
+        self.queue_size = queue_size
+        self.checkpoint_every = checkpoint_every
+        self.boolean_index_file = boolean_index_file
+        self.vector_index_file = vector_index_file
+        self.crawler_options = crawler_options
+
+        self.boolean_builder = boolean_index.IndexBuilder()
+        self.calculator = tf_idf.TfIdfCalculator()
+
+        self.indexed = 0
+        self.total_latency = 0.0
+
+    async def process_stage(self, executor, pages_queue, docs_queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await pages_queue.get()
+            if item is None:
+                await docs_queue.put(None)
+                return
+
+            page_number, url, html, fetched_at = item
+            terms, lemmas, positions, title = await loop.run_in_executor(executor, process_page, html)
+            title = title or f"page_{page_number:03d}.html"
+            await docs_queue.put((page_number, title, terms, lemmas, positions, fetched_at))
+
+    async def index_stage(self, docs_queue):
+        finished = 0
+        while finished < self.workers:
+            item = await docs_queue.get()
+            if item is None:
+                finished += 1
+                continue
+
+            page_number, title, terms, lemmas, positions, fetched_at = item
+            filename = f"page_{page_number:03d}.txt"
+            # TF-IDF считается по всем вхождениям, как из последовательностей токенов hw2;
+            # номера слов нужны булеву индексу для фраз и NEAR
+            self.boolean_builder.add_document(page_number, filename, title, set(lemmas),
+                                              zip(lemmas, positions))
+            self.calculator.add_document(page_number, filename, terms, lemmas)
+
+            self.indexed += 1
+            self.total_latency += time.monotonic() - fetched_at
+            print(f"✓ {filename}: {len(set(terms))} токенов, {len(set(lemmas))} лемм")
+
+            if self.checkpoint_every and self.indexed % self.checkpoint_every == 0:
+                # Снимок индексов пишется в потоке, загрузка и обработка
+                # страниц тем временем продолжаются
+                await asyncio.to_thread(self.save_indexes)
+
+    def build_vector_index(self):
+        # Построитель hw5 хранит частоты без idf, веса считаются при записи индекса
+        builder = vector_index.IndexBuilder(index_file=self.vector_index_file,
+                                            tf=self.calculator.tf, idf=self.calculator.idf)
+        for doc_id, filename in self.calculator.doc_id_to_name.items():
+            title = self.boolean_builder.id_to_title[doc_id]
+            builder.add_document(doc_id, filename, title,
+                                 self.calculator.term_freq[doc_id], self.calculator.lemma_freq[doc_id],
+                                 self.calculator.doc_term_count[doc_id])
+        return builder
+
+    def save_indexes(self):
+        """Сохраняет булев и векторный индексы (контрольная точка)"""
+        print(f"Контрольная точка: документов в индексе {self.indexed}")
+        self.boolean_builder.save(self.boolean_index_file)
+        self.build_vector_index().save_index()
+
+    async def run_async(self, urls):
+        pages_queue = asyncio.Queue(maxsize=self.queue_size)
+        docs_queue = asyncio.Queue(maxsize=self.queue_size)
+        crawler = StreamingCrawler(pages_queue, **self.crawler_options)
+
+        urls, crawler.downloaded = crawler.start_crawl(crawler.filter_urls(urls))
+        executor = ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                       initargs=(self.extractor, self.wiki))
+        with executor:
+            processors = [asyncio.create_task(self.process_stage(executor, pages_queue, docs_queue))
+                          for _ in range(self.workers)]
+            indexer = asyncio.create_task(self.index_stage(docs_queue))
+
+            try:
+                await crawler.crawl_async(urls)
+            finally:
+                crawler.finish_crawl()
+                for _ in processors:
+                    await pages_queue.put(None)
+                await asyncio.gather(*processors)
+                await indexer
+
+    def run(self, urls):
+        start = time.monotonic()
+        asyncio.run(self.run_async(urls))
+        self.save_indexes()
+
+        elapsed = time.monotonic() - start
+        print(f"\nПайплайн завершен за {elapsed:.1f} с. Документов в индексе: {self.indexed}")
+        if self.indexed:
+            print(f"Средняя задержка от загрузки до индекса: {self.total_latency / self.indexed:.2f} с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Потоковый пайплайн: краулинг -> индексы hw3/hw5")
+    parser.add_argument('--urls', help="файл со списком URL (по умолчанию - список из hw1)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="процессов для обработки текста (по умолчанию - число ядер)")
+    parser.add_argument('--queue-size', type=int, default=32,
+                        help="размер очередей между этапами")
+    parser.add_argument('--checkpoint-every', type=int, default=0,
+                        help="сохранять индексы каждые N документов (0 - только в конце)")
+    parser.add_argument('--keep-pages', metavar='STORE_DIR',
+                        help="дополнительно сохранять страницы в сжатое хранилище")
+    parser.add_argument('--extractor', choices=['bs4', 'fast'], default='bs4',
+                        help="извлечение текста: bs4 (BeautifulSoup) или fast (потоковый разбор)")
+    parser.add_argument('--wiki', action='store_true',
+                        help="брать только текст статьи Википедии (без навигации и сносок)")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--host-rate', type=float, default=1.0)
+    parser.add_argument('--host-burst', type=int, default=1)
+    parser.add_argument('--boolean-index', default='../hw3/inverted_index.bin')
+    parser.add_argument('--vector-index', default='../hw5/vector_index.bin')
+    args = parser.parse_args()
+
+    urls = load_url_file(args.urls) if args.urls else get_url_list()
+
+    pipeline = StreamingPipeline(workers=args.workers,
+                                 queue_size=args.queue_size,
+                                 checkpoint_every=args.checkpoint_every,
+                                 boolean_index_file=args.boolean_index,
+                                 vector_index_file=args.vector_index,
+                                 extractor=args.extractor,
+                                 wiki=args.wiki,
+                                 keep_pages=bool(args.keep_pages),
+                                 store_dir=args.keep_pages,
+                                 concurrency=args.concurrency,
+                                 host_rate=args.host_rate,
+                                 host_burst=args.host_burst)
+    pipeline.run(urls)
+
+
+if __name__ == "__main__":
+    main()